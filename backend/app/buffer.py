@@ -1,23 +1,464 @@
-import random
-from collections import deque
+import json, mmap, os
+from pathlib import Path
+import numpy as np
+import torch
+
+FIELDS = ("obs", "act", "rew", "next_obs", "done")
+PRIOR_FIELD = "prior"  # store_prior=True で追加する列（収集時の Prior 行動。未記録の行は NaN）
+META_FILE = "meta.json"
 
 class ReplayBuffer:
     """
-    単純な経験再生バッファ
+    構造体配列（SoA）形式のリングバッファ
     - 各エージェントごとに独立に持つ（局所Qを前提）
-    - 要素: (obs, act, rew, next_obs, done)
+    - 要素: (obs, act, rew, next_obs, done) をフィールドごとの連続 float32 配列に格納
+    - 配列は最初の push で次元を確定して確保。容量までは倍々で拡張し、以降はリングとして上書き
+      （1遷移あたりのメモリは固定: nbytes_per_transition）
+    - sample はフィールドごとに1回のファンシーインデックスで収集し、
+      C連続の float32 配列を返す（torch.from_numpy でコピーなしにラップ可能）
+    - path を与えるとディスク常駐モード（np.memmap）
+      - フィールドごとに {path}/{field}.f32 を容量分確保（疎ファイルなので書いた分だけディスクを使う）
+      - push は RAM 上のステージング領域に溜め、chunk_bytes 程度（ページ境界に揃えた行数）ごとに
+        連続スライスとしてまとめて書き込む。よく読む領域はOSのページキャッシュが保持する
+      - flush() で未書き込み分とメタ情報（ptr/size/形状）を保存し、同じ path で作り直すと再開できる
+    - store_prior=True なら act と同じ形の prior 列を持ち、push(..., prior=) で収集時の Prior 行動を記録する
+      （sample は末尾に prior を足した6要素を返す。prior を渡さなかった行は NaN）
+    - shapes（フィールド名 → 1行の形）を与えると、ディスクから再開するときに meta.json の形・dtype と照合し、
+      食い違えば ValueError（別構成のリプレイを同じ path で開いて、学習途中の push で壊れるのを防ぐ）
     """
-    def __init__(self, capacity:int):
-        self.buf = deque(maxlen=capacity)
+    def __init__(self, capacity:int, seed=None, path=None, chunk_bytes:int=1 << 20, store_prior:bool=False,
+                 shapes:dict=None):
+        self.capacity = capacity
+        self.fields = FIELDS + (PRIOR_FIELD,) if store_prior else FIELDS
+        self.shapes = shapes
+        self.ptr = 0      # 次の書き込み位置
+        self.size = 0     # 格納済み遷移数
+        self.data = None  # フィールド名 → (rows, *shape) float32 配列（ディスクモードでは np.memmap）
+        self.rng = np.random.default_rng(seed)
+        self.path = Path(path) if path is not None else None
+        self.chunk_bytes = chunk_bytes
+        self.stage = None       # ディスクモードのステージング領域 フィールド名 → (chunk_rows, *shape)
+        self.stage_start = 0    # ステージ先頭が書き込まれる行
+        self.n_staged = 0
+        if self.path is not None and (self.path / META_FILE).exists():
+            self._open()
+
+    def _alloc(self, rows:int, shapes:dict):
+        """rows 行分の配列を確保し、既存データがあれば先頭にコピー"""
+        if self.path is not None:
+            self._create_files(shapes)
+            return
+        new = {k: np.zeros((rows, *shapes[k]), dtype=np.float32) for k in self.fields}
+        if self.data is not None:
+            for k in self.fields:
+                new[k][:self.size] = self.data[k][:self.size]
+        self.data = new
+
+    def push(self, obs, act, rew, next_obs, done, prior=None):
+        # 各要素を float32 配列にして、ptr の行へ書き込む（rew/done は長さ1のベクトル）
+        act = np.asarray(act, dtype=np.float32)
+        self._write({
+            "obs": np.asarray(obs, dtype=np.float32),
+            "act": act,
+            "rew": np.asarray(rew, dtype=np.float32).reshape(-1),
+            "next_obs": np.asarray(next_obs, dtype=np.float32),
+            "done": np.asarray(done, dtype=np.float32).reshape(-1),
+            **self._prior_row(prior, act.shape),
+        })
+
+    def _prior_row(self, prior, shape) -> dict:
+        """prior 列の1行分（列がなければ空、prior=None なら NaN）"""
+        if PRIOR_FIELD not in self.fields:
+            return {}
+        if prior is None:
+            return {PRIOR_FIELD: np.full(shape, np.nan, dtype=np.float32)}
+        return {PRIOR_FIELD: np.asarray(prior, dtype=np.float32).reshape(shape)}
 
-    def push(self, *transition):
-        # transition はタプルで受け取り、そのまま保管
-        self.buf.append(transition)
+    def _write(self, row:dict):
+        """整形済みの1行（フィールド名 → 配列）を ptr に書き込む"""
+        if self.data is None:
+            self._alloc(min(self.capacity, 1024), {k: v.shape for k, v in row.items()})
+        rows = len(self.data["obs"])
+        if self.ptr == rows and rows < self.capacity:
+            self._alloc(min(self.capacity, rows * 2), {k: v.shape[1:] for k, v in self.data.items()})
+        if self.stage is not None:
+            # ディスクモード: ステージングに溜め、満杯になったらまとめて書き出す
+            for k in self.fields:
+                self.stage[k][self.n_staged] = row[k]
+            self.n_staged += 1
+        else:
+            for k in self.fields:
+                self.data[k][self.ptr] = row[k]
+        self.ptr = (self.ptr + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        if self.stage is not None and self.n_staged == len(self.stage["obs"]):
+            self._write_stage()
+
+    def _gather(self, idx, *rest):
+        """data[k][idx, *rest] をフィールドごとに収集（未書き出しの行はステージングから補う）"""
+        out = tuple(self.data[k][(idx, *rest)] for k in self.fields)
+        if self.n_staged:
+            off = (idx - self.stage_start) % self.capacity
+            staged = off < self.n_staged
+            if staged.any():
+                sel = (off[staged], *(np.broadcast_to(r, idx.shape)[staged] for r in rest))
+                for k, a in zip(self.fields, out):
+                    a[staged] = self.stage[k][sel]
+        return out
 
     def sample(self, batch_size:int):
-        # ランダムに batch_size 件サンプルし、zipで列方向にまとめて返す
-        batch = random.sample(self.buf, batch_size)
-        return list(zip(*batch))
+        # 一様ランダム（復元抽出）に batch_size 件選び、フィールドごとに1回で収集
+        idx = self.rng.integers(0, self.size, size=batch_size)
+        return self._gather(idx)
+
+    # ---- ディスク常駐モード（np.memmap） ----
+
+    def _create_files(self, shapes:dict):
+        """容量分の memmap ファイルとステージング領域を作る"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.data = {k: np.memmap(self.path / f"{k}.f32", dtype=np.float32, mode="w+",
+                                  shape=(self.capacity, *shapes[k])) for k in self.fields}
+        self._init_stage()
+        self._save_meta()
+
+    def _open(self):
+        """既存の memmap ファイルとメタ情報から再開"""
+        meta = json.loads((self.path / META_FILE).read_text())
+        if meta["capacity"] != self.capacity:
+            raise ValueError(f"replay capacity mismatch: {meta['capacity']} on disk, {self.capacity} requested")
+        shapes = meta["shapes"]
+        if meta.get("dtype", "float32") != "float32":
+            raise ValueError(f"replay dtype mismatch: {meta['dtype']} on disk, float32 expected")
+        if self.shapes is not None:
+            bad = {k: (shapes[k], list(self.shapes[k])) for k in self.fields
+                   if k in shapes and k in self.shapes and list(shapes[k]) != list(self.shapes[k])}
+            if bad:
+                detail = ", ".join(f"{k}: {a} on disk, {b} requested" for k, (a, b) in bad.items())
+                raise ValueError(f"replay shape mismatch ({detail})")
+        if PRIOR_FIELD in self.fields and PRIOR_FIELD not in shapes:
+            # prior 列なしで作られたリプレイ: 列を足し、既存の行は「未記録」（NaN）にする
+            shapes[PRIOR_FIELD] = shapes["act"]
+            prior = np.memmap(self.path / f"{PRIOR_FIELD}.f32", dtype=np.float32, mode="w+",
+                              shape=(self.capacity, *shapes["act"]))
+            prior[:meta["size"]] = np.nan
+            prior.flush()
+        self.data = {k: np.memmap(self.path / f"{k}.f32", dtype=np.float32, mode="r+",
+                                  shape=(self.capacity, *shapes[k])) for k in self.fields}
+        self.ptr, self.size = meta["ptr"], meta["size"]
+        self._init_stage()
+
+    def _init_stage(self):
+        """
+        ステージングの行数を決める: chunk_bytes 程度で、obs の書き込み量がページサイズの倍数になる行数
+        （チャンク境界がページ境界に揃い、書き出しが部分ページを跨がない）
+        """
+        row_bytes = self.data["obs"][0].nbytes
+        align = mmap.PAGESIZE // np.gcd(mmap.PAGESIZE, row_bytes)
+        rows = max(1, -(-self.chunk_bytes // sum(a[0].nbytes for a in self.data.values())))
+        rows = min(self.capacity, -(-rows // align) * align)
+        self.stage = {k: np.zeros((rows, *a.shape[1:]), dtype=np.float32) for k, a in self.data.items()}
+        self.stage_start = self.ptr
+        self.n_staged = 0
+
+    def _write_stage(self):
+        """ステージングの行を memmap へ連続スライスで書き出す（容量端で折り返す場合は2回）"""
+        m, s = self.n_staged, self.stage_start
+        head = min(m, self.capacity - s)
+        for k in self.fields:
+            self.data[k][s:s + head] = self.stage[k][:head]
+            if head < m:
+                self.data[k][:m - head] = self.stage[k][head:m]
+        self.stage_start = self.ptr
+        self.n_staged = 0
+
+    def _save_meta(self):
+        meta = {"capacity": self.capacity, "ptr": self.ptr, "size": self.size, "dtype": "float32",
+                "shapes": {k: list(a.shape[1:]) for k, a in self.data.items()}}
+        tmp = self.path / f"{META_FILE}.tmp"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.path / META_FILE)
+
+    def flush(self):
+        """ディスクモード: 未書き出しの行を書き込み、ディスクへ同期してメタ情報を保存（RAMモードでは何もしない）"""
+        if self.stage is None:
+            return
+        self._write_stage()
+        for a in self.data.values():
+            a.flush()
+        self._save_meta()
+
+    @property
+    def nbytes_per_transition(self) -> int:
+        """1遷移あたりのバイト数（未確保なら0）"""
+        if self.data is None:
+            return 0
+        return sum(a[0].nbytes for a in self.data.values())
 
     def __len__(self):
-        return len(self.buf)
+        return self.size
+
+
+class JointReplayBuffer(ReplayBuffer):
+    """
+    全エージェントの1ステップ分を1行として持つ結合リプレイバッファ
+    - push は環境1ステップにつき1回: obs/next_obs (n_agents, obs_dim), act (n_agents, act_dim),
+      rew/done はスカラー（全員共通）または (n_agents,)
+    - sample(): 同じ時刻を全エージェント分まとめて返す（各フィールド (B, n_agents, dim)）
+    - sample_agents(): エージェントごとに独立な時刻を返す（各フィールド (n_agents, B, dim)）
+    - store_prior=True なら prior (n_agents, act_dim) も1行に持つ
+    """
+    def __init__(self, capacity:int, n_agents:int, seed=None, **kw):
+        super().__init__(capacity, seed=seed, **kw)
+        self.n_agents = n_agents
+
+    def push(self, obs, act, rew, next_obs, done, prior=None):
+        n = self.n_agents
+        act = np.asarray(act, dtype=np.float32)
+        self._write({
+            "obs": np.asarray(obs, dtype=np.float32),
+            "act": act,
+            "rew": np.broadcast_to(np.asarray(rew, dtype=np.float32).reshape(-1, 1), (n, 1)),
+            "next_obs": np.asarray(next_obs, dtype=np.float32),
+            "done": np.broadcast_to(np.asarray(done, dtype=np.float32).reshape(-1, 1), (n, 1)),
+            **self._prior_row(prior, act.shape),
+        })
+
+    def sample_agents(self, batch_size:int):
+        # エージェントごとに独立な時刻 idx (n_agents, B) を選び、(行, エージェント) で一括収集
+        idx = self.rng.integers(0, self.size, size=(self.n_agents, batch_size))
+        agent = np.arange(self.n_agents)[:, None]
+        return self._gather(idx, agent)
+
+
+class CompactReplayBuffer(JointReplayBuffer):
+    """
+    観測を1回だけ保存する結合リプレイバッファ（JointReplayBuffer と同じ push / sample インターフェース）
+    - 観測は1本のフレームリング frames（容量+1行）に置く。累積 g 番目の遷移の obs はフレーム g、
+      next_obs はフレーム g+1（push 時に先に書いておき、次の push の obs が同じ値ならそのまま共有）
+    - エピソード境界（次の push の obs が直前の next_obs と異なる）では、直前遷移の next_obs を
+      term に退避してからフレームを新しい obs で上書きする（境界はエピソードに1回なので少量）
+    - obs_dtype=np.float16 でフレームを半精度保存し、sample 時に float32 へ戻す
+    - ディスク常駐（path）とは併用しない
+    """
+    def __init__(self, capacity:int, n_agents:int, seed=None, obs_dtype=np.float32, store_prior:bool=False):
+        super().__init__(capacity, n_agents, seed=seed, store_prior=store_prior)
+        self.obs_dtype = np.dtype(obs_dtype)
+        self.frames = None      # (rows, n_agents, obs_dim) obs_dtype
+        self.fidx = np.zeros(capacity, dtype=np.int64)   # 遷移スロット → obs のフレーム番号
+        self.is_term = np.zeros(capacity, dtype=bool)    # next_obs を term から取る遷移
+        self.term = {}          # 遷移スロット → 境界での next_obs (n_agents, obs_dim) float32
+        self.n_pushed = 0       # 累積 push 数 g
+        self._pending = None    # 直近遷移の next_obs（境界判定用の float32 コピー）
+
+    @staticmethod
+    def _upcast(a:np.ndarray) -> np.ndarray:
+        """float32 へ変換（float16→float32 は numpy の astype より torch の変換が数倍速い）"""
+        if a.dtype == np.float32:
+            return a
+        return torch.from_numpy(a).float().numpy()
+
+    @staticmethod
+    def _grow(a:np.ndarray, rows:int) -> np.ndarray:
+        new = np.zeros((rows, *a.shape[1:]), dtype=a.dtype)
+        new[:len(a)] = a
+        return new
+
+    def push(self, obs, act, rew, next_obs, done, prior=None):
+        n, cap = self.n_agents, self.capacity
+        obs = np.asarray(obs, dtype=np.float32)
+        next_obs = np.asarray(next_obs, dtype=np.float32)
+        if self.frames is None:
+            self.frames = np.zeros((min(cap + 1, 1024), *obs.shape), dtype=self.obs_dtype)
+            self.data = {"act": np.zeros((min(cap, 1024), *np.shape(act)), dtype=np.float32),
+                         "rew": np.zeros((min(cap, 1024), n, 1), dtype=np.float32),
+                         "done": np.zeros((min(cap, 1024), n, 1), dtype=np.float32)}
+            if PRIOR_FIELD in self.fields:
+                self.data[PRIOR_FIELD] = np.zeros((min(cap, 1024), *np.shape(act)), dtype=np.float32)
+        g, s = self.n_pushed, self.ptr
+        # 容量に達するまでは倍々で拡張（フレームは g+1 行目まで書く。cap+1 行に達したらリングとして使い回す）
+        if len(self.frames) < cap + 1 and g + 2 > len(self.frames):
+            self.frames = self._grow(self.frames, min(cap + 1, 2 * len(self.frames)))
+        if s >= len(self.data["act"]):
+            self.data = {k: self._grow(a, min(cap, 2 * len(a))) for k, a in self.data.items()}
+
+        # 上書きされるスロットの退避分を破棄
+        if self.is_term[s]:
+            del self.term[s]
+            self.is_term[s] = False
+        f = g % (cap + 1)
+        if self._pending is None or not np.array_equal(obs, self._pending):
+            # 境界: フレーム f は直前遷移の next_obs なので退避してから obs を書く
+            if self._pending is not None:
+                prev = (s - 1) % cap
+                self.term[prev] = self._pending
+                self.is_term[prev] = True
+            self.frames[f] = obs
+        self.frames[(g + 1) % (cap + 1)] = next_obs
+        self.fidx[s] = f
+        self.data["act"][s] = act
+        self.data["rew"][s] = np.asarray(rew, dtype=np.float32).reshape(-1, 1)
+        self.data["done"][s] = np.asarray(done, dtype=np.float32).reshape(-1, 1)
+        for k, v in self._prior_row(prior, np.shape(act)).items():
+            self.data[k][s] = v
+        self._pending = next_obs.copy()
+
+        self.n_pushed += 1
+        self.ptr = (s + 1) % cap
+        self.size = min(self.size + 1, cap)
+
+    def _gather(self, idx, *rest):
+        f = self.fidx[idx]
+        obs = self._upcast(self.frames[(f, *rest)])
+        nxt = self._upcast(self.frames[((f + 1) % (self.capacity + 1), *rest)])
+        # 境界の遷移だけ term から next_obs を補う
+        m = self.is_term[idx]
+        if m.any():
+            pos = np.nonzero(m)
+            agents = [np.broadcast_to(r, idx.shape)[pos] for r in rest]
+            for j, s in enumerate(idx[pos]):
+                nxt[tuple(p[j] for p in pos)] = self.term[int(s)][tuple(a[j] for a in agents)]
+        act, rew, done = (self.data[k][(idx, *rest)] for k in ("act", "rew", "done"))
+        if PRIOR_FIELD in self.fields:
+            return obs, act, rew, nxt, done, self.data[PRIOR_FIELD][(idx, *rest)]
+        return obs, act, rew, nxt, done
+
+    @property
+    def nbytes_per_transition(self) -> int:
+        """1遷移あたりのバイト数（フレーム1枚 + act/rew/done + 索引。境界の退避分は含まない）"""
+        if self.frames is None:
+            return 0
+        return self.frames[0].nbytes + sum(a[0].nbytes for a in self.data.values()) \
+            + self.fidx.itemsize + self.is_term.itemsize
+
+
+class SumTree:
+    """
+    配列表現の和木（n_trees 本を並べて1つの配列に持つ）
+    - tree[:, 1] が根（総和）、葉 j は tree[:, P + j]。ノード k の子は 2k, 2k+1
+    - update / find はバッチ単位で、木の深さ（log2 P）回のベクトル演算だけで処理
+    - 葉数 P は書き込み位置に合わせて倍々で拡張
+    """
+    def __init__(self, n_trees:int=1):
+        self.n_trees = n_trees
+        self.P = 1
+        self.tree = np.zeros((n_trees, 2), dtype=np.float64)
+
+    @property
+    def total(self) -> np.ndarray:
+        """各木の総和 (n_trees,)"""
+        return self.tree[:, 1]
+
+    def _grow(self, n:int):
+        """葉数を n 以上の2冪に拡張し、内部ノードを下の段から再計算"""
+        P = self.P
+        while P < n:
+            P *= 2
+        if P == self.P:
+            return
+        leaves = self.tree[:, self.P:]
+        self.tree = np.zeros((self.n_trees, 2 * P), dtype=np.float64)
+        self.tree[:, P:P + leaves.shape[1]] = leaves
+        self.P = P
+        lo = P // 2
+        while lo >= 1:
+            self.tree[:, lo:2 * lo] = self.tree[:, 2 * lo:4 * lo:2] + self.tree[:, 2 * lo + 1:4 * lo:2]
+            lo //= 2
+
+    def _rows(self, idx:np.ndarray) -> np.ndarray:
+        return np.broadcast_to(np.arange(self.n_trees).reshape(-1, *[1] * (idx.ndim - 1)), idx.shape)
+
+    def get(self, idx:np.ndarray) -> np.ndarray:
+        """葉 idx (n_trees, m) の値"""
+        return self.tree[self._rows(idx), idx + self.P]
+
+    def update(self, idx, prio):
+        """
+        葉 idx の値を prio にし、根までの経路を段ごとにまとめて再計算
+        idx / prio は (n_trees, m) に broadcast（(m,) なら全ての木に同じ値）
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        self._grow(int(idx.max()) + 1)
+        shape = np.broadcast_shapes((self.n_trees, idx.shape[-1]), np.shape(prio))
+        idx = np.broadcast_to(idx, shape)
+        # 平坦化した配列上のインデックス（木 r のノード k → r*2P + k）で扱う
+        flat = self.tree.reshape(-1)
+        base = self._rows(idx) * (2 * self.P)
+        k = idx + self.P
+        flat[base + k] = np.broadcast_to(prio, shape)  # 重複インデックスは後勝ち
+        for _ in range(self.P.bit_length() - 1):
+            k = k // 2
+            flat[base + k] = flat[base + 2 * k] + flat[base + 2 * k + 1]
+
+    def find(self, u:np.ndarray) -> np.ndarray:
+        """
+        累積和が u を超える最初の葉を返す（u: (n_trees, B), 0 ≤ u < total）
+        根から葉まで、左の子の和と比べて左右を選ぶ降下を全要素同時に行う
+        """
+        u = np.array(u, dtype=np.float64)
+        flat = self.tree.reshape(-1)
+        base = self._rows(u) * (2 * self.P)
+        k = np.ones(u.shape, dtype=np.int64)
+        for _ in range(self.P.bit_length() - 1):
+            left = flat[base + 2 * k]
+            right = u >= left
+            u -= left * right
+            k = 2 * k + right
+        return k - self.P
+
+
+class PrioritizedReplay:
+    """
+    優先度付き経験再生（JointReplayBuffer / CompactReplayBuffer に被せて使う）
+    - エージェントごとの優先度 (|δ|+eps)^α を n_agents 本の SumTree に持つ
+    - sample_agents: 総和を B 等分した各区間から1点ずつ（層化抽出）を全エージェント同時に引き、
+      (batch, idx, weights) を返す。weights は IS 重み (N·P(i))^-β をエージェントごとにバッチ内最大で正規化
+    - update_priorities: Critic の TD 誤差 (n_agents, B) で葉をまとめて更新
+    - 新しい遷移はその時点の最大優先度で入れる。β は beta_steps 回の抽出で 1 へ線形に近づける
+    - その他の属性（flush, n_agents など）は元のバッファに委譲
+    """
+    def __init__(self, buffer:JointReplayBuffer, alpha:float=0.6, beta:float=0.4,
+                 beta_steps:int=100_000, eps:float=1e-3):
+        self.buffer = buffer
+        self.alpha, self.beta0, self.beta_steps, self.eps = alpha, beta, beta_steps, eps
+        self.tree = SumTree(buffer.n_agents)
+        self.max_prio = 1.0
+        self.n_sampled = 0
+        if len(buffer):
+            # ディスクから再開したバッファは一様な優先度から始める
+            self.tree.update(np.arange(len(buffer)), self.max_prio)
+
+    def __getattr__(self, name):
+        return getattr(self.buffer, name)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def beta(self) -> float:
+        return min(1.0, self.beta0 + (1.0 - self.beta0) * self.n_sampled / self.beta_steps)
+
+    def push(self, obs, act, rew, next_obs, done, prior=None):
+        s = self.buffer.ptr
+        self.buffer.push(obs, act, rew, next_obs, done, prior=prior)
+        self.tree.update(np.array([s]), self.max_prio)
+
+    def sample_agents(self, batch_size:int):
+        n, size = self.buffer.n_agents, len(self.buffer)
+        # 丸め誤差で優先度 0 の葉に着地すると P=0 → 重み inf → 損失 NaN になるので、
+        # 優先度は更新で取り得る最小値 eps^α（eps=0 なら極小値）で下から抑える
+        floor = max(self.eps ** self.alpha, 1e-12)
+        total = np.maximum(self.tree.total[:, None], floor)
+        u = (np.arange(batch_size) + self.buffer.rng.random((n, batch_size))) / batch_size * total
+        idx = np.minimum(self.tree.find(u), size - 1)
+        p = np.maximum(self.tree.get(idx), floor) / total
+        w = (size * p) ** -self.beta
+        w /= w.max(axis=1, keepdims=True)
+        self.n_sampled += 1
+        batch = self.buffer._gather(idx, np.arange(n)[:, None])
+        return batch, idx, w.astype(np.float32)
+
+    def update_priorities(self, idx:np.ndarray, td_error:np.ndarray):
+        """idx, td_error: (n_agents, B)"""
+        prio = (np.abs(td_error) + self.eps) ** self.alpha
+        self.tree.update(idx, prio)
+        self.max_prio = max(self.max_prio, float(prio.max()))
@@ -1,119 +1,146 @@
 import numpy as np
-from .shapes import grid_mask
+from .shapes import get_shape_index
+from .observation import build_observations
+from .spatial import SpatialHash, VerletList, OccupancyGrid
+from .metrics import StreamingMetrics
+from .snapshot import SwarmSnapshot
 
 class SwarmEnv:
     """
     群ロボットの2Dグリッド環境（形状組立タスク）
     - 位置/速度の連続空間を離散グリッドに重ねて扱う
     - 観測は局所（近傍ロボ/目標セル/未占有セル）で固定次元に整形
+    - 近傍探索は空間ハッシュ（neighbor_mode="hash"）か Verlet リスト（"verlet"）
+    - stream_metrics=True なら毎ステップ増分メトリクス（self.metrics）を更新（再問い合わせは metrics_budget_ms 以内）
     """
-    def __init__(self, shape="circle", grid_size=64, n_robot=30, r_sense=0.4, r_avoid=0.1, nhn=6, nhc=80, l_cell=1.0, dt=0.05, seed=0):
+    def __init__(self, shape="circle", grid_size=64, n_robot=30, r_sense=0.4, r_avoid=0.1, nhn=6, nhc=80, l_cell=1.0, dt=0.05, seed=0,
+                 neighbor_mode="hash", verlet_skin=1.0, stream_metrics=True, metrics_budget_ms=1.0):
         # パラメータ保持
         self.shape = shape; self.grid_size = grid_size
         self.n = n_robot; self.rs = r_sense; self.ra = r_avoid
         self.nhn = nhn; self.nhc = nhc; self.lc = l_cell; self.dt = dt
         self.rng = np.random.default_rng(seed)
-        # 形状マスク生成（1=形状セル）
-        self.mask = grid_mask(shape, grid_size)
+        # 形状インデックス（プロセス内キャッシュ）と形状マスク（1=形状セル）
+        self.shape_index = get_shape_index(shape, grid_size)
+        self.mask = self.shape_index.mask
         # 質量（全ロボ1.0）
         self.m = np.ones(self.n, dtype=np.float32)
+        # 近傍半径/衝突閾値（グリッド座標換算）
+        # rs は物理m想定。グリッド座標に換算するため grid_size/8 でスケール（経験的）
+        self.r_neigh = self.rs * self.grid_size/8
+        self.r_col = max(1.0, 2*self.ra * self.grid_size/16)
+        # 占有半径（coverage_m1 と同じしきい値）
+        self.r_occ = max(1.0, self.ra * self.grid_size/4)
+        # 近傍インデックス（位置更新のたびに1回だけ更新し、観測/状態辞書/衝突判定で共有）
+        # verlet: 速度上限 3.0 * dt 程度しか動かないので、候補リストを数ステップ使い回す
+        r_cut = max(self.r_neigh, self.r_col)
+        if neighbor_mode == "hash":
+            self.index = SpatialHash(grid_size, r_cut)
+        elif neighbor_mode == "verlet":
+            self.index = VerletList(grid_size, r_cut, verlet_skin)
+        else:
+            raise ValueError("unknown neighbor_mode")
+        # 占有グリッド（step ごとに差分更新。観測/状態辞書/メトリクスが O(n) で参照）
+        self.occ = OccupancyGrid(grid_size, self.r_occ, region=self.shape_index.lookup)
+        self._knn_p = None; self._knn = None
         # 初期化
+        self.metrics = None
         self.reset()
+        # 増分メトリクス（報酬 DSL を毎ステップ評価するため）
+        if stream_metrics:
+            self.metrics = StreamingMetrics(self, budget_ms=metrics_budget_ms, seed=seed)
 
     def reset(self):
         """
         初期位置/速度を形状近傍に置く（ランダム）
         - 収束を速めるため、形状セル付近にノイズ付きで散布
         """
-        ys, xs = np.where(self.mask == 1)
-        idx = self.rng.choice(len(xs), self.n, replace=True)
-        px = xs[idx] + self.rng.normal(0, 2.0, size=self.n)
-        py = ys[idx] + self.rng.normal(0, 2.0, size=self.n)
+        si = self.shape_index
+        idx = self.rng.choice(si.n_cells, self.n, replace=True)
+        px = si.xs[idx] + self.rng.normal(0, 2.0, size=self.n)
+        py = si.ys[idx] + self.rng.normal(0, 2.0, size=self.n)
         self.p = np.stack([px, py], axis=1).astype(np.float32)      # 位置 (n,2)
         self.v = self.rng.normal(0, 0.1, size=(self.n, 2)).astype(np.float32)  # 速度 (n,2)
+        self.index.build(self.p)
+        self.occ.reset(self.p)
+        if self.metrics is not None:
+            self.metrics.reset()
         return self.observe()
 
+    def free_cells(self):
+        """占有されていない形状セルの番号（ShapeIndex.cells の行番号）"""
+        si = self.shape_index
+        return np.flatnonzero(~self.occ.occupied(si.xs, si.ys))
+
+    def occupancy_coverage(self):
+        """占有グリッドから読む被覆率（差分更新済みのカウンタを読むだけ: O(1)）"""
+        return self.occ.n_covered / max(self.shape_index.n_cells, 1)
+
     def observe(self):
-        """全ロボット分の観測ベクトルを返す。"""
-        obs = []
-        for i in range(self.n):
-            oi = self._obs_i(i)
-            obs.append(oi)
-        return np.array(obs, dtype=np.float32)
+        """
+        全ロボット分の観測ベクトルを (n, obs_dim) で返す。
+        - ロボットごとのループを持たないバッチ版（レイアウトは _obs_i と同一）
+        """
+        nb_idx, _, nb_valid = self.neighbors()
+        return build_observations(self.p, self.v, nb_idx, nb_valid, self.shape_index.cells,
+                                  self.nhn, self.nhc, self.rng, free=self.free_cells())
     
+    def shape_distance(self):
+        """
+        全ロボットの形状までの符号付き距離 (n,) と勾配 (n,2) を SDF から一括参照
+        - 形状内は負、外は正。-grad 方向が形状へ「入る」向き
+        """
+        return self.shape_index.distance(self.p)
+
+    def neighbor_stats(self):
+        """近傍インデックスの再構築統計（updates / rebuilds / rebuild_rate）"""
+        return self.index.stats()
+
+    def neighbors(self):
+        """
+        現在位置での k 近傍 (nb_idx, nb_d2, nb_valid)
+        - 同じ位置配列に対する結果をキャッシュ（step 末尾の observe と次ステップの snapshot で共有）
+        """
+        if self._knn_p is not self.p:
+            self._knn = self.index.knn(self.nhn, self.r_neigh)
+            self._knn_p = self.p
+        return self._knn
+
+    def snapshot(self, cells:bool=True):
+        """
+        群全体の状態を列指向の SwarmSnapshot で返す（Prior / 報酬 / SSE / LLM プロンプト共通の入力）
+        - 近傍は neighbors() のキャッシュを使う
+        - cells=True なら近傍セルを形状セルからランダムに nhc 個（全ロボット共通）選び、占有は占有グリッドから参照
+          （SSE など位置と近傍だけ使う場合は cells=False で乱数を消費しない）
+        """
+        si = self.shape_index
+        k2 = min(self.nhc, si.n_cells) if cells else 0
+        sel = self.rng.choice(si.n_cells, size=k2, replace=False) if k2 > 0 else np.zeros(0, dtype=np.int64)
+        nb_idx, nb_d2, nb_valid = self.neighbors()
+        cell_xy = np.stack([si.xs[sel], si.ys[sel]], axis=1).astype(np.float32)
+        occupied = self.occ.occupied(si.xs[sel], si.ys[sel])
+        return SwarmSnapshot(self.p, self.v, nb_idx, nb_valid, cell_xy, occupied, si.center,
+                             nb_dist=np.sqrt(nb_d2))
+
     def get_state_dicts(self):
         """
         LLM Prior Policy計算用の状態辞書リストを構築
         各ロボットについて、位置、速度、目標中心、近傍ロボット、近傍セルの情報を含む
+        （互換用。snapshot() の遅延ビューで、辞書はアクセスされたロボット分だけ作る）
         
         Returns:
-            List[Dict]: 各ロボットの状態辞書のリスト
+            StateDictView: 各ロボットの状態辞書のシーケンス
         """
-        # 形状の中心を計算（キャッシュ化）
-        ys, xs = np.where(self.mask == 1)
-        if len(xs) > 0:
-            target_center = np.array([xs.mean(), ys.mean()], dtype=np.float32)
-        else:
-            target_center = np.array([self.grid_size / 2, self.grid_size / 2], dtype=np.float32)
-        
-        # 近傍セルをランダムサンプリング（全ロボット共通）
-        k2 = min(self.nhc, len(xs))
-        nearby_cell_indices = self.rng.choice(len(xs), size=k2, replace=False) if k2 > 0 else []
-        
-        # 距離計算用の閾値（事前計算）
-        max_dist_sq = (self.rs * self.grid_size/8) ** 2
-        occupy_dist = self.ra * 2
-        
-        state_dicts = []
-        for i in range(self.n):
-            # 近傍ロボットの情報を収集（最適化済み）
-            rel = self.p - self.p[i]
-            dist_sq = (rel**2).sum(axis=1)
-            idx = np.argsort(dist_sq)
-            
-            neighbors = []
-            cnt = 0
-            for j in idx[1:]:  # 自己除外
-                if dist_sq[j] <= max_dist_sq and cnt < self.nhn:
-                    neighbors.append({
-                        "position": self.p[j].tolist(),
-                        "velocity": self.v[j].tolist(),
-                        "distance": float(np.sqrt(dist_sq[j]))
-                    })
-                    cnt += 1
-            
-            # 近傍セル（形状セル）の情報（最適化: ベクトル化）
-            nearby_cells = []
-            if k2 > 0:
-                cell_positions = np.stack([xs[nearby_cell_indices], ys[nearby_cell_indices]], axis=1).astype(np.float32)
-                # 全ロボットとの距離を一度に計算（ベクトル化）
-                dists = np.linalg.norm(self.p[:, None, :] - cell_positions[None, :, :], axis=2)
-                occupied = (dists < occupy_dist).any(axis=0)
-                
-                for s_idx, occ in zip(nearby_cell_indices, occupied):
-                    nearby_cells.append({
-                        "position": [float(xs[s_idx]), float(ys[s_idx])],
-                        "occupied": bool(occ)
-                    })
-            
-            state_dict = {
-                "position": self.p[i].tolist(),
-                "velocity": self.v[i].tolist(),
-                "target_center": target_center.tolist(),
-                "neighbors": neighbors,
-                "nearby_cells": nearby_cells
-            }
-            state_dicts.append(state_dict)
-        
-        return state_dicts
+        return self.snapshot().state_dicts()
 
     def _obs_i(self, i):
         """
         エージェント i の観測を作る（固定長）
+        ※ 参照実装（スカラー版）。通常は observe() のバッチ版を使用
           - 自身(6): pos(x,y), vel(x,y), n近傍数, 乱数タグ(2) *簡易*
           - 近傍 nhn: 相対pos(2) + 相対vel(2) → 計4 * nhn
           - 目標セル(2): マスクからランダム1点の相対位置
-          - 未占有セル(2*nhc): マスクからランダム抽出（簡略）
+          - 未占有セル(2*nhc): 占有グリッドで未占有の形状セルからランダム抽出
         """
         # 自身状態（6）: 最後の2つは簡易タグ（将来拡張用のダミー）
         self_state = np.array([*self.p[i], *self.v[i], 0, 0], dtype=np.float32)
@@ -134,13 +161,14 @@ class SwarmEnv:
         neigh += [0.0] * (4*self.nhn - len(neigh))
 
         # 目標セル（ランダム1点）: 相対ベクトル
-        ys, xs = np.where(self.mask == 1)
+        xs, ys = self.shape_index.xs, self.shape_index.ys
         k = self.rng.integers(0, len(xs))
         tgt = np.array([xs[k]-self.p[i,0], ys[k]-self.p[i,1]], dtype=np.float32)
 
-        # 未占有セル: 厳密には「未占有」を検知していない簡略版（負荷軽減のため）
-        k2 = min(self.nhc, len(xs))
-        sel = self.rng.choice(len(xs), size=k2, replace=False)
+        # 未占有セル: 占有グリッドで未占有の形状セルから抽出
+        free = self.free_cells()
+        k2 = min(self.nhc, len(free))
+        sel = free[self.rng.choice(len(free), size=k2, replace=False)]
         unocc = []
         for s in sel:
             unocc += [xs[s]-self.p[i,0], ys[s]-self.p[i,1]]
@@ -161,7 +189,7 @@ class SwarmEnv:
           - 入力 actions: [-1,1] の力ベクトル（n,2）
           - 速度/位置を semi-implicit Euler で更新
           - 簡易衝突（2*ra 未満）で反発
-        戻り: (観測, 衝突ペアリスト)
+        戻り: (観測, 衝突ペア (k,2) int 配列)
         """
         # 能動力（スケーリングは1.0で固定。必要に応じて調整可）
         fa = np.clip(actions, -1.0, 1.0) * 1.0
@@ -176,34 +204,27 @@ class SwarmEnv:
 
         # 領域外クランプ
         self.p = np.clip(self.p, 0, self.grid_size-1)
+        # 占有グリッドの差分更新（セルが変わったロボットのみ）
+        self.occ.update(self.p)
 
         # 簡易衝突: 2*ra 未満 → 反発（速度に小さな押し出しを加える）
-        # パフォーマンス改善: ベクトル化による最適化
-        col_pairs = []
-        thr = max(1.0, 2*self.ra * self.grid_size/16)  # グリッドスケール換算の閾値
+        # 空間ハッシュで r_col 以内のペアだけ列挙（(n,n) の距離行列を作らない）
+        self.index.build(self.p)
+        i_idx, j_idx, d2 = self.index.query_pairs(self.r_col)
+        # query_pairs は「以内」なので、厳密に閾値未満のペアのみ採用
+        hit = d2 < self.r_col**2
+        col_pairs = np.stack([i_idx[hit], j_idx[hit]], axis=1).astype(np.int64)  # (k,2)
         
-        # 全ペア間の距離を一度に計算（ベクトル化）
-        diff = self.p[:, None, :] - self.p[None, :, :]  # (n, n, 2)
-        dist = np.linalg.norm(diff, axis=2)  # (n, n)
-        
-        # 上三角行列のみ処理（i < j のペアのみ）
-        i_idx, j_idx = np.triu_indices(self.n, k=1)
-        collision_mask = dist[i_idx, j_idx] < thr
-        
-        if collision_mask.any():
-            # 衝突しているペアのインデックス
-            collision_i = i_idx[collision_mask]
-            collision_j = j_idx[collision_mask]
-            
-            # 衝突ペアをリストに追加
-            col_pairs = list(zip(collision_i.tolist(), collision_j.tolist()))
-            
-            # 衝突時の反発力を一括計算
-            for i, j in col_pairs:
-                d = dist[i, j]
-                dir_vec = diff[i, j] / (d + 1e-6)
-                self.v[i] += dir_vec * 0.2
-                self.v[j] -= dir_vec * 0.2
+        if len(col_pairs) > 0:
+            # 衝突時の反発力を一括加算（同じロボットが複数ペアに出る場合も np.add.at で累積）
+            ci, cj = col_pairs[:, 0], col_pairs[:, 1]
+            dir_vec = (self.p[ci] - self.p[cj]) / (np.sqrt(d2[hit])[:, None] + 1e-6)
+            imp = (dir_vec * 0.2).astype(self.v.dtype)
+            np.add.at(self.v, ci, imp)
+            np.add.at(self.v, cj, -imp)
+
+        if self.metrics is not None:
+            self.metrics.update(col_pairs)
 
         obs = self.observe()
         return obs, col_pairs
@@ -3,11 +3,12 @@ LAMARL LLM Module
 JSON-DSLベースの安全な関数生成モジュール
 """
 
-from .dsl_runtime import build_prior_fn, build_reward_fn
+from .dsl_runtime import build_prior_fn, build_prior_fn_vec, build_reward_fn
 from .client import generate_prior_reward_dsl
 
 __all__ = [
     "build_prior_fn",
+    "build_prior_fn_vec",
     "build_reward_fn",
     "generate_prior_reward_dsl",
 ]
@@ -62,6 +62,7 @@ Available Reward Metrics:
 - coverage: Ratio of occupied target cells (0-1, higher is better)
 - uniformity: Variance of Voronoi regions (0-1, lower is better)
 - collisions: Number of collision pairs (0+, lower is better)
+- share: Robot's fraction of the Voronoi cells (0-1, 1/n on average)
 
 Reward formula must use only: +, -, *, /, abs(), min(), max(), clamp()
 """
@@ -78,7 +79,7 @@ def build_user_prompt(
     
     Args:
         task_description: タスクの自然言語記述
-        env_params: 環境パラメータ
+        env_params: 環境パラメータ（"swarm_state" に SwarmSnapshot.summary() を渡すと現在の群の状態も含める）
         use_cot: Chain-of-Thought推論を有効化
         use_basic_apis: Basic API仕様を含める
     
@@ -96,6 +97,13 @@ Environment Parameters:
 - Max cells observed: {env_params.get('n_hc', 80)}
 """
 
+    # 現在の群の状態（SwarmSnapshot.summary() の集約値）があれば添える
+    swarm_state = env_params.get("swarm_state")
+    if swarm_state:
+        prompt += "\nCurrent Swarm State:\n"
+        prompt += "".join(f"- {k}: {v:.3g}\n" if isinstance(v, float) else f"- {k}: {v}\n"
+                          for k, v in swarm_state.items())
+
     if use_cot:
         prompt += """
 First, analyze the task step-by-step:
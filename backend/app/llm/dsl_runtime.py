@@ -6,6 +6,8 @@ DSL Runtime: JSON-DSL → 実行可能な関数への変換
 import numpy as np
 from typing import Callable, Dict, Any
 
+from ..snapshot import SwarmSnapshot
+
 
 # ==================== State型定義 ====================
 
@@ -189,6 +191,107 @@ def build_prior_fn(prior_dsl: dict) -> Callable:
     return prior_policy
 
 
+# ==================== Prior Policy（配列版）====================
+
+def _unit_or_zero(vec: np.ndarray) -> np.ndarray:
+    """各行を正規化（ノルム < 1e-6 の行はゼロ）"""
+    norm = np.linalg.norm(vec, axis=1, keepdims=True)
+    return np.where(norm < 1e-6, 0.0, vec / np.maximum(norm, 1e-6))
+
+
+def _neighbor_mean(s: SwarmSnapshot, x: np.ndarray) -> np.ndarray:
+    """近傍の x の平均 (n,2)（近傍なしの行はゼロ）"""
+    total = (x[s.nb_idx] * s.nb_valid[:, :, None]).sum(axis=1)
+    return total / np.maximum(s.n_neighbors, 1)[:, None]
+
+
+def vop_move_to_shape_center(s: SwarmSnapshot, weight: float, **kwargs) -> np.ndarray:
+    """形状中心への引力（op_move_to_shape_center の配列版）"""
+    return weight * _unit_or_zero(s.target_center - s.p)
+
+
+def vop_avoid_neighbors(s: SwarmSnapshot, weight: float, radius: float = 0.1, **kwargs) -> np.ndarray:
+    """近傍ロボットからの斥力（op_avoid_neighbors の配列版）"""
+    diff = s.p[:, None, :] - s.p[s.nb_idx]                   # (n,k,2)
+    dist = np.linalg.norm(diff, axis=2)
+    act = s.nb_valid & (dist < radius) & (dist > 1e-6)
+    repulse = (diff / (dist**2 + 1e-6)[:, :, None] * act[:, :, None]).sum(axis=1)
+    return weight * repulse
+
+
+def vop_keep_grid_uniformity(s: SwarmSnapshot, weight: float, cell_size: float = 1.0, **kwargs) -> np.ndarray:
+    """近傍の重心へゆっくり移動（op_keep_grid_uniformity の配列版）"""
+    diff = _neighbor_mean(s, s.p) - s.p
+    return np.where(s.n_neighbors[:, None] > 0, weight * diff * 0.1, 0.0)
+
+
+def vop_synchronize_velocity(s: SwarmSnapshot, weight: float, **kwargs) -> np.ndarray:
+    """近傍ロボットとの速度同期（op_synchronize_velocity の配列版）"""
+    diff = _neighbor_mean(s, s.v) - s.v
+    return np.where(s.n_neighbors[:, None] > 0, weight * diff, 0.0)
+
+
+def vop_explore_empty_cells(s: SwarmSnapshot, weight: float, **kwargs) -> np.ndarray:
+    """並び順で最初の空セルへ（op_explore_empty_cells の配列版。セルは全ロボット共通）"""
+    free = np.flatnonzero(~s.cell_occupied)
+    if len(free) == 0:
+        return np.zeros_like(s.p)
+    return weight * _unit_or_zero(s.cells[free[0]] - s.p)
+
+
+VEC_OP_REGISTRY: Dict[str, Callable] = {
+    "move_to_shape_center": vop_move_to_shape_center,
+    "avoid_neighbors": vop_avoid_neighbors,
+    "keep_grid_uniformity": vop_keep_grid_uniformity,
+    "synchronize_velocity": vop_synchronize_velocity,
+    "explore_empty_cells": vop_explore_empty_cells,
+}
+
+
+def build_prior_fn_vec(prior_dsl: dict) -> Callable:
+    """
+    Prior Policy DSL から全ロボット一括の関数を生成（build_prior_fn の配列版）
+    - 各項は VEC_OP_REGISTRY の配列演算1回で全ロボット分を計算
+    - 未知の op や引数エラーになる項はコンパイル時に1度だけ警告して除外
+      （スカラー版は毎回例外を捕まえて読み飛ばすので、結果は同じ）
+
+    Returns:
+        prior_policy(snap: SwarmSnapshot) -> (n,2) float32
+    """
+    clamp_config = prior_dsl.get("clamp", {"max_speed": 0.5})
+    max_speed = clamp_config.get("max_speed", 0.5)
+
+    # 1台・近傍1・セル1の小さな入力で試し評価し、失敗する項を除外
+    probe = SwarmSnapshot(np.zeros((1, 2)), np.zeros((1, 2)), np.zeros((1, 1)), np.ones((1, 1)),
+                        np.ones((1, 2)), np.zeros(1), np.ones(2))
+    terms = []
+    for term in prior_dsl.get("terms", []):
+        op_name = term.get("op")
+        if op_name not in VEC_OP_REGISTRY:
+            print(f"⚠️ Unknown operation: {op_name}")
+            continue
+        fn = VEC_OP_REGISTRY[op_name]
+        try:
+            fn(probe, **term)
+        except Exception as e:
+            print(f"⚠️ Error in operation {op_name}: {e}")
+            continue
+        terms.append((fn, term))
+
+    def prior_policy(snap: SwarmSnapshot) -> np.ndarray:
+        # スカラー版（状態辞書は Python float = float64）と同じ精度で計算
+        s = snap.astype(np.float64)
+        action = np.zeros((len(s), 2))
+        for fn, term in terms:
+            action += fn(s, **term)
+        # クランプ（最大速度制限）
+        norm = np.linalg.norm(action, axis=1, keepdims=True)
+        action = np.where(norm > max_speed, action / np.maximum(norm, 1e-12) * max_speed, action)
+        return action.astype(np.float32)
+
+    return prior_policy
+
+
 # ==================== Reward Function ビルダー ====================
 
 def build_reward_fn(reward_dsl: dict) -> Callable:
@@ -199,30 +302,34 @@ def build_reward_fn(reward_dsl: dict) -> Callable:
         reward_dsl: RewardDSL の辞書表現
     
     Returns:
-        reward_fn(metrics) -> reward (float)
+        reward_fn(metrics) -> reward (float、メトリクスが配列なら配列)
     """
     from .safe_expr import compile_reward_expr
     
     formula = reward_dsl.get("formula", "coverage")
     clamp_config = reward_dsl.get("clamp", {"min": -1.0, "max": 1.0})
     
-    # 安全な式評価器を作成
+    # 式を1度だけコンパイル（評価時に AST をたどらない）
     expr_fn = compile_reward_expr(formula)
+    min_val = clamp_config.get("min", -1.0)
+    max_val = clamp_config.get("max", 1.0)
     
-    def reward_fn(metrics: Dict[str, float]) -> float:
+    def reward_fn(metrics: Dict[str, Any]):
         """
         Reward Function
         Args:
-            metrics: メトリクス辞書 (coverage, uniformity, collisions など)
+            metrics: メトリクス辞書 (coverage, uniformity, collisions など。値は float か NumPy 配列)
         Returns:
-            reward: スカラー報酬値
+            reward: スカラー報酬値（メトリクスが配列なら要素ごとの報酬配列）
         """
         try:
-            raw_reward = expr_fn(metrics)
+            with np.errstate(all="ignore"):
+                raw_reward = expr_fn(metrics)
             
-            # クランプ
-            min_val = clamp_config.get("min", -1.0)
-            max_val = clamp_config.get("max", 1.0)
+            # クランプ（配列は有限でない要素を 0.0 にしてから: NaN 報酬をリプレイに入れない）
+            if isinstance(raw_reward, np.ndarray):
+                raw_reward = np.where(np.isfinite(raw_reward), raw_reward, 0.0)
+                return np.clip(raw_reward, min_val, max_val)
             clamped = max(min_val, min(max_val, raw_reward))
             
             return float(clamped)
@@ -5,8 +5,11 @@ Safe Expression Evaluator
 
 import ast
 import operator
+from functools import reduce
 from typing import Dict, Callable, Any
 
+import numpy as np
+
 
 # ==================== 許可された要素 ====================
 
@@ -16,6 +19,7 @@ ALLOWED_NAMES = {
     "uniformity",    # Uniformity (M2)
     "collisions",    # 衝突回数
     "variance",      # 分散（uniformityの別名）
+    "share",         # Voronoi 割当の占有率（局所報酬ではロボットごと、全体では 1/n）
 }
 
 # 許可された関数
@@ -26,6 +30,18 @@ ALLOWED_FUNCS = {
     "clamp": lambda x, a, b: max(a, min(b, x)),
 }
 
+def _is_array(args) -> bool:
+    return any(isinstance(a, np.ndarray) for a in args)
+
+
+# コンパイル済みの式から呼ぶ関数（スカラーは組み込み関数と同じ、配列は要素ごと）
+COMPILED_FUNCS = {
+    "abs": abs,
+    "min": lambda *a: reduce(np.minimum, a) if _is_array(a) else min(*a),
+    "max": lambda *a: reduce(np.maximum, a) if _is_array(a) else max(*a),
+    "clamp": lambda x, a, b: np.maximum(a, np.minimum(b, x)) if _is_array((x, a, b)) else max(a, min(b, x)),
+}
+
 # 許可されたASTノードタイプ
 ALLOWED_NODES = (
     ast.Module,
@@ -97,6 +113,7 @@ def validate_expr(expr: str) -> None:
 class SafeExprEvaluator(ast.NodeVisitor):
     """
     ASTを安全に評価するビジター
+    ※ 参照実装（評価のたびに木を再帰的にたどる）。通常は compile_reward_expr のコンパイル版を使用
     """
     
     def __init__(self, variables: Dict[str, Any]):
@@ -146,15 +163,67 @@ class SafeExprEvaluator(ast.NodeVisitor):
 
 # ==================== 公開API ====================
 
-def compile_reward_expr(expr: str) -> Callable[[Dict[str, float]], float]:
+class ConstantFolder(ast.NodeTransformer):
+    """
+    定数だけの部分式（二項/単項演算、許可関数の呼び出し）をコンパイル時に計算して定数に置き換える
+    - 計算できない部分式（0除算など）は残し、評価時に従来どおりエラーにする
+    """
+    @staticmethod
+    def _is_num(node) -> bool:
+        return (isinstance(node, ast.Constant) and isinstance(node.value, (int, float))
+                and not isinstance(node.value, bool))
+
+    def _fold(self, node, fn):
+        try:
+            value = fn()
+        except Exception:
+            return node
+        return ast.copy_location(ast.Constant(value), node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        op = OPERATORS.get(type(node.op))
+        if op is not None and self._is_num(node.left) and self._is_num(node.right):
+            return self._fold(node, lambda: op(node.left.value, node.right.value))
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        op = OPERATORS.get(type(node.op))
+        if op is not None and self._is_num(node.operand):
+            return self._fold(node, lambda: op(node.operand.value))
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if (isinstance(node.func, ast.Name) and node.func.id in ALLOWED_FUNCS and not node.keywords
+                and all(self._is_num(a) for a in node.args)):
+            return self._fold(node, lambda: ALLOWED_FUNCS[node.func.id](*(a.value for a in node.args)))
+        return node
+
+
+def _as_number(value):
+    """メトリクス値を float（配列・リストは float64 配列）に"""
+    if isinstance(value, (np.ndarray, list, tuple)):
+        return np.asarray(value, dtype=np.float64)
+    return float(value)
+
+
+def compile_reward_expr(expr: str) -> Callable[[Dict[str, Any]], Any]:
     """
     報酬式をコンパイルして実行可能な関数を返す
+    - 検証済みの AST を定数畳み込みしたうえで、使われているメトリクス名だけを引数に取る
+      lambda のコードオブジェクトへ1度だけ変換する（評価時に木をたどらない）
+    - グローバルは COMPILED_FUNCS のみ（__builtins__ は空）
+    - メトリクスに NumPy 配列を渡すと要素ごとに評価する（全エージェント分や軌跡全体を1回で）
+      スカラーなら float、配列ならブロードキャスト後の形の float64 配列を返す
+      （スカラーの 0除算は例外→呼び出し側で 0.0 になるので、配列でも 0除算などで有限でない要素は 0.0 にする）
     
     Args:
         expr: 数式文字列（例: "1.0*coverage - 0.5*collisions"）
     
     Returns:
-        評価関数 metrics -> reward
+        評価関数 metrics -> reward（不足しているメトリクスは 0.0）
     
     Raises:
         ValueError: 式が安全でない場合
@@ -162,30 +231,26 @@ def compile_reward_expr(expr: str) -> Callable[[Dict[str, float]], float]:
     # 式の検証
     validate_expr(expr)
     
-    # ASTをコンパイル
-    tree = ast.parse(expr, mode="eval")
+    # 定数畳み込み → 使用メトリクスを引数にした lambda へ
+    tree = ast.fix_missing_locations(ConstantFolder().visit(ast.parse(expr, mode="eval")))
+    names = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id in ALLOWED_NAMES})
+    code = compile(f"lambda {', '.join(names)}: {ast.unparse(tree.body)}", "<reward_expr>", "eval")
+    fn = eval(code, {"__builtins__": {}, **COMPILED_FUNCS})
     
-    def reward_fn(metrics: Dict[str, float]) -> float:
+    def reward_fn(metrics: Dict[str, Any]):
         """
         式を評価
         Args:
-            metrics: メトリクス辞書
+            metrics: メトリクス辞書（値は float か NumPy 配列）
         Returns:
-            計算結果
+            計算結果（float または配列）
         """
-        # メトリクスをfloatに変換
-        safe_metrics = {k: float(v) for k, v in metrics.items() if k in ALLOWED_NAMES}
-        
-        # 不足している変数をゼロで埋める
-        for name in ALLOWED_NAMES:
-            if name not in safe_metrics:
-                safe_metrics[name] = 0.0
-        
-        # 評価
-        evaluator = SafeExprEvaluator(safe_metrics)
-        result = evaluator.visit(tree)
-        
-        return float(result)
+        with np.errstate(all="ignore"):
+            result = fn(*[_as_number(metrics.get(name, 0.0)) for name in names])
+        if np.ndim(result) == 0:
+            return float(result)
+        result = np.asarray(result, dtype=np.float64)
+        return np.where(np.isfinite(result), result, 0.0)
     
     return reward_fn
 
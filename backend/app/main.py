@@ -3,12 +3,12 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Optional
-import asyncio, json
+import asyncio, json, re
 import numpy as np
 import os
 
 # ユーティリティ/環境/MARL/メトリクス
-from .utils import make_id
+from .utils import make_id, RESULTS_DIR
 from .env import SwarmEnv
 from .marl import MADDPGSystem
 from .metrics import coverage_m1, uniformity_m2
@@ -16,7 +16,7 @@ from .metrics import coverage_m1, uniformity_m2
 # LLMモジュール
 from .llm.router import router as llm_router
 from .llm.client import generate_prior_reward_dsl
-from .llm.dsl_runtime import build_prior_fn, build_reward_fn
+from .llm.dsl_runtime import build_prior_fn, build_prior_fn_vec, build_reward_fn
 
 app = FastAPI(title="LAMARL Backend API", version="1.0.0")
 
@@ -62,6 +62,19 @@ class EpisodeCreate(BaseModel):
     nhc: int = 80
     grid_size: int = 64
     l_cell: float = 1.0
+    neighbor_mode: str = "hash"   # 近傍探索: "hash"（毎ステップ再構築） / "verlet"（スキン付きリスト）
+    verlet_skin: float = 1.0      # Verlet リストのスキン幅（グリッド座標）
+    replay_on_disk: bool = False  # リプレイを results/replay/<name> の memmap ファイルに置く（RAM 節約・再開可能）
+    replay_name: Optional[str] = None  # ディスクリプレイの名前（省略時はエピソードID。既存の名前なら続きから）
+    replay_compact: bool = False  # 観測を1回だけ保存（next_obs は次の遷移の obs を参照）。ディスクとは併用不可
+    replay_float16: bool = False  # replay_compact 時に観測を float16 で保存
+    prioritized_replay: bool = False  # TD 誤差に基づく優先度付き経験再生（IS 重みを Critic 損失に適用）
+    prefetch: int = 0             # 別スレッドで先読みしておくミニバッチ数（0 で無効。有効にすると学習は非決定的になり、
+                                  # 優先度付き再生では直前の優先度更新より前に引いた添字/IS 重みを使う）
+    shared_params: bool = False   # 全ロボットで actor/critic を共有（大規模スウォーム向け）
+    agent_embed_dim: int = 0      # 共有モードでのエージェント番号埋め込みの次元（0 で無し）
+    local_reward: bool = True     # 報酬をロボットごとの局所メトリクスで評価（False なら全体メトリクスの同一報酬）
+    metrics_budget_ms: Optional[float] = 1.0  # 増分メトリクスの再問い合わせにかける1ステップの時間予算（None で無制限）
 
 class TrainStart(BaseModel):
     """
@@ -97,11 +110,13 @@ def create_ep(cfg: EpisodeCreate):
     """
     ep_id = make_id("ep")
 
-    # 環境を仮作成して mask 情報（セル数など）を確認
+    # 環境を仮作成して形状情報（セル数など）を確認（ShapeIndex はプロセス内で共有）
     env = SwarmEnv(shape=cfg.shape, grid_size=cfg.grid_size, n_robot=cfg.n_robot,
                    r_sense=cfg.r_sense, r_avoid=cfg.r_avoid, nhn=cfg.nhn, nhc=cfg.nhc,
-                   l_cell=cfg.l_cell, seed=cfg.seed)
-    n_cell = int((env.mask == 1).sum())
+                   l_cell=cfg.l_cell, seed=cfg.seed,
+                   neighbor_mode=cfg.neighbor_mode, verlet_skin=cfg.verlet_skin,
+                   metrics_budget_ms=cfg.metrics_budget_ms)
+    n_cell = env.shape_index.n_cells
 
     # 幾何条件: 4 * n_robot * r_avoid^2 ≤ n_cell * l_cell^2
     if 4 * cfg.n_robot * (cfg.r_avoid**2) > n_cell * (cfg.l_cell**2):
@@ -111,13 +126,32 @@ def create_ep(cfg: EpisodeCreate):
     obs0 = env.observe()
     obs_dim = obs0.shape[1]
 
+    if cfg.replay_compact and cfg.replay_on_disk:
+        raise HTTPException(400, "replay_compact cannot be combined with replay_on_disk")
+
+    # ディスクリプレイの保存先（名前は英数字/_/- のみ。"." や ".." でリプレイ領域の外を指させない）
+    replay_dir = None
+    if cfg.replay_on_disk:
+        replay_name = cfg.replay_name or ep_id
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", replay_name):
+            raise HTTPException(400, "replay_name must match [A-Za-z0-9_-]+")
+        replay_dir = RESULTS_DIR / "replay" / replay_name
+
     # MADDPG（n_agents=ロボット数, 局所Q）
     # パフォーマンス改善: batch_sizeとwarmup_stepsを削減
-    maddpg = MADDPGSystem(
-        n_agents=cfg.n_robot, obs_dim=obs_dim,
-        gamma=0.99, batch=128, lr_actor=1e-4, lr_critic=1e-3,
-        noise=0.1, tau=0.005, capacity=1_000_000, warmup_steps=1000
-    )
+    # 既存のディスクリプレイ（replay_name）が別構成（ロボット数/観測次元/容量）なら 400
+    try:
+        maddpg = MADDPGSystem(
+            n_agents=cfg.n_robot, obs_dim=obs_dim,
+            gamma=0.99, batch=128, lr_actor=1e-4, lr_critic=1e-3,
+            noise=0.1, tau=0.005, capacity=1_000_000, warmup_steps=1000,
+            replay_dir=replay_dir, replay_compact=cfg.replay_compact,
+            replay_obs_dtype=np.float16 if cfg.replay_float16 else np.float32,
+            prioritized=cfg.prioritized_replay, prefetch=cfg.prefetch,
+            shared=cfg.shared_params, agent_embed_dim=cfg.agent_embed_dim
+        )
+    except ValueError as e:
+        raise HTTPException(400, f"Cannot open replay: {e}")
 
     # メモリに保持（DBレス）
     EPISODES[ep_id] = {
@@ -164,6 +198,10 @@ async def start_train(req: TrainStart):
                 "r_avoid": cfg.r_avoid,
                 "n_hn": cfg.nhn,
                 "n_hc": cfg.nhc,
+                # 現在の群の状態（SwarmSnapshot の集約値）もプロンプトに含める
+                # cells=False: セルの抽出で env の乱数を消費しない。未占有率は占有グリッドから正確に読む
+                "swarm_state": {**store["env"].snapshot(cells=False).summary(),
+                                "free_cell_ratio": 1.0 - store["env"].occupancy_coverage()},
             }
             
             dsl = generate_prior_reward_dsl(
@@ -179,10 +217,11 @@ async def start_train(req: TrainStart):
             prior_fn = build_prior_fn(dsl["prior"])
             reward_fn = build_reward_fn(dsl["reward"])
             
-            # MADDPGSystemに設定
+            # MADDPGSystemに設定（学習ループでは全ロボット一括の配列版 Prior を使う）
             maddpg: MADDPGSystem = store["rl"]
             maddpg.set_prior_policy(prior_fn)
             maddpg.set_reward_function(reward_fn)
+            store["prior_vec"] = build_prior_fn_vec(dsl["prior"])
             
             # メタデータを保存
             store["llm_dsl"] = dsl
@@ -216,6 +255,20 @@ async def stop_train(episode_id: str):
     EPISODES[episode_id]["should_stop"] = True
     return {"stopped": True}
 
+# ------- 方策の書き出し -------
+
+@app.post("/export")
+def export_policy(episode_id: str):
+    """
+    学習中/学習済みの Actor を results/policies/<episode_id>.npy/.json に書き出す。
+    - app.np_policy.NumpyActor で torch なしに読み込んで推論できる
+    """
+    if episode_id not in EPISODES:
+        raise HTTPException(404, "episode not found")
+    path = RESULTS_DIR / "policies" / episode_id
+    EPISODES[episode_id]["rl"].export_actor(path)
+    return {"path": str(path.with_suffix(".npy"))}
+
 # ------- SSE ストリーム -------
 
 @app.get("/stream")
@@ -267,7 +320,7 @@ async def _train_loop(ep_id: str):
     学習のメインループ（非同期）。
     - 各ステップで:
         * 行動選択 → 環境更新
-        * M1/M2 計算、成功判定（スパース報酬）
+        * 増分メトリクスから報酬計算（LLM生成の Reward Function があれば使用）
         * リプレイバッファ格納 → 更新（ウォームアップ後）
         * SSE用イベントを metrics.timeline にpush
     - エピソード終了時に metrics.json / final_shape.png を保存
@@ -311,31 +364,36 @@ async def _train_loop(ep_id: str):
                 break
             
             # 行動サンプリング（全エージェント分）
-            # LLM Prior Policyを使用する場合は、状態辞書を渡す
-            # パフォーマンス改善: get_state_dicts()は重いので、5ステップごとに計算
-            state_dicts = None
-            if store.get("use_llm", False) and t % 5 == 0:
-                state_dicts = env.get_state_dicts()
+            # LLM Prior Policyを使用する場合は、配列版 Prior で全ロボット分を毎ステップ一括計算
+            prior_actions = None
+            if store.get("use_llm", False):
+                prior_actions = store["prior_vec"](env.snapshot())
             
-            acts = maddpg.act(obs, deterministic=False, state_dicts=state_dicts)
+            acts = maddpg.act(obs, deterministic=False, prior_actions=prior_actions)
 
             # 環境1ステップ
             nobs, col_pairs = env.step(acts)
 
-            # 報酬計算: シンプルな報酬（メトリクス計算を省略）
-            # パフォーマンス改善: M1/M2計算はエピソード終了時のみ
-            # ステップごとの報酬は簡易版（衝突ペナルティのみ）
+            # 報酬計算: env.step 内で増分更新されたメトリクス（coverage/uniformity/collisions）を使用
+            # LLM生成の Reward Function があれば毎ステップ評価、なければ衝突ペナルティのみ
+            # （厳密な M1/M2 はエピソード終了時に計算）
+            # local_reward: 局所メトリクス（各 (n,) 配列）で式を1回評価し、ロボットごとの報酬 (n,) にする
             n_collisions = len(col_pairs)
-            rew_scalar = -0.01 * n_collisions  # 衝突ペナルティ
+            if cfg.local_reward and env.metrics is not None:
+                local = env.metrics.local_dict()
+                if maddpg.reward_fn is not None:
+                    rew = maddpg.reward_fn(local)
+                else:
+                    rew = -0.01 * local["collisions"]  # 自分が関わった衝突のみのペナルティ
+            elif maddpg.reward_fn is not None and env.metrics is not None:
+                rew = maddpg.reward_fn(env.metrics.as_dict())
+            else:
+                rew = -0.01 * n_collisions  # 衝突ペナルティ
             done = 0.0  # エピソード途中では終了しない
 
-            # 各エージェントに同一報酬（協調タスクの最小実装）
-            for i in range(cfg.n_robot):
-                maddpg.buffers[i].push(
-                    obs[i], acts[i],
-                    np.array([rew_scalar], dtype=np.float32),
-                    nobs[i], np.array([done], dtype=np.float32)
-                )
+            # 1ステップ分をまとめて1回で格納（報酬はスカラーなら全エージェントに同一）
+            # Prior 行動も一緒に記録し、更新時の Actor 正則化に使う（LLM 不使用なら未記録）
+            maddpg.push(obs, acts, rew, nobs, done, prior=prior_actions)
 
             # ウォームアップ後にパラメータ更新
             # パフォーマンス改善: 更新を5ステップごとに実行（asyncioオーバーヘッド削減）
@@ -347,14 +405,14 @@ async def _train_loop(ep_id: str):
             # ---- SSE イベント: tick（間引き送信: 20ステップ毎） ----
             # パフォーマンス改善: 可視化更新をさらに削減
             if t % 20 == 0:
+                # 位置/速度/近傍はスナップショットから（近傍は step 内の観測と同じキャッシュ）
                 store["metrics"]["timeline"].append({
                     "type": "tick",
                     "episode": ep,
                     "step": t,
                     "global_step": global_step,
-                    "positions": env.p.tolist(),
-                    "velocities": env.v.tolist(),
-                    "collisions": col_pairs,
+                    **env.snapshot(cells=False).to_json(),
+                    "collisions": col_pairs.tolist(),  # (k,2) int 配列 → [[i, j], ...]
                 })
             
             # ---- SSE イベント: metrics_update（エピソード終了時のみ） ----
@@ -378,8 +436,8 @@ async def _train_loop(ep_id: str):
             break
 
         # エピソード終了: メトリクス計算（エピソードごとに1回のみ）
-        M1 = coverage_m1(env.mask, env.p, cfg.r_avoid)
-        M2 = uniformity_m2(env.p, env.mask)
+        M1 = coverage_m1(env.shape_index, env.p, cfg.r_avoid)
+        M2 = uniformity_m2(env.p, env.shape_index)
         
         # エピソード終了:  SSE 通知
         store["metrics"]["timeline"].append({
@@ -392,7 +450,15 @@ async def _train_loop(ep_id: str):
             "M2": float(M2),
             "final_positions": env.p.tolist(),  # エピソード終了時の最終位置
             "final_velocities": env.v.tolist(),  # エピソード終了時の最終速度
+            "neighbor_stats": env.neighbor_stats(),  # 近傍インデックスの再構築率（skin 調整用）
         })
         
+        # ディスクリプレイはエピソードごとに書き出して再開可能な状態にする
+        maddpg.flush()
+
         # エピソード間でもイベントループに制御を返す
         await asyncio.sleep(0)
+
+    # 停止時も含め、先読みスレッドを止めて未書き出しのディスクリプレイを保存
+    maddpg.close()
+    maddpg.flush()
@@ -1,5 +1,8 @@
+import json, threading
+from pathlib import Path
 import numpy as np, torch, torch.nn as nn, torch.optim as optim
-from .buffer import ReplayBuffer
+from .buffer import JointReplayBuffer, CompactReplayBuffer, PrioritizedReplay
+from .prefetch import BatchPrefetcher
 
 def mlp(in_dim, out_dim, hidden=[180,180,180], out_act=None):
     """
@@ -16,6 +19,83 @@ def mlp(in_dim, out_dim, hidden=[180,180,180], out_act=None):
         layers += [nn.Tanh()]
     return nn.Sequential(*layers)
 
+class EnsembleMLP(nn.Module):
+    """
+    n 個の mlp（同じ構成）の重みを積み重ねて1つにまとめたもの（エージェントごとに独立なパラメータ）
+    - weights[l]: (n, out, in), biases[l]: (n, out)（nn.Linear と同じ並び）
+    - forward(x): x (n, B, in) → (n, B, out)。各層は torch.baddbmm 1回で全エージェント分を計算
+    - from_modules(): 既存の mlp 群の重みを積み重ね、元の nn.Linear のパラメータを積み重ねた
+      テンソルのビューに差し替える（メモリを共有するので、どちらで更新してももう一方に反映される）
+    - bind=False ならビューへの差し替えをせず、重みのコピーだけを持つ（書き出し用）
+    - embed（nn.Embedding）を持たせると、forward(x, idx) で入力末尾にエージェント番号の埋め込みを連結
+      （パラメータ共有モード用。埋め込みもこのモジュールのパラメータとして学習・ソフト更新される）
+    """
+    def __init__(self, weights, biases, out_act=None, embed=None):
+        super().__init__()
+        self.weights = nn.ParameterList([nn.Parameter(w) for w in weights])
+        self.biases = nn.ParameterList([nn.Parameter(b) for b in biases])
+        self.out_act = out_act
+        self.embed = embed
+
+    @classmethod
+    def from_modules(cls, modules, out_act=None, embed=None, bind=True):
+        linears = [[m for m in mod if isinstance(m, nn.Linear)] for mod in modules]
+        weights = [torch.stack([ls[l].weight.detach() for ls in linears]) for l in range(len(linears[0]))]
+        biases = [torch.stack([ls[l].bias.detach() for ls in linears]) for l in range(len(linears[0]))]
+        ens = cls(weights, biases, out_act=out_act, embed=embed)
+        if not bind:
+            return ens
+        # 元のパラメータ（オブジェクトはそのまま）の中身を積み重ねたテンソルのビューにする
+        for i, ls in enumerate(linears):
+            for l, lin in enumerate(ls):
+                lin.weight.data = ens.weights[l].data[i]
+                lin.bias.data = ens.biases[l].data[i]
+        return ens
+
+    def forward(self, x, idx=None):
+        if self.embed is not None:
+            x = torch.cat([x, self.embed(idx)], dim=-1)
+        last = len(self.weights) - 1
+        for l, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = torch.baddbmm(b.unsqueeze(1), x, w.transpose(1, 2))
+            if l < last:
+                x = nn.functional.leaky_relu(x, 0.1)
+        if self.out_act == "tanh":
+            x = torch.tanh(x)
+        return x
+
+def save_actor(actor:EnsembleMLP, path, shared=False):
+    """
+    Actor を NumPy 推論用（app.np_policy.NumpyActor）に書き出す
+    - {stem}.npy: 各層の重み (n, in, out)・バイアス (n, 1, out)、埋め込みを連結した float32 1次元配列
+    - {stem}.json: 層の形状・活性化・共有モードかどうか
+    """
+    path = Path(path)
+    parts, layers = [], []
+    for w, b in zip(actor.weights, actor.biases):
+        w = w.detach().cpu().numpy().transpose(0, 2, 1)
+        parts += [w.ravel(), b.detach().cpu().numpy().ravel()]
+        layers.append(list(w.shape))
+    embed = None
+    if actor.embed is not None:
+        e = actor.embed.weight.detach().cpu().numpy()
+        parts.append(e.ravel())
+        embed = list(e.shape)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path.with_suffix(".npy"), np.concatenate(parts).astype(np.float32))
+    meta = {"layers": layers, "embed": embed, "shared": shared,
+            "negative_slope": 0.1, "out_act": actor.out_act}
+    path.with_suffix(".json").write_text(json.dumps(meta))
+
+def prior_penalty(a:torch.Tensor, prior:torch.Tensor, dims) -> torch.Tensor:
+    """
+    Prior 正則化 ||a - prior||^2 の dims 方向の平均
+    - prior が NaN の行（Prior を記録していない遷移）は除いて平均（全行 NaN なら 0）
+    """
+    valid = ~torch.isnan(prior[..., :1])
+    sq = (a - torch.nan_to_num(prior))**2 * valid
+    return sq.sum(dim=dims) / (valid.sum(dim=dims) * a.shape[-1]).clamp(min=1)
+
 class MADDPGAgent:
     """
     単一エージェントの DDPG（MADDPG の構成要素）
@@ -42,6 +122,7 @@ class MADDPGAgent:
 
         # ハイパラ
         self.gamma, self.tau, self.noise = gamma, tau, noise
+        self.td_error = None  # 直近 update の |Q - y|（(B,) テンソル。優先度付き再生の優先度更新用）
 
     @staticmethod
     def copy(dst, src):
@@ -49,6 +130,24 @@ class MADDPGAgent:
         for d, s in zip(dst.parameters(), src.parameters()):
             d.data.copy_(s.data)
 
+    def export_actor(self, path):
+        """Actor を NumPy 推論用に書き出す（1エージェント分）"""
+        save_actor(EnsembleMLP.from_modules([self.actor], out_act="tanh", bind=False), path)
+
+    def _as_tensor(self, x):
+        """
+        バッチを float32 テンソルに変換
+        - ReplayBuffer.sample の C連続 float32 配列は torch.from_numpy でコピーせずラップ
+        - 配列のタプル/リストは従来どおり vstack
+        - BatchPrefetcher がテンソル化済みのものはデバイスへ移すだけ
+        """
+        if isinstance(x, torch.Tensor):
+            return x.to(self.device)
+        if not isinstance(x, np.ndarray):
+            x = np.vstack(x)
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        return torch.from_numpy(x).to(self.device)
+
     def act(self, obs, deterministic=False, prior_action=None, beta=0.0):
         """
         観測 obs（np.ndarray shape=(1, obs_dim)）から行動 a を出力
@@ -76,25 +175,26 @@ class MADDPGAgent:
         
         return np.clip(a, -1.0, 1.0)
 
-    def update(self, batch, reward_scale=1.0, prior_actions=None, alpha_prior=0.0):
+    def update(self, batch, reward_scale=1.0, prior_actions=None, alpha_prior=0.0, weights=None):
         """
         1回分の学習ステップ
-        - Critic: MSE(Q - y)
+        - Critic: MSE(Q - y)（weights があれば IS 重み付き）
         - Actor: -Q(o, π(o)) + α * ||π(o) - πprior(o)||^2（LAMARL拡張）
         - Target: soft update
         
         Args:
-            batch: (obs, act, rew, nobs, done)のタプル
+            batch: (obs, act, rew, nobs, done)のタプル（各要素は (B, dim) 配列または配列の列）
             reward_scale: 報酬のスケーリング係数
-            prior_actions: LLM生成のPrior Policy行動（バッチサイズ分）
+            prior_actions: LLM生成のPrior Policy行動 (B, act_dim)（NaN の行は正則化から除外）
             alpha_prior: Prior正則化係数（0.0〜1.0）
+            weights: 優先度付き再生の IS 重み (B,)（None なら一様）
         """
         obs, act, rew, nobs, done = batch
-        obs = torch.as_tensor(np.vstack(obs), dtype=torch.float32, device=self.device)
-        act = torch.as_tensor(np.vstack(act), dtype=torch.float32, device=self.device)
-        rew = torch.as_tensor(np.vstack(rew), dtype=torch.float32, device=self.device) * reward_scale
-        nobs = torch.as_tensor(np.vstack(nobs), dtype=torch.float32, device=self.device)
-        done = torch.as_tensor(np.vstack(done).astype(np.float32), dtype=torch.float32, device=self.device)
+        obs = self._as_tensor(obs)
+        act = self._as_tensor(act)
+        rew = self._as_tensor(rew) * reward_scale
+        nobs = self._as_tensor(nobs)
+        done = self._as_tensor(done)
 
         # 目標Q
         with torch.no_grad():
@@ -104,7 +204,12 @@ class MADDPGAgent:
 
         # クリティック更新
         q = self.critic(torch.cat([obs, act], dim=1))
-        loss_c = ((q - y)**2).mean()
+        td = q - y
+        if weights is not None:
+            loss_c = (self._as_tensor(weights).reshape(-1, 1) * td**2).mean()
+        else:
+            loss_c = (td**2).mean()
+        self.td_error = td.detach().abs().squeeze(1)
         self.opt_c.zero_grad(); loss_c.backward(); self.opt_c.step()
 
         # アクター更新（LAMARL拡張: Prior正則化項を追加）
@@ -113,17 +218,16 @@ class MADDPGAgent:
         
         # Prior Policy正則化項: α * ||πθ(s) - πprior(s)||^2
         if prior_actions is not None and alpha_prior > 0:
-            prior_actions_t = torch.as_tensor(np.vstack(prior_actions), dtype=torch.float32, device=self.device)
-            prior_reg = alpha_prior * ((a - prior_actions_t) ** 2).mean()
+            prior_actions_t = self._as_tensor(prior_actions)
+            prior_reg = alpha_prior * prior_penalty(a, prior_actions_t, dims=(0, 1))
             loss_a = loss_a + prior_reg
         
         self.opt_a.zero_grad(); loss_a.backward(); self.opt_a.step()
 
-        # ターゲットのソフト更新
-        for tp, p in zip(self.actor_t.parameters(), self.actor.parameters()):
-            tp.data.copy_(self.tau * p.data + (1 - self.tau) * tp.data)
-        for tp, p in zip(self.critic_t.parameters(), self.critic.parameters()):
-            tp.data.copy_(self.tau * p.data + (1 - self.tau) * tp.data)
+        # ターゲットのソフト更新: θ_t ← θ_t + τ(θ - θ_t)（全パラメータを foreach で一括）
+        with torch.no_grad():
+            torch._foreach_lerp_(list(self.actor_t.parameters()), list(self.actor.parameters()), self.tau)
+            torch._foreach_lerp_(list(self.critic_t.parameters()), list(self.critic.parameters()), self.tau)
 
         return float(loss_a.item()), float(loss_c.item())
         
@@ -131,17 +235,74 @@ class MADDPGSystem:
     """
     マルチエージェント版（各エージェントを独立 DDPG として束ねる）
     - 局所 Q: Critic 入力は (o_i, a_i) のみ（論文で述べた拡張に合わせた簡易形）
-    - ReplayBuffer もエージェントごとに持つ
+    - リプレイは全エージェント結合の JointReplayBuffer（環境1ステップにつき push 1回）
+    - 各エージェントのネットワーク（actor/critic とターゲット）は EnsembleMLP に積み重ね、
+      行動選択は全エージェント分を1回の順伝播で計算（エージェント側の nn.Module とメモリ共有）
+    - 更新も既定（batched_update=True）では全エージェントの損失を1つの計算グラフで求め、
+      積み重ねたパラメータを foreach 版 Adam 1回で更新（各エージェントを個別に更新した結果と同じ）
+    - shared=True ならパラメータ共有モード: actor/critic を1組だけ持ち、全エージェントの遷移を
+      1つの大きなバッチ (n_agents*B) にまとめて学習（モデルのメモリは台数によらず一定）
+      agent_embed_dim > 0 でエージェント番号の学習可能な埋め込みを入力に連結
     - LAMARL拡張: Prior Policy統合機能を追加
+      収集時の Prior 行動をリプレイの prior 列に記録し、更新ではサンプルと一緒に取り出して
+      Actor の正則化 α * ||π(s) - πprior(s)||^2 に使う（過去の状態で Prior を再計算しない）
     """
     def __init__(self, n_agents, obs_dim, **kw):
         # MADDPGAgentに渡すパラメータをフィルタリング
         agent_kw = {k: v for k, v in kw.items() 
                    if k in ['act_dim', 'lr_actor', 'lr_critic', 'gamma', 'tau', 'noise', 'device']}
-        self.agents = [MADDPGAgent(obs_dim, **agent_kw) for _ in range(n_agents)]
-        self.buffers = [ReplayBuffer(capacity=kw.get("capacity", 1_000_000)) for _ in range(n_agents)]
+        self.n_agents = n_agents
+        self.shared = kw.get("shared", False)
+        embed_dim = kw.get("agent_embed_dim", 0) if self.shared else 0
+        # 共有モードでは1エージェント分のネットワーク（入力は観測 + 埋め込み）だけを作る
+        self.agents = [MADDPGAgent(obs_dim + embed_dim, **agent_kw)
+                       for _ in range(1 if self.shared else n_agents)]
+        self.device = self.agents[0].device
+        self.noise = self.agents[0].noise
+        embeds = [None] * 4
+        if embed_dim > 0:
+            # actor / actor_t / critic / critic_t がそれぞれ持つ（ターゲットはオンラインと同じ初期値）
+            embeds = [nn.Embedding(n_agents, embed_dim).to(self.device) for _ in range(4)]
+            embeds[1].load_state_dict(embeds[0].state_dict())
+            embeds[3].load_state_dict(embeds[2].state_dict())
+        self.actor = EnsembleMLP.from_modules([ag.actor for ag in self.agents], out_act="tanh", embed=embeds[0])
+        self.actor_t = EnsembleMLP.from_modules([ag.actor_t for ag in self.agents], out_act="tanh", embed=embeds[1])
+        self.critic = EnsembleMLP.from_modules([ag.critic for ag in self.agents], embed=embeds[2])
+        self.critic_t = EnsembleMLP.from_modules([ag.critic_t for ag in self.agents], embed=embeds[3])
+        self.gamma, self.tau = self.agents[0].gamma, self.agents[0].tau
+        self.batched_update = kw.get("batched_update", True) or self.shared
+        self.opt_a = optim.Adam(self.actor.parameters(), lr=kw.get("lr_actor", 1e-4), foreach=True)
+        self.opt_c = optim.Adam(self.critic.parameters(), lr=kw.get("lr_critic", 1e-3), foreach=True)
+        self.td_error = None  # 直近 update の |Q - y| (n_agents, B)
+        # replay_dir を与えるとディスク常駐（np.memmap）。既存ファイルがあればそこから再開
+        # replay_compact=True なら観測を1回だけ保存（replay_obs_dtype=np.float16 で半精度）
+        capacity = kw.get("capacity", 1_000_000)
+        if kw.get("replay_compact", False):
+            if kw.get("replay_dir") is not None:
+                raise ValueError("replay_compact cannot be combined with replay_dir")
+            self.buffer = CompactReplayBuffer(capacity, n_agents, store_prior=True,
+                                              obs_dtype=kw.get("replay_obs_dtype", np.float32))
+        else:
+            # ディスクから再開する場合に照合する1行の形（ロボット数・観測次元が違うリプレイは ValueError）
+            act_dim = kw.get("act_dim", 2)
+            shapes = {"obs": (n_agents, obs_dim), "act": (n_agents, act_dim), "rew": (n_agents, 1),
+                      "next_obs": (n_agents, obs_dim), "done": (n_agents, 1), "prior": (n_agents, act_dim)}
+            self.buffer = JointReplayBuffer(capacity=capacity, n_agents=n_agents, path=kw.get("replay_dir"),
+                                            store_prior=True, shapes=shapes)
+        # prioritized=True なら TD 誤差に基づく優先度付き再生（どの保存形式にも被せられる）
+        if kw.get("prioritized", False):
+            self.buffer = PrioritizedReplay(self.buffer, alpha=kw.get("per_alpha", 0.6),
+                                            beta=kw.get("per_beta", 0.4))
         self.batch = kw.get("batch", 512)
         self.warmup = kw.get("warmup_steps", 5000)
+
+        # prefetch=K (>0) なら次の K バッチを別スレッドで先読み（ウォームアップ完了後に起動。既定は無効）
+        # 先読み分は最大 K 回前の状態から引くので、優先度付き再生では直近 K 回の update_priorities が
+        # 反映されていない添字と IS 重みになる（サンプル順もスレッドのタイミング次第で非決定的）
+        # push / sample / 優先度更新はスレッド間で lock により排他
+        self.prefetch = kw.get("prefetch", 0)
+        self.prefetcher = None
+        self._lock = threading.Lock()
         
         # LAMARL拡張: Prior Policy & Reward Function
         self.prior_policy_fn = None  # LLM生成のPrior Policy関数
@@ -165,55 +326,158 @@ class MADDPGSystem:
         """
         self.reward_fn = reward_fn
 
-    def act(self, obs_list, deterministic=False, state_dicts=None):
+    def push(self, obs, acts, rew, nobs, done, prior=None):
+        """
+        環境1ステップ分の遷移を全エージェントまとめて格納
+        obs/nobs: (n_agents, obs_dim), acts: (n_agents, act_dim), rew/done: スカラーまたは (n_agents,)
+        prior: 収集時の Prior 行動 (n_agents, act_dim)（None なら未記録として正則化から除外）
+        """
+        with self._lock:
+            self.buffer.push(obs, acts, rew, nobs, done, prior=prior)
+
+    # (n_agents, B, dim) 配列 → テンソル（MADDPGAgent と同じ変換）
+    _as_tensor = MADDPGAgent._as_tensor
+
+    def update_batched(self, batch, prior_actions=None, weights=None):
+        """
+        全エージェントを1回で更新（MADDPGAgent.update を n_agents 分まとめたもの）
+        - batch: (obs, act, rew, nobs, done) 各 (n_agents, B, dim)
+        - 損失はエージェントごとの平均をエージェント方向に足す（パラメータが独立なので勾配は個別更新と同じ）
+        - prior_actions: (n_agents, B, act_dim)（NaN の行は正則化から除外）、weights: IS 重み (n_agents, B)
+        - 共有モードでは全エージェント分を (1, n_agents*B) の1バッチにまとめて1組のネットワークを更新
+        戻り: エージェント（共有モードでは共有ネットワーク）ごとの (loss_actor, loss_critic) np.ndarray
+        """
+        n, B = batch[0].shape[:2]
+        obs, act, rew, nobs, done = (self._pool(self._as_tensor(x)) for x in batch)
+        ids = self._agent_ids(B)
+
+        # 目標Q
+        with torch.no_grad():
+            na = self.actor_t(nobs, ids)
+            q_t = self.critic_t(torch.cat([nobs, na], dim=2), ids)
+            y = rew + self.gamma * (1.0 - done) * q_t
+
+        # クリティック更新（IS 重みがあれば重み付き）
+        q = self.critic(torch.cat([obs, act], dim=2), ids)
+        td = q - y
+        err = td**2
+        if weights is not None:
+            err = self._as_tensor(weights).reshape(err.shape) * err
+        loss_c = err.mean(dim=(1, 2))
+        self.opt_c.zero_grad(); loss_c.sum().backward(); self.opt_c.step()
+        self.td_error = td.detach().abs().reshape(n, B)
+
+        # アクター更新（Prior正則化項: α * ||πθ(s) - πprior(s)||^2）
+        a = self.actor(obs, ids)
+        loss_a = -self.critic(torch.cat([obs, a], dim=2), ids).mean(dim=(1, 2))
+        if prior_actions is not None and self.alpha_prior > 0:
+            prior = self._pool(self._as_tensor(prior_actions))
+            loss_a = loss_a + self.alpha_prior * prior_penalty(a, prior, dims=(1, 2))
+        self.opt_a.zero_grad(); loss_a.sum().backward(); self.opt_a.step()
+
+        # ターゲットのソフト更新（積み重ねたテンソルを foreach で一括）
+        with torch.no_grad():
+            torch._foreach_lerp_(list(self.actor_t.parameters()), list(self.actor.parameters()), self.tau)
+            torch._foreach_lerp_(list(self.critic_t.parameters()), list(self.critic.parameters()), self.tau)
+
+        return loss_a.detach().cpu().numpy(), loss_c.detach().cpu().numpy()
+
+    def export_actor(self, path):
+        """全エージェントの Actor（共有モードなら共有 Actor と埋め込み）を NumPy 推論用に書き出す"""
+        save_actor(self.actor, path, shared=self.shared)
+
+    def _pool(self, x):
+        """共有モード: (n_agents, B, ...) → (1, n_agents*B, ...)（エージェント方向を行方向にまとめる）"""
+        return x.reshape(1, -1, *x.shape[2:]) if self.shared else x
+
+    def _agent_ids(self, B:int):
+        """_pool した各行のエージェント番号 (1, n_agents*B)。埋め込みを使わない場合は None"""
+        if self.actor.embed is None:
+            return None
+        return torch.arange(self.n_agents, device=self.device).repeat_interleave(B)[None]
+
+    def _sample(self):
+        with self._lock:
+            return self.buffer.sample_agents(self.batch)
+
+    def flush(self):
+        """ディスクリプレイの未書き出し分を保存（先読みスレッドと排他）"""
+        with self._lock:
+            self.buffer.flush()
+
+    def close(self):
+        """先読みスレッドを止める"""
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def act(self, obs_list, deterministic=False, state_dicts=None, prior_actions=None):
         """
         全エージェント分の行動をまとめて返す。
         obs_list: (n_agents, obs_dim) の np.ndarray
         state_dicts: Prior Policy計算用の状態辞書リスト（オプション）
+        prior_actions: 計算済みの Prior 行動 (n_agents, act_dim)（build_prior_fn_vec の出力。state_dicts より優先）
         """
-        acts = []
-        for i, (a, obs) in enumerate(zip(self.agents, obs_list)):
-            # Prior Policy行動を計算（もし設定されていれば）
-            prior_action = None
-            if self.prior_policy_fn is not None and state_dicts is not None and i < len(state_dicts):
+        n = self.n_agents
+        with torch.no_grad():
+            x = torch.as_tensor(np.asarray(obs_list), dtype=torch.float32, device=self.device)
+            x = x.reshape(n, 1, -1)
+            a = self.actor(self._pool(x), self._agent_ids(1)).reshape(n, -1).cpu().numpy()
+
+        # Prior Policy行動を計算（もし設定されていれば）し、β で融合: a = (1-β)*πθ + β*πprior
+        if prior_actions is not None and self.beta > 0:
+            a = (1.0 - self.beta) * a + self.beta * np.asarray(prior_actions).reshape(a.shape)
+        elif self.prior_policy_fn is not None and state_dicts is not None and self.beta > 0:
+            for i in range(min(n, len(state_dicts))):
                 try:
                     prior_action = self.prior_policy_fn(state_dicts[i])
                 except Exception as e:
                     print(f"⚠️ Prior policy error for agent {i}: {e}")
-                    prior_action = None
-            
-            # 行動選択（Prior融合あり）
-            action = a.act(obs[None, ...], deterministic=deterministic, 
-                          prior_action=prior_action, beta=self.beta)[0]
-            acts.append(action)
-        
-        return np.array(acts, dtype=np.float32)
+                    continue
+                if prior_action is not None:
+                    a[i] = (1.0 - self.beta) * a[i] + self.beta * np.asarray(prior_action).reshape(-1)
+
+        # ノイズ付与（探索）
+        if not deterministic:
+            a += np.random.normal(0, self.noise, size=a.shape)
 
-    def step_update(self, prior_state_dicts_batch=None):
+        return np.clip(a, -1.0, 1.0).astype(np.float32)
+
+    def step_update(self):
         """
         バッファが十分貯まっていれば、各エージェントを1ステップ更新。
+        Prior 正則化にはサンプルした遷移の prior 列（収集時に記録した Prior 行動）を使う。
         戻り: 代表的な actor/critic loss の平均（可視化用）
-        
-        Args:
-            prior_state_dicts_batch: Prior Policy計算用の状態辞書のバッチリスト（オプション）
         """
-        if min(len(b) for b in self.buffers) < self.warmup:
+        if len(self.buffer) < self.warmup:
             return None
         la, lc = [], []
-        for i, ag in enumerate(self.agents):
-            b = self.buffers[i]
-            obs, act, rew, nobs, done = b.sample(self.batch)
-            
-            # Prior Policy行動を計算（もし設定されていれば）
-            prior_actions = None
-            if self.prior_policy_fn is not None and prior_state_dicts_batch is not None:
-                # バッチ内の各観測についてPrior行動を計算
-                # 注: 現実装では簡略化のため、prior_actionsはNoneのまま
-                # 完全な実装では、バッファからサンプリングした観測に対応する状態辞書を使用
-                pass
-            
-            la_i, lc_i = ag.update((obs, act, rew, nobs, done), 
-                                  prior_actions=prior_actions, 
-                                  alpha_prior=self.alpha_prior)
-            la.append(la_i); lc.append(lc_i)
+        # 全エージェント分を1回で収集（エージェントごとに独立な時刻）: 各 (n_agents, B, dim)
+        if self.prefetch > 0:
+            if self.prefetcher is None:
+                self.prefetcher = BatchPrefetcher(self._sample, k=self.prefetch, device=self.device)
+            sample = self.prefetcher.get()
+        else:
+            sample = self._sample()
+        prioritized = isinstance(self.buffer, PrioritizedReplay)
+        if prioritized:
+            (obs_b, act_b, rew_b, nobs_b, done_b, prior_b), idx, w = sample
+        else:
+            obs_b, act_b, rew_b, nobs_b, done_b, prior_b = sample
+        if self.batched_update:
+            la, lc = self.update_batched((obs_b, act_b, rew_b, nobs_b, done_b), prior_actions=prior_b,
+                                         weights=w if prioritized else None)
+            td = self.td_error
+        else:
+            for i, ag in enumerate(self.agents):
+                la_i, lc_i = ag.update((obs_b[i], act_b[i], rew_b[i], nobs_b[i], done_b[i]),
+                                      prior_actions=prior_b[i],
+                                      alpha_prior=self.alpha_prior,
+                                      weights=w[i] if prioritized else None)
+                la.append(la_i); lc.append(lc_i)
+            td = torch.stack([ag.td_error for ag in self.agents])
+        if prioritized:
+            # 全エージェントの TD 誤差で優先度を一括更新
+            with self._lock:
+                self.buffer.update_priorities(idx, td.cpu().numpy())
         return {"loss_actor": float(np.mean(la)), "loss_critic": float(np.mean(lc))}
\ No newline at end of file
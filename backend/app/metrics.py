@@ -1,47 +1,196 @@
+import time
 import numpy as np
-from scipy.spatial import Voronoi
+from scipy.spatial import cKDTree
+from .shapes import as_shape_index
 
-def coverage_m1(shape_mask: np.ndarray, robots_xy: np.ndarray, r_avoid: float) -> float:
+def coverage_m1(shape, robots_xy: np.ndarray, r_avoid: float) -> float:
     """
     Coverage(M1): 形状セルのうち「ロボットが占有した」と見なせる割合
     - セル中心と最近ロボット距離がしきい値未満なら「占有」
     - しきい値はグリッドスケールと r_avoid から簡易スケーリング
     ※ 論文の定義に近づけつつ、実装コストと速度を優先した近似
+    - 最近ロボットは KD-tree で検索（メモリはセル数 + ロボット数に線形）
+    shape: ShapeIndex（生のマスク配列も可）
     """
-    size = shape_mask.shape[0]
-    ys, xs = np.where(shape_mask == 1)
-    if len(xs) == 0:
+    si = as_shape_index(shape)
+    size = si.size
+    if si.n_cells == 0 or len(robots_xy) == 0:
         return 0.0
-    # shape セルの座標 → (N,2)
-    pts = np.stack([xs, ys], axis=1).astype(np.float32)
-    rob = robots_xy.astype(np.float32)  # (n,2)
-    # 各セルと各ロボの距離行列（ベクトル化）
-    d2 = ((pts[:, None, :] - rob[None, :, :])**2).sum(axis=2)
-    min_d = np.sqrt(d2.min(axis=1))
     # スケール調整: グリッド座標系なので、r_avoid を格子に合わせて拡大
     thr = max(1.0, r_avoid*size/4)
+    # 各セルの最近ロボット距離（thr より遠いものは inf で打ち切り）
+    tree = cKDTree(np.asarray(robots_xy, dtype=np.float64))
+    min_d, _ = tree.query(si.cells, k=1, distance_upper_bound=thr)
     occupied = (min_d < thr).sum()
-    return float(occupied) / float(len(xs))
+    return float(occupied) / float(si.n_cells)
 
-def uniformity_m2(robots_xy: np.ndarray, shape_mask: np.ndarray, sample_k: int = 500) -> float:
+def uniformity_m2(robots_xy: np.ndarray, shape, sample_k: int = 500, exact: bool = False) -> float:
     """
     Uniformity(M2): Voronoi によるセル割当の分散（小さいほど均一）
-    - 全セルでの厳密計算は重いので、形状セルをランダムサンプリング
-    - サンプル点の最近ロボットを求め、ロボットごとの割当数の分散を算出
-    ※ 速度と安定性のトレードオフで sample_k を設定
+    - 既定では形状セルをランダムサンプリング（sample_k 点）
+    - exact=True なら全形状セルをラベル付け（決定的なので実行間で比較可能）
+    - サンプル点の最近ロボットを KD-tree で求め、ロボットごとの割当数の分散を算出
+    shape: ShapeIndex（生のマスク配列も可）
     """
-    h, w = shape_mask.shape
-    ys, xs = np.where(shape_mask == 1)
-    if len(xs) == 0 or len(robots_xy) == 0:
+    si = as_shape_index(shape)
+    if si.n_cells == 0 or len(robots_xy) == 0:
         return 1.0  # 形状もしくはロボがない場合は悪値で返す
-    # サンプリング
-    idx = np.random.choice(len(xs), size=min(sample_k, len(xs)), replace=False)
-    pts = np.stack([xs[idx], ys[idx]], axis=1).astype(np.float32)
-    rob = robots_xy.astype(np.float32)
+    if exact:
+        pts = si.cells
+    else:
+        # サンプリング
+        idx = np.random.choice(si.n_cells, size=min(sample_k, si.n_cells), replace=False)
+        pts = si.cells[idx]
+    rob = np.asarray(robots_xy, dtype=np.float64)
     # 最近ロボットを各点に割り当て
-    d2 = ((pts[:, None, :] - rob[None, :, :])**2).sum(axis=2)
-    nearest = d2.argmin(axis=1)
+    _, nearest = cKDTree(rob).query(pts, k=1)
     counts = np.bincount(nearest, minlength=len(rob))
     nv = counts.mean()
     # 分散（= Σ (nv_i - 平均)^2 / n_robot）
     return float(((counts - nv)**2).sum() / len(rob))
+
+
+class StreamingMetrics:
+    """
+    ステップごとの増分メトリクス（SwarmEnv に付随し、step のたびに update される）
+    - coverage:   env の占有グリッドが差分更新している被覆カウンタを読むだけ（O(1)）
+    - uniformity: 固定サンプル点（exact なら全形状セル）の最近ロボットラベルを保持。
+                  前回問い合わせ以降の累積移動量 D に対し、1位と2位の距離差 gap ≤ 2D の点
+                  （= ラベルが変わり得る点）だけを KD-tree で再問い合わせする
+    - collisions: 直近ステップの衝突ペア数と累積数
+    - budget_ms:  再問い合わせにかける1ステップあたりの時間予算。超える分は危険度の高い点から
+                  優先して更新し、残りは次ステップへ繰り越す（その間 uniformity は近似）
+    - local_dict(): 同じキーのロボットごとの局所メトリクス（報酬 DSL を全エージェント一括で評価する用）
+    """
+    def __init__(self, env, sample_k: int = 500, exact: bool = False,
+                 budget_ms: float = None, seed: int = 0):
+        self.env = env
+        self.sample_k, self.exact, self.budget_ms = sample_k, exact, budget_ms
+        self.rng = np.random.default_rng(seed)
+        self._cost_per_pt = None   # 1点あたりの再問い合わせコスト（ms, 指数移動平均）
+        self.last_update_ms = 0.0
+        self.n_refreshed = 0
+        # 局所被覆の円形近傍（半径 r_sense のグリッド換算 = env.r_neigh）のセルオフセット (K,2)
+        rr = int(np.ceil(env.r_neigh))
+        dy, dx = np.mgrid[-rr:rr + 1, -rr:rr + 1]
+        inside = dx**2 + dy**2 <= env.r_neigh**2
+        self.local_offsets = np.stack([dx[inside], dy[inside]], axis=1)
+        self._pad = rr
+        self._region_pad = np.pad(env.shape_index.lookup, rr)   # はみ出し判定を不要にする余白付き形状マスク
+        # オフセットを平坦インデックスの差分にしたもの（余白付きマスク用 / 占有グリッド用）
+        dx, dy = self.local_offsets[:, 0], self.local_offsets[:, 1]
+        self._off_pad = (dy * self._region_pad.shape[1] + dx)[None, :]
+        self._off_grid = (dy * env.occ.size + dx)[None, :]
+        self.reset()
+
+    def reset(self):
+        """サンプル点を選び直し、全点のラベルを問い合わせる（env.reset 後に呼ぶ）"""
+        si = self.env.shape_index
+        if self.exact or si.n_cells <= self.sample_k:
+            self.pts = si.cells
+        else:
+            self.pts = si.cells[self.rng.choice(si.n_cells, size=self.sample_k, replace=False)]
+        n = len(self.env.p)
+        self.labels = np.zeros(len(self.pts), dtype=np.int64)
+        self.assigned = np.zeros(len(self.pts), dtype=bool)
+        self.gap = np.full(len(self.pts), -np.inf)   # 負値 = 必ず再問い合わせ
+        self.drift_at = np.zeros(len(self.pts))      # 各点を最後に問い合わせた時点の D
+        self.drift = 0.0
+        self.counts = np.zeros(n, dtype=np.int64)
+        self.p_prev = self.env.p.copy()
+        self.collisions = 0
+        self.total_collisions = 0
+        self.col_pairs = np.zeros((0, 2), dtype=np.int64)
+        self._refresh(np.arange(len(self.pts)))
+
+    def _refresh(self, idx: np.ndarray):
+        """点 idx の最近/2番目ロボットを問い合わせ、割当数を差し替える"""
+        if len(idx) == 0 or len(self.env.p) == 0:
+            return
+        p = np.asarray(self.env.p, dtype=np.float64)
+        k = 2 if len(p) >= 2 else 1
+        d, j = cKDTree(p).query(self.pts[idx], k=k)
+        if k == 1:
+            d, j = d[:, None], j[:, None]
+        new = j[:, 0]
+        old = self.labels[idx]
+        known = self.assigned[idx]                   # 初回（未割当）の点は減算しない
+        self.counts -= np.bincount(old[known], minlength=len(self.counts))
+        self.counts += np.bincount(new, minlength=len(self.counts))
+        self.labels[idx] = new
+        self.assigned[idx] = True
+        self.gap[idx] = d[:, 1] - d[:, 0] if k == 2 else np.inf
+        self.drift_at[idx] = self.drift
+        self.n_refreshed += len(idx)
+
+    def update(self, col_pairs=None) -> dict:
+        """1ステップ分の増分更新。戻り値: as_dict()"""
+        t0 = time.perf_counter()
+        p = self.env.p
+        if len(p) != len(self.counts):
+            self.reset()
+        else:
+            # 累積移動量（全ロボットの最大変位の和）→ ラベルが変わり得る点を抽出
+            if len(p):
+                self.drift += float(np.sqrt(((p - self.p_prev)**2).sum(axis=1).max()))
+            self.p_prev = p.copy()
+            slack = self.gap - 2 * (self.drift - self.drift_at)
+            stale = np.flatnonzero(slack <= 0)
+            if self.budget_ms is not None and self._cost_per_pt and len(stale):
+                cap = max(1, int(self.budget_ms / self._cost_per_pt))
+                if len(stale) > cap:
+                    stale = stale[np.argpartition(slack[stale], cap - 1)[:cap]]
+            t1 = time.perf_counter()
+            self._refresh(stale)
+            if len(stale):
+                cost = (time.perf_counter() - t1) * 1000 / len(stale)
+                self._cost_per_pt = cost if self._cost_per_pt is None else 0.9 * self._cost_per_pt + 0.1 * cost
+        self.col_pairs = np.zeros((0, 2), dtype=np.int64) if col_pairs is None else np.asarray(col_pairs)
+        self.collisions = len(self.col_pairs)
+        self.total_collisions += self.collisions
+        self.last_update_ms = (time.perf_counter() - t0) * 1000
+        return self.as_dict()
+
+    @property
+    def coverage(self) -> float:
+        return self.env.occupancy_coverage()
+
+    @property
+    def uniformity(self) -> float:
+        n = len(self.counts)
+        if n == 0:
+            return 1.0
+        return float(((self.counts - self.counts.mean())**2).sum() / n)
+
+    def as_dict(self) -> dict:
+        """報酬 DSL にそのまま渡せるメトリクス辞書（variance は uniformity の別名、share は全ロボット平均 1/n）"""
+        u = self.uniformity
+        return {"coverage": self.coverage, "uniformity": u, "variance": u,
+                "collisions": float(self.collisions), "share": 1.0 / max(len(self.counts), 1)}
+
+    def local_dict(self) -> dict:
+        """
+        ロボットごとの局所メトリクス（as_dict と同じキーで、値は (n,) 配列）。全ロボット分を1回の配列演算で作る
+        - coverage:   半径 r_sense 内の形状セルのうち占有済みの割合（形状セルがなければ 0）
+        - uniformity: Voronoi 割当数の平均からの偏差の2乗 (counts_i - mean)^2（全ロボット平均 = uniformity）
+        - variance:   uniformity の別名（同じ配列）
+        - share:      Voronoi 割当の占有率 counts_i / counts.sum()（割当がなければ 0）
+        - collisions: 直近ステップで自分が含まれる衝突ペア数
+        """
+        env = self.env
+        n = len(env.p)
+        # 各ロボットのセル（占有グリッドと同じ丸め）+ 円形オフセット → (n,K)。O(n·K) の参照だけ（グリッド全体は触らない）
+        # 形状マスクは余白付き（範囲外は False）の平坦インデックスで、占有は env.occ.grid から直接引く
+        # （範囲外の要素は in_region=False で除かれるので、占有側の添字は mode="clip" で配列内に収めるだけでよい）
+        size = env.occ.size
+        bx, by = env.occ.bins[:, 0, None], env.occ.bins[:, 1, None]
+        in_region = self._region_pad.reshape(-1)[(by + self._pad) * self._region_pad.shape[1] + bx + self._pad
+                                                  + self._off_pad]
+        occupied = np.take(env.occ.grid.reshape(-1), by * size + bx + self._off_grid, mode="clip") > 0
+        coverage = (in_region & occupied).sum(axis=1) / np.maximum(in_region.sum(axis=1), 1)
+        mean = self.counts.mean() if n else 0.0
+        uniformity = ((self.counts - mean)**2).astype(np.float64)
+        share = self.counts / max(self.counts.sum(), 1)
+        collisions = np.bincount(self.col_pairs.reshape(-1), minlength=n)
+        return {"coverage": coverage.astype(np.float64), "uniformity": uniformity, "variance": uniformity,
+                "share": share.astype(np.float64), "collisions": collisions.astype(np.float64)}
@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+import numpy as np
+
+class NumpyActor:
+    """
+    書き出した Actor を NumPy だけで推論する（torch を import しない軽量な評価/デプロイ用）
+    - 重みファイル: {stem}.npy（全パラメータを連結した float32 1次元配列）+ {stem}.json（形状などのメタ情報）
+      MADDPGSystem.export_actor / MADDPGAgent.export_actor が書き出す
+    - np.load(mmap_mode="r") で読み、各層はファイル上のビュー（起動時にコピーしない）
+    - 層ごとの重みは (n_nets, in, out)。全エージェント分を np.matmul 1回/層で計算
+    - 活性化は mlp と同じ LeakyReLU(negative_slope) と出力 Tanh
+    """
+    def __init__(self, path):
+        path = Path(path)
+        meta = json.loads(path.with_suffix(".json").read_text())
+        flat = np.load(path.with_suffix(".npy"), mmap_mode="r")
+        self.shared = meta["shared"]
+        self.slope = meta["negative_slope"]
+        self.out_act = meta["out_act"]
+        self.weights, self.biases = [], []
+        off = 0
+        def take(shape):
+            nonlocal off
+            size = int(np.prod(shape))
+            a = flat[off:off + size].reshape(shape)
+            off += size
+            return a
+        for n, d_in, d_out in meta["layers"]:
+            self.weights.append(take((n, d_in, d_out)))
+            self.biases.append(take((n, 1, d_out)))
+        self.embed = take(meta["embed"]) if meta["embed"] is not None else None
+
+    def forward(self, x:np.ndarray) -> np.ndarray:
+        """x: (n_nets, B, in) → (n_nets, B, act_dim)"""
+        last = len(self.weights) - 1
+        for l, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = np.matmul(x, w) + b
+            if l < last:
+                x = np.maximum(x, self.slope * x)
+        if self.out_act == "tanh":
+            x = np.tanh(x)
+        return x
+
+    def act(self, obs:np.ndarray) -> np.ndarray:
+        """全エージェントの決定的行動: obs (n_agents, obs_dim) → (n_agents, act_dim)"""
+        obs = np.asarray(obs, dtype=np.float32)
+        n = len(obs)
+        if self.shared:
+            x = obs[None]
+            if self.embed is not None:
+                x = np.concatenate([x, self.embed[None, :n]], axis=2)
+        else:
+            x = obs[:, None, :]
+        return self.forward(x).reshape(n, -1)
@@ -0,0 +1,68 @@
+import numpy as np
+
+def sample_cells(n_cells: int, n: int, k: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    各ロボットに k 個ずつ（重複なし）のセル番号を、ロボットごとに独立に割り当てる
+    （ロボットごとに rng.choice(n_cells, k, replace=False) を呼ぶのと同じ分布）
+    - k*k <= n_cells: 復元抽出 (n,k) を引き、行内に重複がある行だけ引き直す（O(n*k)）
+    - それ以外: ランダムキー行列 (n,n_cells) の argpartition で各行の上位 k 個を取る
+    戻り値: (n,k) int
+    """
+    if k <= 0 or n_cells == 0:
+        return np.zeros((n, 0), dtype=np.int64)
+    if k * k > n_cells:
+        keys = rng.random((n, n_cells))
+        idx = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        # argpartition の並びは偏るので、キー順に並べ直して行内の順序もランダムにする
+        return np.take_along_axis(idx, np.argsort(np.take_along_axis(keys, idx, axis=1), axis=1), axis=1)
+    out = rng.integers(0, n_cells, size=(n, k))
+    redo = np.arange(n)
+    while True:
+        srt = np.sort(out[redo], axis=1)
+        redo = redo[(srt[:, 1:] == srt[:, :-1]).any(axis=1)]
+        if len(redo) == 0:
+            return out
+        out[redo] = rng.integers(0, n_cells, size=(len(redo), k))
+
+def build_observations(p, v, nb_idx, nb_valid, cells, nhn, nhc, rng, free=None):
+    """
+    観測行列 (n, obs_dim) を配列演算だけで構築（SwarmEnv._obs_i と同一レイアウト）
+      - 自身(6) | 近傍 4*nhn | 目標セル(2) | 未占有セル 2*nhc
+    Args:
+        p, v: (n,2) 位置/速度
+        nb_idx, nb_valid: (n,k) 近傍インデックスと有効マスク（距離昇順, k<=nhn）
+        cells: (m,2) 形状セル座標 (x,y)
+        free: 未占有セルの行番号（None なら全セルを候補にする）
+    """
+    n = len(p)
+    m = len(cells)
+    obs_dim = 6 + 4 * nhn + 2 + 2 * nhc
+    out = np.zeros((n, obs_dim), dtype=np.float32)
+
+    # 自身状態（最後の2つはダミータグ=0）
+    out[:, 0:2] = p
+    out[:, 2:4] = v
+
+    # 近傍: 相対pos/相対vel を (n,k,4) で作り、無効スロットはマスクでゼロ埋め
+    k = nb_idx.shape[1]
+    if k > 0:
+        rel = np.concatenate([p[nb_idx] - p[:, None, :], v[nb_idx] - v[:, None, :]], axis=2)
+        rel *= nb_valid[:, :, None]
+        # 有効近傍を前詰め（距離昇順なので有効スロットは常に先頭側）
+        out[:, 6:6 + 4 * k] = rel.reshape(n, 4 * k)
+
+    # 目標セル（ランダム1点）の相対ベクトル
+    base = 6 + 4 * nhn
+    if m > 0:
+        tgt = cells[rng.integers(0, m, size=n)]
+        out[:, base:base + 2] = tgt - p
+
+    # 未占有セル（ロボットごとに重複なしで nhc 個）の相対ベクトル、不足分はゼロ
+    if free is None:
+        free = np.arange(m)
+    k2 = min(nhc, len(free))
+    if k2 > 0:
+        sel = free[sample_cells(len(free), n, k2, rng)]
+        rel_c = cells[sel] - p[:, None, :]                      # (n,k2,2)
+        out[:, base + 2:base + 2 + 2 * k2] = rel_c.reshape(n, 2 * k2)
+    return out
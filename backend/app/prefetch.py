@@ -0,0 +1,65 @@
+import queue, threading
+import numpy as np
+import torch
+
+class BatchPrefetcher:
+    """
+    リプレイのサンプリングとテンソル化を別スレッドで先行実行する
+    - ワーカーが sample_fn() → テンソル化 を繰り返し、結果を最大 k 個キューに溜める
+    - NumPy のファンシーインデックスや torch の変換は GIL を解放するので、
+      メインスレッドの env.step / act と並行して進む
+    - sample_fn 内のバッファ参照と、メインスレッドの push は呼び出し側の lock で排他する
+    - 先読みした分だけ（最大 k ステップ）古いバッファ内容からのサンプルになる
+      優先度付き再生では、直近 k 回の優先度更新を反映していない添字と IS 重みを使う
+      （乱数の消費順もスレッドのタイミングに依存するので、学習は非決定的になる）
+    """
+    def __init__(self, sample_fn, k:int=2, device="cpu"):
+        self.sample_fn = sample_fn
+        self.device = torch.device(device)
+        self.queue = queue.Queue(maxsize=max(1, k))
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="replay-prefetch", daemon=True)
+        self.thread.start()
+
+    def _to_tensor(self, x):
+        """配列（の入れ子タプル）を C連続の float32 テンソルへ（CPU ではコピーなし）"""
+        if isinstance(x, tuple):
+            return tuple(self._to_tensor(a) for a in x)
+        if x.dtype.kind in "iu":
+            return x  # サンプル位置などの整数配列はそのまま
+        t = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+        if self.device.type != "cpu":
+            t = t.pin_memory().to(self.device, non_blocking=True)
+        return t
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                item = self._to_tensor(self.sample_fn())
+                while not self.stop_event.is_set():
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            self.error = e
+
+    def get(self):
+        """次のバッチを取り出す（溜まっていなければ待つ）。ワーカーの例外はここで送出"""
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self.thread.is_alive() and self.error is None:
+                    raise RuntimeError("prefetch worker stopped")
+
+    def close(self):
+        """ワーカーを止めて溜まったバッチを捨てる"""
+        self.stop_event.set()
+        self.thread.join()
+        while not self.queue.empty():
+            self.queue.get_nowait()
@@ -1,12 +1,104 @@
+import os
 import numpy as np
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+from scipy.ndimage import distance_transform_edt
 
-def grid_mask(shape: str, size: int = 64) -> np.ndarray:
+# 組み込み形状
+SHAPES = ("circle", "triangle", "square", "L", "A", "M", "R")
+
+# ディスクキャッシュ（任意）: 環境変数で .npy の保存先を指定すると、プロセス再起動後も再利用
+MASK_CACHE_DIR = os.getenv("LAMARL_MASK_CACHE_DIR")
+
+
+def grid_mask(shape: str, size: int = 64, cache_dir: Optional[str] = None) -> np.ndarray:
     """
     指定形状（circle/triangle/square/L/A/M/R）を 2D 二値マスクに変換して返す。
     戻り値: (size, size) の uint8 配列（1: 形状セル, 0: 背景）
+    - (shape, size) ごとにメモ化（インメモリ LRU + 任意の .npy ディスクキャッシュ）
+    - 共有配列なので読み取り専用（書き換える場合は .copy() すること）
+    """
+    if shape not in SHAPES:
+        raise ValueError("unknown shape")
+    return _cached_mask(shape, int(size), cache_dir or MASK_CACHE_DIR)
+
+
+@lru_cache(maxsize=32)
+def _cached_mask(shape: str, size: int, cache_dir: Optional[str]) -> np.ndarray:
+    """LRU 本体: ディスクにあれば読み込み、なければラスタライズして保存"""
+    path = Path(cache_dir) / f"mask_{shape}_{size}.npy" if cache_dir else None
+    if path is not None and path.exists():
+        m = np.load(path)
+    else:
+        m = _rasterize(shape, size)
+        if path is not None:
+            # 一時ファイルに書いてから置換（並行プロセスが途中のファイルを読まないように）
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, m)
+            os.replace(tmp, path)
+    m.setflags(write=False)
+    return m
+
+
+def signed_distance_field(lookup: np.ndarray) -> np.ndarray:
+    """
+    形状の符号付き距離場（SDF）と勾配場を距離変換で一括計算
+    - 外側: 最寄り形状セルまでの距離 - 0.5（正）、内側: -(最寄り背景セルまでの距離 - 0.5)（負）
+    - 勾配は np.gradient（形状から離れる向き）。x, y 順に並べる
+    戻り値: (3, size, size) float32 = [sdf, ∂sdf/∂x, ∂sdf/∂y]
+    """
+    size = lookup.shape[0]
+    if not lookup.any():
+        return np.stack([np.full(lookup.shape, float(size)), np.zeros(lookup.shape),
+                         np.zeros(lookup.shape)]).astype(np.float32)
+    d_out = distance_transform_edt(~lookup)    # 背景セル → 最寄り形状セル
+    d_in = distance_transform_edt(lookup)      # 形状セル → 最寄り背景セル
+    sdf = np.where(lookup, -(d_in - 0.5), d_out - 0.5)
+    gy, gx = np.gradient(sdf)
+    return np.stack([sdf, gx, gy]).astype(np.float32)
+
+
+@lru_cache(maxsize=32)
+def _cached_sdf(shape: str, size: int, cache_dir: Optional[str]) -> np.ndarray:
+    """SDF の LRU（マスクと同じディスクキャッシュに sdf_{shape}_{size}.npy として保存）"""
+    path = Path(cache_dir) / f"sdf_{shape}_{size}.npy" if cache_dir else None
+    if path is not None and path.exists():
+        field = np.load(path)
+    else:
+        field = signed_distance_field(_cached_mask(shape, size, cache_dir) == 1)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, field)
+            os.replace(tmp, path)
+    field.setflags(write=False)
+    return field
+
+
+def bilinear(field: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """
+    グリッド場 field (C,H,W) を連続座標 p (n,2)=(x,y) で双線形補間（領域外は端にクランプ）
+    戻り値: (n,C)
     """
+    _, h, w = field.shape
+    x = np.clip(p[:, 0], 0, w - 1); y = np.clip(p[:, 1], 0, h - 1)
+    x0 = np.minimum(np.floor(x).astype(np.int64), max(w - 2, 0))
+    y0 = np.minimum(np.floor(y).astype(np.int64), max(h - 2, 0))
+    x1 = np.minimum(x0 + 1, w - 1); y1 = np.minimum(y0 + 1, h - 1)
+    fx = (x - x0)[:, None]; fy = (y - y0)[:, None]
+    f00 = field[:, y0, x0].T; f01 = field[:, y0, x1].T
+    f10 = field[:, y1, x0].T; f11 = field[:, y1, x1].T
+    return ((1 - fy) * ((1 - fx) * f00 + fx * f01) + fy * ((1 - fx) * f10 + fx * f11)).astype(np.float32)
+
+
+def _rasterize(shape: str, size: int) -> np.ndarray:
+    """形状マスクを配列演算だけで生成（Python の行ループなし）"""
     m = np.zeros((size, size), dtype=np.uint8)
-    yy, xx = np.mgrid[0:size, 0:size]
+    yy, xx = np.ogrid[0:size, 0:size]          # ブロードキャスト用の行/列ベクトル
     cx, cy = size // 2, size // 2              # 図形中心
     r = size // 4                             # 基準半径（大幅に縮小）
 
@@ -15,18 +107,14 @@ def grid_mask(shape: str, size: int = 64) -> np.ndarray:
         m[((xx - cx) ** 2 + (yy - cy) ** 2) <= r * r] = 1
 
     elif shape == "triangle":
-        # 正三角形（簡易実装）
+        # 正三角形（簡易実装）: 行 i の半幅 = int(w * (h - i) / h) を全行まとめて計算
         h = int(r * 1.2)  # 高さ
         w = int(r * 1.0)  # 底辺の半分
-        for i in range(h):
-            # 各行の幅を計算（三角形の形状）
-            line_width = int(w * (h - i) / h)
-            if line_width > 0:
-                start_x = cx - line_width
-                end_x = cx + line_width
-                y = cy - r + i
-                if 0 <= y < size:
-                    m[y, max(0, start_x):min(size, end_x)] = 1
+        y0 = cy - r
+        i = np.arange(max(0, -y0), min(h, size - y0))[:, None]  # 有効な行（列ベクトル）
+        line_width = (w * (h - i)) // h
+        x = np.arange(size)[None, :]
+        m[y0 + i[:, 0]] = ((x >= cx - line_width) & (x < cx + line_width)).astype(np.uint8)
 
     elif shape == "square":
         # 中心正方形（やや大きめ）
@@ -42,37 +130,6 @@ def grid_mask(shape: str, size: int = 64) -> np.ndarray:
     return m
 
 
-def _triangle_mask(size: int, p1: tuple[int, int], p2: tuple[int, int], p3: tuple[int, int]) -> np.ndarray:
-    """
-    三角形の内部（辺を含む）を NumPy ベクトル演算だけで塗りつぶす。
-    半平面（クロス積の符号）で判定し、頂点列の向き（CW/CCW）で条件を切り替える。
-    """
-    yy, xx = np.mgrid[0:size, 0:size]
-
-    # 3辺ベクトル
-    (x1, y1), (x2, y2), (x3, y3) = p1, p2, p3
-    v12 = (x2 - x1, y2 - y1)
-    v23 = (x3 - x2, y3 - y2)
-    v31 = (x1 - x3, y1 - y3)
-
-    # 各ピクセルに対するクロス積（(P - Ai) × (Ai+1 - Ai)）
-    c1 = (xx - x1) * v12[1] - (yy - y1) * v12[0]
-    c2 = (xx - x2) * v23[1] - (yy - y2) * v23[0]
-    c3 = (xx - x3) * v31[1] - (yy - y3) * v31[0]
-
-    # 三角形の向き（符号付き面積の2倍）
-    area2 = v12[0] * (y3 - y1) - v12[1] * (x3 - x1)
-
-    if area2 >= 0:
-        # 反時計回り(CCW): 全て >= 0 が内側
-        mask = (c1 >= 0) & (c2 >= 0) & (c3 >= 0)
-    else:
-        # 時計回り(CW): 全て <= 0 が内側
-        mask = (c1 <= 0) & (c2 <= 0) & (c3 <= 0)
-
-    return mask.astype(np.uint8)
-
-
 def _letter_mask(letter: str, size: int = 64) -> np.ndarray:
     """
     L/A/M/R を太めの矩形ストロークで近似。塗りつぶし領域を返す。
@@ -96,9 +153,18 @@ def _letter_mask(letter: str, size: int = 64) -> np.ndarray:
         m[size // 4: size * 3 // 4, size * 3 // 4 - t: size * 3 // 4] = 1      # 右縦
         m[size // 4: size // 3, size // 4: size * 3 // 4] = 1                  # 上帯
         # 斜め（簡易）：左上→中央/右上→中央 を太めに
-        for i in range(size // 6):
-            m[size // 4 + i: size // 4 + i + t, size // 4 + i: size // 4 + i + t] = 1
-            m[size // 4 + i: size // 4 + i + t, size * 3 // 4 - i - t: size * 3 // 4 - i] = 1
+        # t×t の正方形を i=0..size//6-1 だけ斜めにずらして重ねた領域を、
+        # 「条件を満たす i が存在するか」（区間 [lo, hi] が空でないか）で一括判定
+        a, b, d = size // 4, size * 3 // 4, size // 6
+        rows = slice(a, min(size, a + d + t))                   # 斜めが掛かる行だけ計算
+        yy, xx = np.ogrid[rows, 0:size]
+        lo = np.maximum(np.maximum(yy - a - t + 1, xx - a - t + 1), 0)
+        hi = np.minimum(np.minimum(yy - a, xx - a), d - 1)
+        diag = lo <= hi
+        lo = np.maximum(np.maximum(yy - a - t + 1, b - t - xx), 0)
+        hi = np.minimum(np.minimum(yy - a, b - 1 - xx), d - 1)
+        diag |= lo <= hi
+        m[rows] |= diag.astype(np.uint8)
 
     elif letter == "R":
         m[size // 4: size * 3 // 4, size // 4: size // 4 + t] = 1              # 左縦
@@ -108,3 +174,77 @@ def _letter_mask(letter: str, size: int = 64) -> np.ndarray:
         m[size // 2: size * 3 // 4, size // 2: size // 2 + t] = 1              # 斜脚の起点
 
     return m
+
+
+class ShapeIndex:
+    """
+    形状マスクの前計算インデックス（env / metrics / create_ep で共有）
+    - mask:       (size,size) uint8 形状マスク
+    - lookup:     (size,size) bool  セル (y,x) が形状内か
+    - xs, ys:     形状セル座標（np.where(mask == 1) と同順）
+    - cells:      (n_cells,2) float32 セル座標 (x,y)
+    - center:     (2,) float32 形状の重心（形状が空ならグリッド中心）
+    - n_cells:    形状セル数
+    - flat_index: (size,size) int64 セル番号（形状外は -1）
+    - sdf / sdf_grad: 符号付き距離場と勾配場（初回アクセス時に計算、マスクと同様にキャッシュ）
+    ※ 共有オブジェクトなので配列はすべて読み取り専用
+    """
+    def __init__(self, mask: np.ndarray, key: Optional[tuple] = None):
+        self.key = key  # (shape, size)。組み込み形状ならディスクキャッシュを利用
+        self._field = None
+        self.size = mask.shape[0]
+        self.mask = mask.astype(np.uint8)
+        self.lookup = self.mask == 1
+        self.ys, self.xs = np.where(self.lookup)
+        self.n_cells = len(self.xs)
+        self.cells = np.stack([self.xs, self.ys], axis=1).astype(np.float32)
+        if self.n_cells > 0:
+            self.center = np.array([self.xs.mean(), self.ys.mean()], dtype=np.float32)
+        else:
+            self.center = np.array([self.size / 2, self.size / 2], dtype=np.float32)
+        self.flat_index = np.full(self.mask.shape, -1, dtype=np.int64)
+        self.flat_index[self.ys, self.xs] = np.arange(self.n_cells)
+        for a in (self.mask, self.lookup, self.xs, self.ys, self.cells, self.center, self.flat_index):
+            a.setflags(write=False)
+
+    @property
+    def field(self) -> np.ndarray:
+        """(3,size,size) = [sdf, ∂x, ∂y]（遅延計算）"""
+        if self._field is None:
+            if self.key is not None:
+                self._field = _cached_sdf(self.key[0], self.key[1], MASK_CACHE_DIR)
+            else:
+                self._field = signed_distance_field(self.lookup)
+                self._field.setflags(write=False)
+        return self._field
+
+    @property
+    def sdf(self) -> np.ndarray:
+        """(size,size) 符号付き距離（内側が負）"""
+        return self.field[0]
+
+    @property
+    def sdf_grad(self) -> np.ndarray:
+        """(2,size,size) SDF の勾配 (x, y)"""
+        return self.field[1:]
+
+    def distance(self, p: np.ndarray):
+        """
+        位置 p (n,2) の形状までの符号付き距離と勾配を一括取得（各 O(1)）
+        戻り値: (d (n,), grad (n,2))。-grad 方向に進むと形状へ近づく
+        """
+        out = bilinear(self.field, p)
+        return out[:, 0], out[:, 1:]
+
+
+@lru_cache(maxsize=64)
+def get_shape_index(shape: str, size: int = 64) -> ShapeIndex:
+    """(shape, size) ごとに1度だけ ShapeIndex を構築し、プロセス内でキャッシュして返す"""
+    return ShapeIndex(grid_mask(shape, size), key=(shape, int(size)))
+
+
+def as_shape_index(shape) -> ShapeIndex:
+    """ShapeIndex または生のマスク配列を受け取り、ShapeIndex に揃える（後方互換用）"""
+    if isinstance(shape, ShapeIndex):
+        return shape
+    return ShapeIndex(np.asarray(shape))
@@ -0,0 +1,102 @@
+from collections.abc import Sequence
+import numpy as np
+
+class SwarmSnapshot:
+    """
+    群全体の状態を列指向（NumPy 配列）でまとめたスナップショット
+    - Prior（build_prior_fn_vec）/ 報酬 / SSE / LLM プロンプトが共通で読む
+    - ロボットごとの辞書は作らず、近傍はインデックス + 有効マスク、セルは全ロボット共通の配列で持つ
+      p, v: (n,2) 位置/速度
+      nb_idx, nb_valid, nb_dist: (n,k) 近傍インデックス（無効スロットは 0）/ 有効マスク / 距離（無効は inf）
+      cells: (m,2) 近傍セル座標、cell_occupied: (m,) 占有フラグ
+      target_center: (2,) 形状中心
+    - 旧来の状態辞書が必要なら state_dicts() の遅延ビューを使う（アクセスされたロボット分だけ作る）
+    """
+    def __init__(self, p, v, nb_idx, nb_valid, cells, cell_occupied, target_center, nb_dist=None):
+        self.p = np.asarray(p).reshape(-1, 2)
+        self.v = np.asarray(v).reshape(-1, 2)
+        self.nb_idx = np.asarray(nb_idx, dtype=np.int64).reshape(len(self.p), -1)
+        self.nb_valid = np.asarray(nb_valid, dtype=bool).reshape(self.nb_idx.shape)
+        self.cells = np.asarray(cells).reshape(-1, 2)
+        self.cell_occupied = np.asarray(cell_occupied, dtype=bool).reshape(-1)
+        self.target_center = np.asarray(target_center).reshape(2)
+        if nb_dist is None:
+            nb_dist = np.linalg.norm(self.p[self.nb_idx] - self.p[:, None, :], axis=2)
+            nb_dist = np.where(self.nb_valid, nb_dist, np.inf)
+        self.nb_dist = np.asarray(nb_dist).reshape(self.nb_idx.shape)
+        self.n_neighbors = self.nb_valid.sum(axis=1)
+
+    def __len__(self):
+        return len(self.p)
+
+    def astype(self, dtype):
+        """座標系の配列（p, v, cells, target_center, nb_dist）を dtype にそろえたコピー"""
+        return SwarmSnapshot(self.p.astype(dtype), self.v.astype(dtype), self.nb_idx, self.nb_valid,
+                             self.cells.astype(dtype), self.cell_occupied,
+                             self.target_center.astype(dtype), self.nb_dist.astype(dtype))
+
+    def state_dict(self, i:int) -> dict:
+        """ロボット i の状態辞書（旧 get_state_dicts の1要素と同じ形式）"""
+        return self.state_dicts()[i]
+
+    def state_dicts(self) -> "StateDictView":
+        """ロボットごとの状態辞書の遅延ビュー（len / 添字アクセス / 反復ができる）"""
+        return StateDictView(self)
+
+    def to_json(self) -> dict:
+        """SSE 用の JSON 化できる辞書（近傍は無効スロットを -1 にしたインデックス表）"""
+        return {
+            "positions": self.p.tolist(),
+            "velocities": self.v.tolist(),
+            "neighbors": np.where(self.nb_valid, self.nb_idx, -1).tolist(),
+        }
+
+    def summary(self) -> dict:
+        """LLM プロンプト用の集約値（ロボット数に依存しない少数のスカラー）"""
+        n = len(self)
+        speed = np.linalg.norm(self.v, axis=1)
+        to_center = np.linalg.norm(self.p - self.target_center, axis=1)
+        return {
+            "n_robot": n,
+            "mean_neighbors": float(self.n_neighbors.mean()) if n else 0.0,
+            "isolated_ratio": float((self.n_neighbors == 0).mean()) if n else 0.0,
+            "mean_speed": float(speed.mean()) if n else 0.0,
+            "mean_distance_to_center": float(to_center.mean()) if n else 0.0,
+            "free_cell_ratio": float((~self.cell_occupied).mean()) if len(self.cells) else 0.0,
+        }
+
+
+class StateDictView(Sequence):
+    """
+    SwarmSnapshot をロボットごとの状態辞書として見せる読み取り専用ビュー
+    - 辞書は添字アクセスのたびに作る（保持しない）。nearby_cells は全ロボット共通なので1度だけ作る
+    """
+    def __init__(self, snap:SwarmSnapshot):
+        self.snap = snap
+        self._cells = None
+
+    def __len__(self):
+        return len(self.snap)
+
+    def _nearby_cells(self):
+        if self._cells is None:
+            s = self.snap
+            self._cells = [{"position": [float(x), float(y)], "occupied": bool(o)}
+                           for (x, y), o in zip(s.cells, s.cell_occupied)]
+        return self._cells
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        s = self.snap
+        i = range(len(s))[i]  # 負の添字と範囲外チェック
+        valid = s.nb_valid[i]
+        neighbors = [{"position": s.p[j].tolist(), "velocity": s.v[j].tolist(), "distance": float(d)}
+                     for j, d in zip(s.nb_idx[i][valid], s.nb_dist[i][valid])]
+        return {
+            "position": s.p[i].tolist(),
+            "velocity": s.v[i].tolist(),
+            "target_center": s.target_center.tolist(),
+            "neighbors": neighbors,
+            "nearby_cells": self._nearby_cells(),
+        }
@@ -0,0 +1,212 @@
+import numpy as np
+
+def knn_from_pairs(n: int, i: np.ndarray, j: np.ndarray, d2: np.ndarray, k: int):
+    """
+    近傍ペア（i<j, 距離の2乗 d2）から各ロボットの k 近傍を作る（距離昇順）
+    戻り値: (idx, kd2, valid)
+      idx: (n,k) int   近傍インデックス（無効スロットは 0）
+      kd2: (n,k) float 距離の2乗（無効スロットは inf）
+      valid: (n,k) bool 有効スロット
+    """
+    k = max(0, min(k, n - 1))
+    idx = np.zeros((n, k), dtype=np.int64)
+    kd2 = np.full((n, k), np.inf, dtype=np.float32)
+    if k == 0 or len(i) == 0:
+        return idx, kd2, np.zeros((n, k), dtype=bool)
+    # 両方向に展開して (自分, 距離) の順にソート
+    a = np.concatenate([i, j]); b = np.concatenate([j, i]); d = np.concatenate([d2, d2])
+    order = np.lexsort((d, a))
+    a, b, d = a[order], b[order], d[order]
+    # グループ内の順位（= 何番目に近いか）
+    counts = np.bincount(a, minlength=n)
+    starts = np.cumsum(counts) - counts
+    rank = np.arange(len(a)) - starts[a]
+    keep = rank < k
+    idx[a[keep], rank[keep]] = b[keep]
+    kd2[a[keep], rank[keep]] = d[keep]
+    return idx, kd2, np.isfinite(kd2)
+
+
+class SpatialHash:
+    """
+    一様グリッド（セルリスト）による近傍インデックス
+    - build(): ロボット位置をセルに振り分け（セル番号でソート + 先頭位置テーブル）
+    - query_pairs(): 半径 r 以内のペアを周辺セルだけ調べて列挙（ほぼ O(n)）
+    - knn(): 半径 r 以内の k 近傍（距離昇順）
+    ※ 領域外の点は端のセルにクランプ（セル番号の差は広がらないので取りこぼしなし）
+    """
+    def __init__(self, grid_size: int, cell_size: float):
+        self.cs = float(max(cell_size, 1e-6))
+        self.nc = max(1, int(np.ceil(grid_size / self.cs)))
+        self.p = np.zeros((0, 2), dtype=np.float32)
+        self.n_builds = 0
+
+    def build(self, p: np.ndarray):
+        """位置 p (n,2) からインデックスを再構築"""
+        self.p = p
+        self.n_builds += 1
+        c = np.clip(np.floor(p / self.cs).astype(np.int64), 0, self.nc - 1)
+        self.cx, self.cy = c[:, 0], c[:, 1]
+        cid = self.cy * self.nc + self.cx
+        self.order = np.argsort(cid, kind="stable")
+        self.counts = np.bincount(cid, minlength=self.nc * self.nc)
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def candidate_pairs(self, r: float):
+        """半径 r をカバーする周辺セル内の候補ペア (i, j) を全列挙（i≠j, 両方向）"""
+        n = len(self.p)
+        reach = int(np.ceil(r / self.cs))
+        ids = np.arange(n)
+        out_i, out_j = [], []
+        for dy in range(-reach, reach + 1):
+            for dx in range(-reach, reach + 1):
+                nx, ny = self.cx + dx, self.cy + dy
+                ok = (nx >= 0) & (nx < self.nc) & (ny >= 0) & (ny < self.nc)
+                cid = ny[ok] * self.nc + nx[ok]
+                s, c = self.starts[cid], self.counts[cid]
+                total = int(c.sum())
+                if total == 0:
+                    continue
+                # セル内の要素を一括展開（np.repeat + 連番オフセット）
+                within = np.arange(total) - np.repeat(np.cumsum(c) - c, c)
+                out_i.append(np.repeat(ids[ok], c))
+                out_j.append(self.order[np.repeat(s, c) + within])
+        if not out_i:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        i = np.concatenate(out_i); j = np.concatenate(out_j)
+        keep = i != j
+        return i[keep], j[keep]
+
+    def query_pairs(self, r: float):
+        """
+        半径 r 以内のペアを返す（i<j, (i, j) の辞書順）
+        戻り値: (i, j, d2)
+        """
+        i, j = self.candidate_pairs(r)
+        keep = i < j
+        i, j = i[keep], j[keep]
+        d2 = ((self.p[i] - self.p[j])**2).sum(axis=1)
+        keep = d2 <= r * r
+        i, j, d2 = i[keep], j[keep], d2[keep]
+        order = np.lexsort((j, i))
+        return i[order], j[order], d2[order]
+
+    def knn(self, k: int, r: float):
+        """半径 r 以内の k 近傍（自己除外・距離昇順）。戻り値は knn_from_pairs と同じ"""
+        i, j, d2 = self.query_pairs(r)
+        return knn_from_pairs(len(self.p), i, j, d2, k)
+
+    def stats(self):
+        """再構築統計（毎回再構築するので rebuild_rate は常に 1）"""
+        return {"updates": self.n_builds, "rebuilds": self.n_builds,
+                "rebuild_rate": 1.0 if self.n_builds else 0.0}
+
+
+class VerletList:
+    """
+    Verlet 近傍リスト（スキン半径付き）
+    - r_cut + skin 以内の候補ペアを保持し、ステップ間で使い回す
+    - 最後の再構築からいずれかのロボットが skin/2 を超えて動いた時だけ空間ハッシュで再構築
+      （2台が逆向きに skin/2 ずつ動いても r_cut 以内のペアは候補から漏れない）
+    - SpatialHash と同じ build/query_pairs/knn インターフェース
+    """
+    def __init__(self, grid_size: int, r_cut: float, skin: float):
+        self.r_cut = float(r_cut); self.skin = float(skin)
+        self.hash = SpatialHash(grid_size, self.r_cut + self.skin)
+        self.p = np.zeros((0, 2), dtype=np.float32)
+        self.p_ref = None
+        self.n_updates = 0; self.n_rebuilds = 0
+
+    def build(self, p: np.ndarray):
+        """位置 p (n,2) を反映。必要な場合のみ候補ペアを再構築"""
+        self.p = p
+        self.n_updates += 1
+        if self.p_ref is None or len(p) != len(self.p_ref) or \
+                ((p - self.p_ref)**2).sum(axis=1).max(initial=0.0) > (self.skin / 2)**2:
+            self.hash.build(p)
+            self.ci, self.cj, _ = self.hash.query_pairs(self.r_cut + self.skin)
+            self.p_ref = p.copy()
+            self.n_rebuilds += 1
+
+    def query_pairs(self, r: float):
+        """半径 r (≤ r_cut) 以内のペアを候補リストから抽出（戻り値は SpatialHash と同じ）"""
+        if r > self.r_cut + 1e-9:
+            raise ValueError(f"query radius {r} exceeds Verlet cutoff {self.r_cut}")
+        d2 = ((self.p[self.ci] - self.p[self.cj])**2).sum(axis=1)
+        keep = d2 <= r * r
+        return self.ci[keep], self.cj[keep], d2[keep]
+
+    def knn(self, k: int, r: float):
+        """半径 r 以内の k 近傍（自己除外・距離昇順）"""
+        i, j, d2 = self.query_pairs(r)
+        return knn_from_pairs(len(self.p), i, j, d2, k)
+
+    def stats(self):
+        """再構築統計（rebuild_rate = 再構築回数 / 位置更新回数）。skin の調整用"""
+        return {"updates": self.n_updates, "rebuilds": self.n_rebuilds,
+                "rebuild_rate": self.n_rebuilds / self.n_updates if self.n_updates else 0.0}
+
+
+class OccupancyGrid:
+    """
+    整数占有グリッド: grid[y, x] = セル (x,y) を半径 r_occ 以内に含むロボット数（近似）
+    - ロボット位置を最寄りセルに丸め（binning）、円形スタンプを加算する
+    - update(): セルが変わったロボットだけスタンプを付け替える差分更新（O(移動台数 × スタンプ面積)）
+    - region（形状セルの bool グリッド）を与えると、占有された領域セル数 n_covered も差分で保持
+    """
+    def __init__(self, size: int, r_occ: float, region: np.ndarray = None):
+        self.size = size
+        rr = int(np.ceil(r_occ))
+        dy, dx = np.mgrid[-rr:rr + 1, -rr:rr + 1]
+        inside = dx**2 + dy**2 < r_occ**2
+        inside[rr, rr] = True  # 自セルは常に含む
+        self.offsets = np.stack([dx[inside], dy[inside]], axis=1)   # (K,2) (dx,dy)
+        self.region = region
+        self.grid = np.zeros((size, size), dtype=np.int32)
+        self.bins = np.zeros((0, 2), dtype=np.int64)
+        self.n_covered = 0
+
+    def _bin(self, p: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(p).astype(np.int64), 0, self.size - 1)
+
+    def _stamp(self, bins: np.ndarray, sign: int):
+        """bins (m,2) の各セルを中心にスタンプを sign だけ加算"""
+        if len(bins) == 0:
+            return
+        c = (bins[:, None, :] + self.offsets[None, :, :]).reshape(-1, 2)
+        ok = (c >= 0).all(axis=1) & (c < self.size).all(axis=1)
+        flat = c[ok, 1] * self.size + c[ok, 0]
+        g = self.grid.reshape(-1)
+        if self.region is None:
+            np.add.at(g, flat, sign)
+            return
+        # 影響セルの「占有/非占有」が反転した分だけ被覆数を更新
+        touched = np.unique(flat)
+        before = g[touched] > 0
+        np.add.at(g, flat, sign)
+        after = g[touched] > 0
+        in_region = self.region.reshape(-1)[touched]
+        self.n_covered += int((in_region & after).sum()) - int((in_region & before).sum())
+
+    def reset(self, p: np.ndarray):
+        """全ロボット位置からグリッドを作り直す"""
+        self.grid[:] = 0
+        self.n_covered = 0
+        self.bins = self._bin(p)
+        self._stamp(self.bins, +1)
+
+    def update(self, p: np.ndarray) -> int:
+        """セルが変わったロボットだけ差分更新。戻り値: 付け替えた台数"""
+        new = self._bin(p)
+        if len(new) != len(self.bins):
+            self.reset(p)
+            return len(new)
+        moved = (new != self.bins).any(axis=1)
+        self._stamp(self.bins[moved], -1)
+        self._stamp(new[moved], +1)
+        self.bins = new
+        return int(moved.sum())
+
+    def occupied(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """セル (xs, ys) が占有されているか（bool 配列）"""
+        return self.grid[ys, xs] > 0
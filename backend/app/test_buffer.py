@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+リプレイバッファのテスト
+リング上書き・サンプル形状・torch へのゼロコピー変換を確認
+"""
+
+import sys
+import os
+import tempfile
+import numpy as np
+import torch
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.buffer import ReplayBuffer, JointReplayBuffer, CompactReplayBuffer, SumTree, PrioritizedReplay
+from app.marl import MADDPGSystem
+from app.prefetch import BatchPrefetcher
+
+
+def _push_steps(buf, start, stop, obs_dim=5):
+    for t in range(start, stop):
+        buf.push(np.full(obs_dim, t, dtype=np.float32), np.array([t, -t], dtype=np.float32),
+                 np.array([t], dtype=np.float32), np.full(obs_dim, t + 1, dtype=np.float32),
+                 np.array([0.0], dtype=np.float32))
+
+
+def test_ring_buffer_wraps_and_samples():
+    """容量を超えると古い遷移から上書きされ、サンプルは各フィールド (B, dim) の float32 になるか"""
+    buf = ReplayBuffer(capacity=3000, seed=0)
+    _push_steps(buf, 0, 5000)
+    assert len(buf) == 3000
+    assert buf.nbytes_per_transition == (5 + 2 + 1 + 5 + 1) * 4
+
+    obs, act, rew, nobs, done = buf.sample(256)
+    assert obs.shape == (256, 5) and act.shape == (256, 2)
+    assert rew.shape == (256, 1) and done.shape == (256, 1)
+    for a in (obs, act, rew, nobs, done):
+        assert a.dtype == np.float32 and a.flags.c_contiguous
+    # 残っているのは直近 3000 遷移のみで、各行の整合性が保たれている
+    assert rew.min() >= 2000
+    np.testing.assert_array_equal(obs[:, 0], rew[:, 0])
+    np.testing.assert_array_equal(nobs[:, 0], rew[:, 0] + 1)
+
+    # torch.from_numpy はコピーせずにメモリを共有する
+    t = torch.from_numpy(obs)
+    assert t.data_ptr() == obs.ctypes.data
+
+
+def test_joint_buffer_joint_and_per_agent_sampling():
+    """結合バッファ: 1ステップ1行で格納し、同時刻の結合サンプルとエージェント別サンプルが取れるか"""
+    n, obs_dim = 4, 5
+    buf = JointReplayBuffer(capacity=100, n_agents=n, seed=0)
+    agent = np.arange(n, dtype=np.float32)
+    for t in range(150):
+        obs = np.repeat((t * 10 + agent)[:, None], obs_dim, axis=1)
+        buf.push(obs, np.stack([agent, -agent], axis=1), float(t), obs + 1, 0.0)
+    assert len(buf) == 100
+    assert buf.nbytes_per_transition == n * (5 + 2 + 1 + 5 + 1) * 4
+
+    # 結合サンプル: 各行は同一時刻の全エージェント分
+    obs, act, rew, nobs, done = buf.sample(64)
+    assert obs.shape == (64, n, obs_dim) and act.shape == (64, n, 2) and rew.shape == (64, n, 1)
+    t = rew[:, 0, 0]
+    assert t.min() >= 50
+    np.testing.assert_array_equal(obs[:, :, 0], t[:, None] * 10 + agent[None, :])
+    np.testing.assert_array_equal(rew[..., 0], np.repeat(t[:, None], n, axis=1))
+
+    # エージェント別サンプル: (n_agents, B, dim) で、i 番目は i 番目のエージェントの遷移
+    obs, act, rew, nobs, done = buf.sample_agents(64)
+    assert obs.shape == (n, 64, obs_dim) and done.shape == (n, 64, 1)
+    np.testing.assert_array_equal(obs[:, :, 0], rew[..., 0] * 10 + agent[:, None])
+    np.testing.assert_array_equal(act[:, :, 0], np.repeat(agent[:, None], 64, axis=1))
+    np.testing.assert_array_equal(nobs, obs + 1)
+    assert obs[1].flags.c_contiguous
+
+
+def test_memmap_buffer_matches_ram_and_resumes():
+    """ディスク常駐モード: RAMモードと同じサンプルを返し、flush 後に同じ path で再開できるか"""
+    with tempfile.TemporaryDirectory() as d:
+        ram = JointReplayBuffer(capacity=700, n_agents=3, seed=1)
+        disk = JointReplayBuffer(capacity=700, n_agents=3, seed=1, path=d, chunk_bytes=4096)
+        rng = np.random.default_rng(0)
+        for t in range(1000):
+            step = (rng.normal(size=(3, 5)), rng.normal(size=(3, 2)), rng.normal(size=3),
+                    rng.normal(size=(3, 5)), 0.0)
+            ram.push(*step); disk.push(*step)
+            if t % 97 == 0:
+                # ステージング中の行を含めても一致する
+                for a, b in zip(ram.sample_agents(32), disk.sample_agents(32)):
+                    np.testing.assert_array_equal(a, b)
+        assert 0 < disk.n_staged < len(disk.stage["obs"])
+        for a, b in zip(ram.sample(64), disk.sample(64)):
+            np.testing.assert_array_equal(a, b)
+        assert isinstance(disk.data["obs"], np.memmap)
+
+        disk.flush()
+        resumed = JointReplayBuffer(capacity=700, n_agents=3, seed=1, path=d)
+        assert (resumed.ptr, len(resumed)) == (ram.ptr, len(ram))
+        for k in ("obs", "act", "rew", "next_obs", "done"):
+            np.testing.assert_array_equal(np.asarray(resumed.data[k]), ram.data[k])
+        # 1行の形を指定して開くと meta.json と照合し、別構成（ロボット数・観測次元）なら再開しない
+        shapes = {"obs": (3, 5), "act": (3, 2), "rew": (3, 1), "next_obs": (3, 5), "done": (3, 1)}
+        JointReplayBuffer(capacity=700, n_agents=3, path=d, shapes=shapes)
+        for bad in [{**shapes, "obs": (3, 6), "next_obs": (3, 6)}, {k: (4, *v[1:]) for k, v in shapes.items()}]:
+            try:
+                JointReplayBuffer(capacity=700, n_agents=bad["obs"][0], path=d, shapes=bad)
+            except ValueError as e:
+                assert "shape mismatch" in str(e)
+            else:
+                raise AssertionError("mismatched replay was opened")
+        del disk, resumed
+
+
+def test_compact_buffer_matches_joint_across_episode_boundaries():
+    """観測共有バッファ: エピソード境界・リング上書きを跨いでも JointReplayBuffer と同じサンプルになるか"""
+    bufs = [JointReplayBuffer(capacity=300, n_agents=3, seed=2),
+            CompactReplayBuffer(capacity=300, n_agents=3, seed=2),
+            CompactReplayBuffer(capacity=300, n_agents=3, seed=2, obs_dtype=np.float16)]
+    rng = np.random.default_rng(0)
+    obs = rng.normal(size=(3, 40))
+    for t in range(1000):
+        nobs = rng.normal(size=(3, 40))
+        done = float(t % 37 == 36)
+        for b in bufs:
+            b.push(obs, np.full((3, 2), t), t, nobs, done)
+        # 長さ 37 のエピソードごとに reset（次の obs は直前の next_obs と無関係）
+        obs = rng.normal(size=(3, 40)) if done else nobs
+    ref, compact, half = bufs
+    assert 0 < len(compact.term) <= 300 // 37 + 1
+    assert ref.nbytes_per_transition / half.nbytes_per_transition > 3
+
+    for sample in ("sample", "sample_agents"):
+        r, c, h = (getattr(b, sample)(256) for b in bufs)
+        for a, b, x in zip(r, c, h):
+            np.testing.assert_array_equal(a, b)
+            assert x.dtype == np.float32
+            np.testing.assert_allclose(a, x, atol=1e-2)
+        # 境界の遷移（done=1）もサンプルに含まれている
+        assert r[4].any()
+
+    # 一周した後はフレームも他の列も確保し直さない（リングとして上書き）
+    # （参照を保持した同一オブジェクトのままか確認。アドレス比較は解放後の再利用で一致し得る）
+    frames, data = compact.frames, dict(compact.data)
+    for t in range(1000, 1700):
+        compact.push(obs, np.full((3, 2), t), t, rng.normal(size=(3, 40)), 0.0)
+    assert compact.frames is frames and len(frames) == 301
+    assert all(compact.data[k] is a for k, a in data.items())
+
+
+def test_sum_tree_matches_cumsum():
+    """和木: 一括更新後の総和と find が累積和の二分探索と一致するか（木の拡張・重複インデックス込み）"""
+    rng = np.random.default_rng(0)
+    tree = SumTree(3)
+    v = np.zeros((3, 700))
+    for _ in range(5):
+        idx = rng.integers(0, 700, size=(3, 128))
+        prio = rng.random((3, 128))
+        tree.update(idx, prio)
+        for r in range(3):
+            v[r, idx[r]] = prio[r]
+    np.testing.assert_allclose(tree.total, v.sum(axis=1))
+    np.testing.assert_allclose(tree.get(np.tile(np.arange(700), (3, 1))), v)
+    u = rng.random((3, 256)) * tree.total[:, None]
+    ref = np.stack([np.searchsorted(np.cumsum(v[r]), u[r], side="right") for r in range(3)])
+    np.testing.assert_array_equal(tree.find(u), ref)
+
+
+def test_prioritized_replay_sampling_and_system_update():
+    """優先度付き再生: 優先度に比例して引かれ、IS 重みが逆順になり、MADDPG の更新で優先度が変わるか"""
+    n, obs_dim = 2, 8
+    per = PrioritizedReplay(JointReplayBuffer(capacity=500, n_agents=n, seed=0), alpha=1.0, beta=1.0)
+    rng = np.random.default_rng(1)
+    for t in range(400):
+        per.push(rng.normal(size=(n, obs_dim)), rng.uniform(-1, 1, size=(n, 2)), 0.0,
+                 rng.normal(size=(n, obs_dim)), 0.0)
+    # エージェント0は遷移 7 だけ、エージェント1は遷移 11 だけを大きな優先度にする
+    idx = np.tile(np.arange(400), (n, 1))
+    td = np.ones((n, 400))
+    td[0, 7] = td[1, 11] = 400.0
+    per.update_priorities(idx, td)
+    (obs, act, rew, nobs, done), sidx, w = per.sample_agents(128)
+    assert obs.shape == (n, 128, obs_dim) and w.shape == (n, 128) and w.dtype == np.float32
+    assert (sidx[0] == 7).mean() > 0.4 and (sidx[1] == 11).mean() > 0.4
+    np.testing.assert_array_equal(obs[0, sidx[0] == 7], np.broadcast_to(per.data["obs"][7, 0], obs[0, sidx[0] == 7].shape))
+    assert w.max() == 1.0 and w[0, sidx[0] == 7].max() < w[0, sidx[0] != 7].min()
+
+    sys_ = MADDPGSystem(n_agents=n, obs_dim=obs_dim, batch=32, warmup_steps=100, capacity=500, prioritized=True)
+    for t in range(120):
+        sys_.push(rng.normal(size=(n, obs_dim)), rng.uniform(-1, 1, size=(n, 2)), -1.0,
+                  rng.normal(size=(n, obs_dim)), 0.0)
+    before = sys_.buffer.tree.total.copy()
+    assert sys_.step_update() is not None
+    assert sys_.td_error.shape == (n, 32)
+    assert not np.allclose(sys_.buffer.tree.total, before)
+
+
+def test_prioritized_replay_zero_priority_leaf():
+    """優先度 0 の葉が引かれても IS 重みが有限で、全体が 0 でも NaN にならないか"""
+    n = 2
+    per = PrioritizedReplay(JointReplayBuffer(capacity=64, n_agents=n, seed=0), alpha=1.0, beta=1.0, eps=0.0)
+    rng = np.random.default_rng(2)
+    for t in range(32):
+        per.push(rng.normal(size=(n, 4)), np.zeros((n, 2)), 0.0, rng.normal(size=(n, 4)), 0.0)
+    # 遷移 5 の優先度を 0 にし、find が（丸め誤差で）その葉に着地した場合を再現する
+    per.update_priorities(np.full((n, 1), 5), np.zeros((n, 1)))
+    assert (per.tree.get(np.full((n, 1), 5)) == 0).all()
+    find = per.tree.find
+    per.tree.find = lambda u: np.where(np.arange(u.shape[1]) % 2 == 0, 5, find(u))
+    _, sidx, w = per.sample_agents(16)
+    assert (sidx[:, ::2] == 5).all()
+    assert np.isfinite(w).all() and w.max() == 1.0 and (w > 0).all()
+    # 全優先度が 0 でも有限
+    per.tree.find = find
+    per.update_priorities(np.tile(np.arange(32), (n, 1)), np.zeros((n, 32)))
+    _, _, w = per.sample_agents(16)
+    assert np.isfinite(w).all()
+
+
+def test_prefetcher_feeds_tensors_and_system_update():
+    """先読み: ワーカーがテンソル化したバッチを順に返し、例外は get で送出、MADDPG の更新にも使えるか"""
+    buf = JointReplayBuffer(capacity=200, n_agents=3, seed=0)
+    _rng = np.random.default_rng(0)
+    for t in range(200):
+        buf.push(_rng.normal(size=(3, 8)), np.zeros((3, 2)), t, _rng.normal(size=(3, 8)), 0.0)
+    pf = BatchPrefetcher(lambda: buf.sample_agents(16), k=3)
+    for _ in range(5):
+        obs, act, rew, nobs, done = pf.get()
+        assert isinstance(obs, torch.Tensor) and obs.shape == (3, 16, 8) and obs.is_contiguous()
+    pf.close()
+    assert not pf.thread.is_alive()
+
+    def broken():
+        raise KeyError("boom")
+    pf = BatchPrefetcher(broken)
+    try:
+        pf.get()
+        assert False, "worker error must propagate"
+    except KeyError:
+        pass
+
+    for prioritized in [False, True]:
+        sys_ = MADDPGSystem(n_agents=3, obs_dim=8, batch=16, warmup_steps=50, capacity=500,
+                            prefetch=2, prioritized=prioritized)
+        for t in range(60):
+            sys_.push(_rng.normal(size=(3, 8)), np.zeros((3, 2)), -1.0, _rng.normal(size=(3, 8)), 0.0)
+            upd = sys_.step_update()
+        assert upd is not None and sys_.prefetcher.thread.is_alive()
+        sys_.close()
+        assert sys_.prefetcher is None
+
+
+def test_prior_column_round_trips():
+    """store_prior: 記録した Prior 行動がサンプルの末尾に返り、未記録の行は NaN。旧形式のディスクリプレイにも列を足して再開できるか"""
+    n = 3
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as d:
+        plain = JointReplayBuffer(capacity=50, n_agents=n, seed=0, path=d)
+        for t in range(30):
+            plain.push(np.full((n, 4), t), np.full((n, 2), t), t, np.full((n, 4), t + 1), 0.0)
+        plain.flush()
+        del plain
+        bufs = [JointReplayBuffer(capacity=50, n_agents=n, seed=0, store_prior=True),
+                CompactReplayBuffer(capacity=50, n_agents=n, seed=0, store_prior=True),
+                JointReplayBuffer(capacity=50, n_agents=n, seed=0, path=d, store_prior=True)]
+        assert len(bufs[2]) == 30
+        for t in range(30, 80):
+            prior = np.full((n, 2), -t) if t % 2 else None
+            for b in bufs[:2]:
+                b.push(np.full((n, 4), t), np.full((n, 2), t), t, np.full((n, 4), t + 1), 0.0, prior=prior)
+            bufs[2].push(np.full((n, 4), t), np.full((n, 2), t), t, np.full((n, 4), t + 1), 0.0, prior=prior)
+        for b in bufs:
+            batch = b.sample_agents(64)
+            assert len(batch) == 6 and batch[5].shape == (n, 64, 2)
+            t_ = batch[2][..., 0]
+            odd = t_ % 2 == 1
+            assert odd.any() and (~odd).any()
+            np.testing.assert_array_equal(batch[5][odd][:, 0], -t_[odd])
+            assert np.isnan(batch[5][~odd]).all()
+        bufs[2].flush()
+        resumed = JointReplayBuffer(capacity=50, n_agents=n, seed=0, path=d, store_prior=True)
+        np.testing.assert_array_equal(np.asarray(resumed.data["prior"]), np.asarray(bufs[2].data["prior"]))
+        del bufs, resumed
+
+
+if __name__ == "__main__":
+    test_ring_buffer_wraps_and_samples()
+    test_joint_buffer_joint_and_per_agent_sampling()
+    test_memmap_buffer_matches_ram_and_resumes()
+    test_compact_buffer_matches_joint_across_episode_boundaries()
+    test_sum_tree_matches_cumsum()
+    test_prioritized_replay_sampling_and_system_update()
+    test_prioritized_replay_zero_priority_leaf()
+    test_prefetcher_feeds_tensors_and_system_update()
+    test_prior_column_round_trips()
+    print("✅ リプレイバッファテスト完了")
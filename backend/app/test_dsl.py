@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+DSL ランタイムのテスト
+配列版 Prior（build_prior_fn_vec）がスカラー版（build_prior_fn）と同じ行動を返すか確認
+"""
+
+import sys
+import os
+import ast
+import numpy as np
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.env import SwarmEnv
+from app.llm.dsl_runtime import build_prior_fn, build_prior_fn_vec, build_reward_fn
+from app.llm.safe_expr import compile_reward_expr, ConstantFolder, SafeExprEvaluator, ALLOWED_NAMES
+
+
+PRIOR_DSL = {
+    "terms": [
+        {"op": "move_to_shape_center", "weight": 0.4},
+        {"op": "avoid_neighbors", "weight": 0.3, "radius": 3.0},
+        {"op": "keep_grid_uniformity", "weight": 0.5},
+        {"op": "synchronize_velocity", "weight": 0.2},
+        {"op": "explore_empty_cells", "weight": 0.6},
+        {"op": "unknown_op", "weight": 1.0},          # 未知の op は無視
+        {"op": "move_to_shape_center"},               # weight なし → 読み飛ばし
+    ],
+    "clamp": {"max_speed": 0.5},
+}
+
+
+def test_prior_vec_matches_scalar():
+    """全 op を含む Prior で、配列版とスカラー版（状態辞書経由）の行動が一致するか"""
+    rng = np.random.default_rng(0)
+    for max_speed in [0.5, 100.0]:
+        dsl = dict(PRIOR_DSL, clamp={"max_speed": max_speed})
+        scalar, vec = build_prior_fn(dsl), build_prior_fn_vec(dsl)
+        for n_robot, nhc in [(1, 80), (40, 80), (40, 0)]:
+            env = SwarmEnv(shape="circle", grid_size=64, n_robot=n_robot, nhc=nhc, seed=3)
+            for _ in range(3):
+                env.step(rng.uniform(-1, 1, size=(n_robot, 2)))
+            # 同じ乱数状態から、スナップショットと状態辞書（遅延ビュー）を作る
+            state = env.rng.bit_generator.state
+            snap = env.snapshot()
+            env.rng.bit_generator.state = state
+            dicts = env.get_state_dicts()
+
+            out = vec(snap)
+            ref = np.array([scalar(d) for d in dicts])
+            assert out.shape == (n_robot, 2) and out.dtype == np.float32
+            np.testing.assert_allclose(out, ref, rtol=1e-5, atol=1e-6)
+            if max_speed == 0.5:
+                assert (np.linalg.norm(out, axis=1) <= 0.5 + 1e-6).all()
+
+
+FORMULAS = [
+    "1.0*coverage - 0.5*collisions - 0.2*uniformity",
+    "max(0, coverage - 0.5) + min(variance, 0.1, uniformity)",
+    "clamp(coverage * (2*3 - max(1, 4)), -0.5, 0.5) - abs(uniformity - 0.2)",
+    "-(-coverage) / (1 + collisions) + 0.5*share",
+    "0.25",
+]
+
+
+def test_compiled_reward_matches_reference():
+    """コンパイル版の報酬式が AST 評価（参照実装）と一致し、配列なら要素ごとに評価されるか"""
+    rng = np.random.default_rng(0)
+    metrics = {"coverage": rng.uniform(0, 1, 50), "uniformity": rng.uniform(0, 1, 50),
+               "collisions": rng.integers(0, 4, 50).astype(float), "variance": rng.uniform(0, 1, 50),
+               "share": rng.dirichlet(np.ones(50))}
+    for formula in FORMULAS:
+        fn = compile_reward_expr(formula)
+        tree = ast.parse(formula, mode="eval")
+        ref = []
+        for k in range(50):
+            m = {name: float(metrics[name][k]) for name in ALLOWED_NAMES}
+            ref.append(SafeExprEvaluator(m).visit(tree))
+            assert fn(m) == ref[-1]
+        out = fn(metrics)
+        np.testing.assert_allclose(np.broadcast_to(out, (50,)), ref, rtol=1e-12)
+    # 不足メトリクスは 0、余分なキーは無視
+    assert compile_reward_expr("coverage + collisions")({"coverage": 0.5, "foo": 3}) == 0.5
+    # 定数部分式は畳み込まれ、0除算は評価時まで残る
+    folded = ConstantFolder().visit(ast.parse("coverage * (2*3 - max(1, 4)) + 1/0", mode="eval"))
+    assert ast.unparse(folded) == "coverage * 2 + 1 / 0"
+    # 配列でもスカラーと同じ約束: 0除算など有限でない要素は 0.0（スカラーは例外 → 呼び出し側で 0.0）
+    fn = compile_reward_expr("coverage / collisions - uniformity / 0")
+    with np.errstate(all="raise"):
+        out = fn({"coverage": np.array([0.0, 1.0, 2.0]), "collisions": np.array([0.0, 0.0, 2.0]),
+                  "uniformity": np.zeros(3)})
+    np.testing.assert_array_equal(out, [0.0, 0.0, 0.0])
+    np.testing.assert_array_equal(compile_reward_expr("coverage / collisions")(
+        {"coverage": np.array([0.0, 1.0, 3.0]), "collisions": np.array([0.0, 1.0, 2.0])}), [0.0, 1.0, 1.5])
+    # クランプ付きの報酬関数も配列を受け付ける
+    reward_fn = build_reward_fn({"formula": "4*coverage - 2", "clamp": {"min": -1.0, "max": 1.0}})
+    np.testing.assert_allclose(reward_fn({"coverage": np.array([0.0, 0.5, 1.0])}), [-1.0, 0.0, 1.0])
+    assert reward_fn({"coverage": 0.6}) == 4 * 0.6 - 2
+
+
+if __name__ == "__main__":
+    test_prior_vec_matches_scalar()
+    test_compiled_reward_matches_reference()
+    print("✅ DSL ランタイムテスト完了")
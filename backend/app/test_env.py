@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+SwarmEnv のテスト
+バッチ観測が参照実装（_obs_i）と同じレイアウト・内容になるか確認
+"""
+
+import sys
+import os
+import numpy as np
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.env import SwarmEnv
+from app.spatial import SpatialHash, OccupancyGrid
+
+
+def _check_cell_vectors(env, vecs, i):
+    """相対ベクトル + 自己位置 が形状セル上に乗っているか"""
+    pts = np.rint(vecs.reshape(-1, 2) + env.p[i]).astype(int)
+    assert (env.mask[pts[:, 1], pts[:, 0]] == 1).all()
+
+
+def test_observe_matches_obs_i():
+    """observe() の各ブロックが _obs_i と一致するか"""
+    for n_robot in [1, 2, 10, 40]:
+        env = SwarmEnv(shape="circle", grid_size=64, n_robot=n_robot, seed=7)
+        for _ in range(3):
+            env.step(np.random.default_rng(0).uniform(-1, 1, size=(n_robot, 2)))
+        obs = env.observe()
+        nb = 6 + 4 * env.nhn
+
+        assert obs.shape == (env.n, nb + 2 + 2 * env.nhc)
+        assert obs.dtype == np.float32
+        for i in range(env.n):
+            ref = env._obs_i(i)
+            assert ref.shape == obs[i].shape
+            # 自身状態・近傍ブロックは決定的なので完全一致
+            np.testing.assert_allclose(obs[i, :nb], ref[:nb], rtol=1e-5, atol=1e-5)
+            # 目標セル/未占有セルはランダムだが、形状セルへの相対ベクトルであること
+            _check_cell_vectors(env, obs[i, nb:], i)
+            cells = obs[i, nb + 2:].reshape(-1, 2) + env.p[i]
+            assert len(np.unique(np.rint(cells), axis=0)) == env.nhc
+
+
+def test_observe_padding_when_few_cells():
+    """形状セル数 < nhc の場合は不足分がゼロ埋めされるか"""
+    env = SwarmEnv(shape="circle", grid_size=8, n_robot=5, nhc=80, seed=3)
+    n_cells = int((env.mask == 1).sum())
+    obs = env.observe()
+    base = 6 + 4 * env.nhn + 2
+    assert n_cells < env.nhc
+    assert (obs[:, base + 2 * n_cells:] == 0).all()
+    assert (obs[:, base:base + 2 * n_cells] != 0).any()
+
+
+def test_spatial_hash_matches_brute_force():
+    """空間ハッシュの半径クエリ / k近傍が全ペア計算と一致するか（領域外の点も含む）"""
+    rng = np.random.default_rng(1)
+    p = rng.uniform(-5, 69, size=(300, 2)).astype(np.float32)
+    index = SpatialHash(64, 3.2)
+    index.build(p)
+    for r in [1.0, 3.2, 7.5]:
+        i, j, d2 = index.query_pairs(r)
+        d2_full = ((p[:, None, :] - p[None, :, :])**2).sum(axis=2)
+        bi, bj = np.where(np.triu(d2_full <= r * r, k=1))
+        np.testing.assert_array_equal(i, bi)
+        np.testing.assert_array_equal(j, bj)
+        np.testing.assert_allclose(d2, d2_full[bi, bj], rtol=1e-6)
+
+    idx, kd2, valid = index.knn(6, 3.2)
+    np.fill_diagonal(d2_full, np.inf)
+    ref = np.sort(d2_full, axis=1)[:, :6]
+    np.testing.assert_allclose(np.where(valid, kd2, np.inf), np.where(ref <= 3.2**2, ref, np.inf), rtol=1e-6)
+
+
+def test_step_collisions_match_brute_force():
+    """step の衝突ペアが全ペア計算と一致するか"""
+    env = SwarmEnv(shape="square", grid_size=64, n_robot=120, seed=5)
+    _, col_pairs = env.step(np.zeros((env.n, 2)))
+    d = np.linalg.norm(env.p[:, None, :] - env.p[None, :, :], axis=2)
+    bi, bj = np.where(np.triu(d < env.r_col, k=1))
+    assert col_pairs.shape == (len(bi), 2) and len(bi) > 0
+    np.testing.assert_array_equal(col_pairs, np.stack([bi, bj], axis=1))
+
+
+def test_verlet_matches_spatial_hash():
+    """Verlet リストモードが空間ハッシュモードと同じ軌道・観測を生成するか"""
+    envs = [SwarmEnv(shape="circle", grid_size=64, n_robot=60, seed=11, neighbor_mode=mode)
+            for mode in ["hash", "verlet"]]
+    rng = np.random.default_rng(2)
+    for _ in range(40):
+        acts = rng.uniform(-1, 1, size=(60, 2))
+        (o1, c1), (o2, c2) = [env.step(acts) for env in envs]
+        np.testing.assert_array_equal(envs[0].p, envs[1].p)
+        np.testing.assert_array_equal(o1[:, :6 + 4 * envs[0].nhn], o2[:, :6 + 4 * envs[1].nhn])
+        np.testing.assert_array_equal(c1, c2)
+    stats = envs[1].neighbor_stats()
+    assert stats["updates"] == 41
+    assert 0 < stats["rebuild_rate"] < 1
+
+
+def test_occupancy_grid_incremental():
+    """差分更新した占有グリッド/被覆数が、毎回作り直した場合と一致するか"""
+    env = SwarmEnv(shape="circle", grid_size=64, n_robot=50, seed=4)
+    rng = np.random.default_rng(3)
+    for _ in range(30):
+        env.step(rng.uniform(-1, 1, size=(env.n, 2)))
+        ref = OccupancyGrid(64, env.r_occ, region=env.shape_index.lookup)
+        ref.reset(env.p)
+        np.testing.assert_array_equal(env.occ.grid, ref.grid)
+        si = env.shape_index
+        assert env.occ.n_covered == int(env.occ.occupied(si.xs, si.ys).sum())
+        assert env.occupancy_coverage() == env.occ.n_covered / si.n_cells
+
+    # 観測の「未占有セル」ブロックは実際に未占有のセルだけを指す
+    obs = env.observe()
+    base = 6 + 4 * env.nhn + 2
+    cells = np.rint(obs[:, base:].reshape(env.n, -1, 2) + env.p[:, None, :]).astype(int)
+    assert not env.occ.grid[cells[..., 1], cells[..., 0]].any()
+
+
+def test_snapshot_and_state_dict_view():
+    """スナップショットの近傍表が全ペア計算と一致し、遅延ビューが旧形式の状態辞書を返すか"""
+    env = SwarmEnv(shape="circle", grid_size=64, n_robot=40, nhc=20, seed=5)
+    for _ in range(3):
+        env.step(np.random.default_rng(0).uniform(-1, 1, size=(env.n, 2)))
+    snap = env.snapshot()
+    assert len(snap) == env.n and snap.cells.shape == (20, 2)
+    # 近傍: 半径内・距離昇順・最大 nhn 個
+    d = np.linalg.norm(env.p[:, None] - env.p[None], axis=2)
+    np.fill_diagonal(d, np.inf)
+    for i in range(env.n):
+        ref = np.sort(d[i][d[i] <= env.r_neigh])[:env.nhn]
+        np.testing.assert_allclose(snap.nb_dist[i][snap.nb_valid[i]], ref, rtol=1e-4)
+    # observe と同じ近傍計算を使い回す（同じ位置なら再計算しない）
+    assert env.neighbors() is env.neighbors()
+
+    dicts = env.get_state_dicts()
+    assert len(dicts) == env.n
+    for i in [0, 17, -1]:
+        sd = dicts[i]
+        j = i % env.n
+        assert sd["position"] == env.p[j].tolist() and sd["velocity"] == env.v[j].tolist()
+        assert len(sd["neighbors"]) == snap.n_neighbors[j]
+        assert len(sd["nearby_cells"]) == 20
+        for nb in sd["neighbors"]:
+            assert abs(np.linalg.norm(np.array(nb["position"]) - env.p[j]) - nb["distance"]) < 1e-4
+    assert [sd["position"] for sd in dicts[:3]] == env.p[:3].tolist()
+
+    ev = env.snapshot(cells=False).to_json()
+    assert len(ev["neighbors"]) == env.n and len(ev["neighbors"][0]) == env.nhn
+    assert set(snap.summary()) >= {"n_robot", "mean_neighbors", "free_cell_ratio"}
+
+
+if __name__ == "__main__":
+    test_observe_matches_obs_i()
+    test_observe_padding_when_few_cells()
+    test_spatial_hash_matches_brute_force()
+    test_step_collisions_match_brute_force()
+    test_verlet_matches_spatial_hash()
+    test_occupancy_grid_incremental()
+    test_snapshot_and_state_dict_view()
+    print("✅ SwarmEnv テスト完了")
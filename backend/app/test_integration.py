@@ -131,8 +131,8 @@ def test_integration():
         nobs, col_pairs = env.step(acts)
         
         # メトリクス計算
-        M1 = coverage_m1(env.mask, env.p, env.ra)
-        M2 = uniformity_m2(env.p, env.mask)
+        M1 = coverage_m1(env.shape_index, env.p, env.ra)
+        M2 = uniformity_m2(env.p, env.shape_index)
         
         # Reward計算（LLM生成関数を使用）
         n_collisions = len(col_pairs)
@@ -142,13 +142,8 @@ def test_integration():
             "collisions": float(n_collisions)
         })
         
-        # バッファに格納
-        for i in range(env.n):
-            maddpg.buffers[i].push(
-                obs[i], acts[i],
-                np.array([rew_scalar], dtype=np.float32),
-                nobs[i], np.array([0.0], dtype=np.float32)
-            )
+        # バッファに格納（全エージェント分を1回で）
+        maddpg.push(obs, acts, rew_scalar, nobs, 0.0)
         
         # 更新（ウォームアップ後）
         upd = maddpg.step_update()
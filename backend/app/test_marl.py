@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+MADDPG のテスト
+積み重ねたネットワーク（EnsembleMLP）が各エージェントのネットワークと同じ出力になるか確認
+"""
+
+import sys
+import os
+import subprocess
+import tempfile
+import numpy as np
+import torch
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.marl import MADDPGSystem
+from app.np_policy import NumpyActor
+
+
+def test_ensemble_matches_agents_and_shares_memory():
+    """EnsembleMLP の一括順伝播が各エージェントの mlp と一致し、パラメータを共有しているか"""
+    torch.manual_seed(0)
+    n, obs_dim = 5, 12
+    sys_ = MADDPGSystem(n_agents=n, obs_dim=obs_dim, warmup_steps=10)
+    obs = torch.randn(n, 7, obs_dim)
+    act = torch.rand(n, 7, 2) * 2 - 1
+    with torch.no_grad():
+        a = sys_.actor(obs)
+        q = sys_.critic_t(torch.cat([obs, act], dim=2))
+        for i, ag in enumerate(sys_.agents):
+            torch.testing.assert_close(a[i], ag.actor(obs[i]), rtol=1e-5, atol=1e-6)
+            torch.testing.assert_close(q[i], ag.critic_t(torch.cat([obs[i], act[i]], dim=1)), rtol=1e-5, atol=1e-6)
+
+    # エージェント側の更新（オプティマイザの in-place 更新）が積み重ねた重みにも見える
+    w0 = sys_.agents[2].actor[0].weight
+    assert w0.data_ptr() == sys_.actor.weights[0][2].data_ptr()
+    with torch.no_grad():
+        w0.add_(1.0)
+    torch.testing.assert_close(sys_.actor.weights[0][2], w0)
+
+    # act は全エージェント分を1回で返し、決定的モードでは各エージェントの act と一致
+    o = np.random.default_rng(0).normal(size=(n, obs_dim)).astype(np.float32)
+    acts = sys_.act(o, deterministic=True)
+    assert acts.shape == (n, 2) and acts.dtype == np.float32
+    ref = np.concatenate([ag.act(o[i:i + 1], deterministic=True) for i, ag in enumerate(sys_.agents)])
+    np.testing.assert_allclose(acts, ref, rtol=1e-5, atol=1e-6)
+
+
+def test_batched_update_matches_per_agent_updates():
+    """一括更新（1グラフ + foreach Adam + foreach lerp）が、エージェントごとの個別更新と同じパラメータになるか"""
+    n, obs_dim, B = 4, 10, 32
+    systems = []
+    for batched in [True, False]:
+        torch.manual_seed(1)
+        systems.append(MADDPGSystem(n_agents=n, obs_dim=obs_dim, batch=B, warmup_steps=50,
+                                    capacity=500, batched_update=batched, prioritized=True))
+    rng = np.random.default_rng(0)
+    for t in range(60):
+        step = (rng.normal(size=(n, obs_dim)), rng.uniform(-1, 1, size=(n, 2)), rng.normal(size=n),
+                rng.normal(size=(n, obs_dim)), float(t % 20 == 19))
+        for s in systems:
+            s.push(*step)
+    for s in systems:
+        s.buffer.buffer.rng = np.random.default_rng(5)  # PrioritizedReplay の内側のバッファ
+    for _ in range(5):
+        u1, u2 = [s.step_update() for s in systems]
+        np.testing.assert_allclose(u1["loss_actor"], u2["loss_actor"], rtol=1e-4, atol=1e-6)
+        np.testing.assert_allclose(u1["loss_critic"], u2["loss_critic"], rtol=1e-4, atol=1e-6)
+    for name in ["actor", "critic", "actor_t", "critic_t"]:
+        for p1, p2 in zip(getattr(systems[0], name).parameters(), getattr(systems[1], name).parameters()):
+            torch.testing.assert_close(p1, p2, rtol=1e-4, atol=1e-6)
+    # 優先度（TD 誤差）も同じ
+    np.testing.assert_allclose(systems[0].buffer.tree.tree, systems[1].buffer.tree.tree, rtol=1e-4)
+
+
+def test_shared_mode_pools_agents():
+    """共有モード: ネットワークは1組で、全エージェントの遷移をまとめたバッチで学習し、埋め込みで行動が分かれるか"""
+    n, obs_dim, B = 6, 10, 16
+    rng = np.random.default_rng(0)
+    for embed_dim in [0, 4]:
+        torch.manual_seed(0)
+        sys_ = MADDPGSystem(n_agents=n, obs_dim=obs_dim, batch=B, warmup_steps=30, capacity=200,
+                            shared=True, agent_embed_dim=embed_dim, prioritized=True)
+        assert len(sys_.agents) == 1 and sys_.actor.weights[0].shape[0] == 1
+        n_params = sum(p.numel() for p in sys_.actor.parameters())
+        assert n_params == sum(p.numel() for p in sys_.agents[0].actor.parameters()) + n * embed_dim
+
+        # 全員同じ観測でも、埋め込みがあればエージェントごとに行動が変わる
+        o = np.tile(rng.normal(size=(1, obs_dim)), (n, 1)).astype(np.float32)
+        acts = sys_.act(o, deterministic=True)
+        assert acts.shape == (n, 2)
+        assert (len(np.unique(acts.round(6), axis=0)) > 1) == (embed_dim > 0)
+
+        for t in range(40):
+            sys_.push(rng.normal(size=(n, obs_dim)), rng.uniform(-1, 1, size=(n, 2)), -1.0,
+                      rng.normal(size=(n, obs_dim)), 0.0)
+        w_before = sys_.actor.weights[0].detach().clone()
+        e_before = None if embed_dim == 0 else sys_.critic.embed.weight.detach().clone()
+        upd = sys_.step_update()
+        assert upd is not None and sys_.td_error.shape == (n, B)
+        assert not torch.equal(w_before, sys_.actor.weights[0])
+        if embed_dim:
+            assert not torch.equal(e_before, sys_.critic.embed.weight)
+
+
+def test_numpy_actor_matches_torch():
+    """書き出した Actor の NumPy 推論が torch の決定的行動と一致し、torch を import しないか"""
+    n, obs_dim = 5, 12
+    o = np.random.default_rng(0).normal(size=(n, obs_dim)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as d:
+        for kw in [{}, {"shared": True}, {"shared": True, "agent_embed_dim": 3}]:
+            torch.manual_seed(0)
+            sys_ = MADDPGSystem(n_agents=n, obs_dim=obs_dim, **kw)
+            sys_.export_actor(os.path.join(d, "actor"))
+            actor = NumpyActor(os.path.join(d, "actor"))
+            assert isinstance(actor.weights[0], np.memmap)
+            np.testing.assert_allclose(actor.act(o), sys_.act(o, deterministic=True), rtol=1e-5, atol=1e-6)
+
+        # 単体エージェントの mlp からも書き出せる
+        ag = sys_.agents[0]
+        ag.export_actor(os.path.join(d, "single"))
+        single = NumpyActor(os.path.join(d, "single"))
+        x = np.concatenate([o, np.zeros((n, 3), dtype=np.float32)], axis=1)
+        np.testing.assert_allclose(single.act(x[:1]), ag.act(x[:1], deterministic=True), rtol=1e-5, atol=1e-6)
+
+    code = "import sys, app.np_policy; assert 'torch' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_prior_regularizer_uses_recorded_prior():
+    """記録した Prior 行動がサンプルと一緒に返り、Actor 損失に α * ||π(s) - πprior(s)||^2 が加わるか（未記録の行は除外）"""
+    n, obs_dim, B = 3, 8, 16
+    rng = np.random.default_rng(0)
+    steps = [(rng.normal(size=(n, obs_dim)), rng.uniform(-1, 1, size=(n, 2)), 0.0,
+              rng.normal(size=(n, obs_dim)), 0.0) for _ in range(40)]
+    priors = [rng.uniform(-1, 1, size=(n, 2)) if t % 3 else None for t in range(40)]
+    losses = {}
+    for record in [False, True]:
+        for batched in [True, False]:
+            torch.manual_seed(0)
+            sys_ = MADDPGSystem(n_agents=n, obs_dim=obs_dim, batch=B, warmup_steps=40, capacity=100,
+                                alpha_prior=1.0, batched_update=batched)
+            for step, prior in zip(steps, priors):
+                sys_.push(*step, prior=prior if record else None)
+            sys_.buffer.rng = np.random.default_rng(1)
+            with torch.no_grad():
+                obs_b, *_, prior_b = sys_.buffer.sample_agents(B)
+                a = sys_.actor(torch.from_numpy(obs_b)).numpy()
+            assert np.isnan(prior_b).any() and np.isnan(prior_b).all() != record
+            sys_.buffer.rng = np.random.default_rng(1)
+            losses[record, batched] = sys_.step_update()["loss_actor"]
+    # NaN（未記録）の行を除いた ||a - prior||^2 のエージェントごとの平均
+    valid = ~np.isnan(prior_b[..., 0])
+    sq = ((a - np.nan_to_num(prior_b))**2).sum(axis=2) * valid
+    reg = (sq.sum(axis=1) / (valid.sum(axis=1) * 2)).mean()
+    for batched in [True, False]:
+        assert np.isclose(losses[True, batched] - losses[False, batched], reg, rtol=1e-4)
+    assert np.isclose(losses[True, True], losses[True, False], rtol=1e-5)
+
+
+if __name__ == "__main__":
+    test_ensemble_matches_agents_and_shares_memory()
+    test_batched_update_matches_per_agent_updates()
+    test_shared_mode_pools_agents()
+    test_numpy_actor_matches_torch()
+    test_prior_regularizer_uses_recorded_prior()
+    print("✅ MADDPG テスト完了")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+メトリクス（M1/M2）のテスト
+KD-tree 版が全ペア距離による素朴な計算と一致するか確認
+"""
+
+import sys
+import os
+import numpy as np
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.env import SwarmEnv
+from app.metrics import coverage_m1, uniformity_m2, StreamingMetrics
+from app.shapes import get_shape_index
+
+
+def _nearest_brute(pts, rob):
+    d2 = ((pts[:, None, :] - rob[None, :, :])**2).sum(axis=2)
+    return np.sqrt(d2.min(axis=1)), d2.argmin(axis=1)
+
+
+def test_coverage_matches_brute_force():
+    """coverage_m1 が全ペア計算と一致するか（生マスク入力も可）"""
+    rng = np.random.default_rng(0)
+    for shape in ['circle', 'M']:
+        si = get_shape_index(shape, 64)
+        rob = rng.uniform(10, 54, size=(40, 2))
+        min_d, _ = _nearest_brute(si.cells.astype(np.float64), rob)
+        ref = float((min_d < max(1.0, 0.1 * 64 / 4)).sum()) / si.n_cells
+        assert coverage_m1(si, rob, 0.1) == ref
+        assert coverage_m1(si.mask, rob, 0.1) == ref
+    assert coverage_m1(si, np.zeros((0, 2)), 0.1) == 0.0
+
+
+def test_uniformity_exact_is_deterministic():
+    """exact=True は全セルを割り当てるので決定的で、全ペア計算と一致するか"""
+    rng = np.random.default_rng(1)
+    si = get_shape_index('square', 64)
+    rob = rng.uniform(10, 54, size=(30, 2))
+    _, nearest = _nearest_brute(si.cells.astype(np.float64), rob)
+    counts = np.bincount(nearest, minlength=len(rob))
+    ref = float(((counts - counts.mean())**2).sum() / len(rob))
+    assert uniformity_m2(rob, si, exact=True) == uniformity_m2(rob, si, exact=True)
+    np.testing.assert_allclose(uniformity_m2(rob, si, exact=True), ref)
+    # サンプリング版は sample_k 点の割当分散
+    assert uniformity_m2(rob, si, sample_k=si.n_cells) == uniformity_m2(rob, si, exact=True)
+
+
+def test_streaming_uniformity_matches_exact():
+    """増分更新した uniformity が、毎ステップ全セルを割り当て直した値と一致するか"""
+    env = SwarmEnv(shape="circle", grid_size=64, n_robot=30, seed=2)
+    sm = StreamingMetrics(env, exact=True)
+    rng = np.random.default_rng(0)
+    n_pts = len(sm.pts)
+    for _ in range(50):
+        _, col_pairs = env.step(rng.uniform(-1, 1, size=(env.n, 2)))
+        m = sm.update(col_pairs)
+        np.testing.assert_allclose(m["uniformity"], uniformity_m2(env.p, env.shape_index, exact=True))
+        assert m["coverage"] == env.occupancy_coverage()
+        assert m["collisions"] == len(col_pairs)
+    # 全点を毎回問い合わせるより少ない（前ステップの状態を再利用できている）
+    assert sm.n_refreshed < n_pts * 51
+
+    # 時間予算付きでも動作し、env.metrics は step ごとに更新される
+    env = SwarmEnv(shape="circle", grid_size=64, n_robot=30, seed=2)
+    env.metrics.budget_ms = 0.01
+    for _ in range(5):
+        env.step(rng.uniform(-1, 1, size=(env.n, 2)))
+    assert set(env.metrics.as_dict()) == {"coverage", "uniformity", "variance", "share", "collisions"}
+
+
+def test_local_metrics_match_brute_force():
+    """局所メトリクス（ロボットごと）が素朴なループ計算と一致し、報酬式で (n,) の報酬になるか"""
+    from app.llm.dsl_runtime import build_reward_fn
+    from app.llm.safe_expr import ALLOWED_NAMES
+    rng = np.random.default_rng(4)
+    env = SwarmEnv(shape="circle", grid_size=64, n_robot=80, seed=4)
+    for _ in range(5):
+        _, col_pairs = env.step(rng.uniform(-1, 1, size=(env.n, 2)))
+    assert len(col_pairs) > 0
+    local = env.metrics.local_dict()
+    region, grid, size = env.shape_index.lookup, env.occ.grid, env.grid_size
+    for i in range(env.n):
+        bx, by = np.clip(np.rint(env.p[i]).astype(int), 0, size - 1)
+        n_reg = n_cov = 0
+        for y in range(size):
+            for x in range(size):
+                if (x - bx)**2 + (y - by)**2 <= env.r_neigh**2 and region[y, x]:
+                    n_reg += 1
+                    n_cov += grid[y, x] > 0
+        assert np.isclose(local["coverage"][i], n_cov / max(n_reg, 1))
+        assert local["collisions"][i] == sum(i in pair for pair in col_pairs.tolist())
+    assert ((local["coverage"] > 0) & (local["coverage"] < 1)).any()
+    # 偏差の2乗の平均 = 全体の uniformity
+    assert np.isclose(local["uniformity"].mean(), env.metrics.uniformity)
+    np.testing.assert_array_equal(local["variance"], local["uniformity"])
+    # 占有率の合計は 1、全体辞書と同じキーを持つ
+    assert np.isclose(local["share"].sum(), 1.0)
+    np.testing.assert_allclose(local["share"], env.metrics.counts / env.metrics.counts.sum())
+    assert set(local) == set(env.metrics.as_dict()) == ALLOWED_NAMES
+
+    reward_fn = build_reward_fn({"formula": "1.0*coverage - 0.5*collisions - 0.01*uniformity"})
+    rew = reward_fn(local)
+    assert rew.shape == (env.n,) and (rew >= -1).all() and (rew <= 1).all()
+    ref = [reward_fn({k: float(v[i]) for k, v in local.items()}) for i in range(env.n)]
+    np.testing.assert_allclose(rew, ref)
+
+    # 局所メトリクスでの 0除算: スカラー版の 0.0 フォールバックと同じく NaN/inf ではなく 0.0
+    ratio_fn = build_reward_fn({"formula": "coverage / collisions"})
+    with np.errstate(all="raise"):
+        rew = ratio_fn({"coverage": np.array([0.0, 1.0, 0.5]), "collisions": np.array([0.0, 0.0, 1.0])})
+    np.testing.assert_array_equal(rew, [0.0, 0.0, 0.5])
+    assert ratio_fn({"coverage": 1.0, "collisions": 0.0}) == 0.0
+
+
+if __name__ == "__main__":
+    test_coverage_matches_brute_force()
+    test_uniformity_exact_is_deterministic()
+    test_streaming_uniformity_matches_exact()
+    test_local_metrics_match_brute_force()
+    print("✅ メトリクステスト完了")
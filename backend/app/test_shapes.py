@@ -12,7 +12,7 @@ import json
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.env import SwarmEnv
-from app.shapes import grid_mask
+from app.shapes import grid_mask, get_shape_index
 
 
 def test_shape_creation():
@@ -95,6 +95,70 @@ def test_shape_visualization():
             print(line)
 
 
+def test_shape_index():
+    """ShapeIndex が生マスクと整合し、(shape, grid_size) ごとに共有されるか"""
+    import numpy as np
+
+    for shape in ['circle', 'square', 'triangle', 'L', 'A', 'M', 'R']:
+        si = get_shape_index(shape, 64)
+        mask = grid_mask(shape, 64)
+        ys, xs = np.where(mask == 1)
+        assert si.n_cells == len(xs)
+        np.testing.assert_array_equal(si.xs, xs)
+        np.testing.assert_array_equal(si.ys, ys)
+        np.testing.assert_allclose(si.center, [xs.mean(), ys.mean()], rtol=1e-6)
+        np.testing.assert_array_equal(si.lookup, mask == 1)
+        assert (si.flat_index[ys, xs] == np.arange(len(xs))).all()
+        assert (si.flat_index[mask == 0] == -1).all()
+        # 同じキーなら同一オブジェクト（環境間で共有）
+        assert get_shape_index(shape, 64) is si
+        assert SwarmEnv(shape=shape, grid_size=64, n_robot=5).shape_index is si
+        assert not si.cells.flags.writeable
+
+
+def test_grid_mask_cache():
+    """grid_mask がメモ化され、ディスクキャッシュ（.npy）経由でも同じマスクを返すか"""
+    import tempfile
+    import numpy as np
+    from app.shapes import _cached_mask
+
+    m = grid_mask('M', 128)
+    assert grid_mask('M', 128) is m          # インメモリ LRU
+    assert not m.flags.writeable
+
+    with tempfile.TemporaryDirectory() as d:
+        m_disk = grid_mask('M', 128, cache_dir=d)
+        assert os.path.exists(os.path.join(d, 'mask_M_128.npy'))
+        _cached_mask.cache_clear()
+        np.testing.assert_array_equal(grid_mask('M', 128, cache_dir=d), m_disk)
+        np.testing.assert_array_equal(m_disk, m)
+
+
+def test_shape_sdf():
+    """SDF の符号が形状内外と一致し、円の外では中心距離 - 半径 に近いか"""
+    import numpy as np
+
+    si = get_shape_index('circle', 64)
+    assert ((si.sdf < 0) == si.lookup).all()
+    assert si.sdf.shape == (64, 64) and si.sdf_grad.shape == (2, 64, 64)
+
+    p = np.array([[32.0, 2.0], [60.0, 32.0], [5.0, 5.0]], dtype=np.float32)
+    d, grad = si.distance(p)
+    ref = np.linalg.norm(p - 32, axis=1) - 16
+    np.testing.assert_allclose(d, ref, atol=1.0)
+    # 勾配は形状から離れる向き（中心からの放射方向）
+    radial = (p - 32) / np.linalg.norm(p - 32, axis=1, keepdims=True)
+    assert ((grad * radial).sum(axis=1) > 0.9).all()
+
+    # 環境からの一括参照
+    env = SwarmEnv(shape='circle', grid_size=64, n_robot=20, seed=0)
+    d_env, g_env = env.shape_distance()
+    assert d_env.shape == (20,) and g_env.shape == (20, 2)
+
+
 if __name__ == "__main__":
     test_shape_creation()
     test_shape_visualization()
+    test_shape_index()
+    test_grid_mask_cache()
+    test_shape_sdf()
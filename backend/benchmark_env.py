@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+環境（SwarmEnv）のベンチマーク
+ロボット数を変えながら各処理の所要時間を計測する
+"""
+import time
+import numpy as np
+from app.env import SwarmEnv
+
+ROBOT_COUNTS = [10, 30, 100, 300, 1000]
+
+def make_env(n, **kw):
+    """
+    ロボット密度と近傍/占有半径（グリッド座標で一定）を保ったままスケールした環境
+    - r_sense / r_avoid はグリッド比でスケールされるため、grid_size に反比例させる
+    """
+    grid_size = max(64, int(np.sqrt(n) * 12))
+    return SwarmEnv(shape="circle", grid_size=grid_size, n_robot=n,
+                    r_sense=0.4 * 64 / grid_size, r_avoid=0.1 * 64 / grid_size, seed=0, **kw)
+
+def timeit(fn, repeat=5):
+    """fn を repeat 回実行し、中央値（ms）を返す"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)) * 1000
+
+def baseline_obs_i(env, i):
+    """
+    バッチ化前の _obs_i（比較基準）
+    - 未占有セルは占有グリッドを見ずに形状セル全体から抽出していた（free_cells() は呼ばない）
+    - 現行の env._obs_i は占有判定付きの参照実装なので、速度比較には使わない
+    """
+    self_state = np.array([*env.p[i], *env.v[i], 0, 0], dtype=np.float32)
+    rel = env.p - env.p[i]
+    dist_sq = (rel**2).sum(axis=1)
+    max_dist_sq = (env.rs * env.grid_size/8) ** 2
+    idx = np.argsort(dist_sq)
+    neigh = []
+    cnt = 0
+    for j in idx[1:]:
+        if dist_sq[j] <= max_dist_sq and cnt < env.nhn:
+            neigh += [rel[j,0], rel[j,1], env.v[j,0]-env.v[i,0], env.v[j,1]-env.v[i,1]]
+            cnt += 1
+    neigh += [0.0] * (4*env.nhn - len(neigh))
+    ys, xs = np.where(env.mask == 1)
+    k = env.rng.integers(0, len(xs))
+    tgt = np.array([xs[k]-env.p[i,0], ys[k]-env.p[i,1]], dtype=np.float32)
+    k2 = min(env.nhc, len(xs))
+    sel = env.rng.choice(len(xs), size=k2, replace=False)
+    unocc = []
+    for s in sel:
+        unocc += [xs[s]-env.p[i,0], ys[s]-env.p[i,1]]
+    unocc += [0.0] * (2*env.nhc - 2*k2)
+    return np.concatenate([self_state, np.array(neigh[:4*env.nhn], dtype=np.float32), tgt,
+                           np.array(unocc[:2*env.nhc], dtype=np.float32)], axis=0)
+
+def bench_observe():
+    """観測生成: バッチ化前のループ版（baseline_obs_i）とバッチ版（observe）の比較"""
+    print("\n【観測生成】baseline _obs_i ループ vs observe バッチ")
+    print(f"{'n_robot':>8} {'loop[ms]':>10} {'batch[ms]':>10} {'speedup':>8}")
+    for n in ROBOT_COUNTS:
+        env = make_env(n)
+        repeat = 3 if n <= 300 else 1
+        t_loop = timeit(lambda: np.array([baseline_obs_i(env, i) for i in range(env.n)]), repeat)
+        t_batch = timeit(env.observe, repeat)
+        print(f"{n:>8} {t_loop:>10.2f} {t_batch:>10.2f} {t_loop / t_batch:>7.1f}x")
+
+def bench_neighbors():
+    """近傍探索/衝突判定: 全ペア距離行列と空間ハッシュの比較"""
+    print("\n【近傍探索】全ペア (n,n) vs 空間ハッシュ")
+    print(f"{'n_robot':>8} {'dense[ms]':>10} {'hash[ms]':>10} {'step[ms]':>10}")
+    for n in ROBOT_COUNTS + [3000]:
+        env = make_env(n)
+        def dense():
+            d2 = ((env.p[:, None, :] - env.p[None, :, :])**2).sum(axis=2)
+            np.argsort(d2, axis=1)
+        def hashed():
+            env.index.build(env.p)
+            env.index.knn(env.nhn, env.r_neigh)
+            env.index.query_pairs(env.r_col)
+        acts = np.zeros((n, 2), dtype=np.float32)
+        t_dense = timeit(dense, 3 if n <= 1000 else 1)
+        t_hash = timeit(hashed, 3)
+        t_step = timeit(lambda: env.step(acts), 3)
+        print(f"{n:>8} {t_dense:>10.2f} {t_hash:>10.2f} {t_step:>10.2f}")
+
+def bench_verlet(n=1000, steps=100):
+    """Verlet リスト: skin ごとの再構築率と step 時間"""
+    print(f"\n【Verlet リスト】n_robot={n}, {steps}ステップ")
+    print(f"{'mode':>12} {'rebuild_rate':>13} {'step[ms]':>10}")
+    rng = np.random.default_rng(0)
+    acts = rng.uniform(-1, 1, size=(steps, n, 2)).astype(np.float32)
+    for mode, skin in [("hash", 0.0), ("verlet", 0.5), ("verlet", 1.0), ("verlet", 2.0)]:
+        env = make_env(n, neighbor_mode=mode, verlet_skin=skin)
+        t0 = time.perf_counter()
+        for t in range(steps):
+            env.step(acts[t])
+        t_step = (time.perf_counter() - t0) / steps * 1000
+        label = mode if mode == "hash" else f"{mode}({skin})"
+        print(f"{label:>12} {env.neighbor_stats()['rebuild_rate']:>13.3f} {t_step:>10.2f}")
+
+if __name__ == "__main__":
+    print("🔍 SwarmEnv ベンチマーク")
+    print("=" * 60)
+    bench_observe()
+    bench_neighbors()
+    bench_verlet()
+    print("=" * 60)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+方策推論のベンチマーク
+torch の Actor（MADDPGSystem.act）と、書き出した NumPy 版（NumpyActor）の
+起動時間（プロセス起動〜最初の行動まで）と1ステップあたりの推論時間を比較する
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from app.marl import MADDPGSystem
+from app.np_policy import NumpyActor
+
+ROBOT_COUNTS = [10, 30, 100, 300]
+OBS_DIM = 6 + 4 * 6 + 2 + 2 * 80   # SwarmEnv 既定（nhn=6, nhc=80）の観測次元
+
+# 別プロセスで「import → 重み読み込み → 1回推論」までを実行するコード
+STARTUP_NUMPY = """
+import numpy as np
+from app.np_policy import NumpyActor
+actor = NumpyActor({path!r})
+actor.act(np.zeros(({n}, {obs_dim}), dtype=np.float32))
+"""
+STARTUP_TORCH = """
+import numpy as np, torch
+from app.marl import MADDPGSystem
+sys_ = MADDPGSystem(n_agents={n}, obs_dim={obs_dim})
+sys_.actor.load_state_dict(torch.load({path!r}))
+sys_.act(np.zeros(({n}, {obs_dim}), dtype=np.float32), deterministic=True)
+"""
+
+def timeit(fn, repeat=200):
+    """fn を repeat 回実行し、中央値（ms）を返す"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)) * 1000
+
+def startup_time(code, repeat=3):
+    """別プロセスでの起動〜最初の推論までの時間（ms, 中央値）"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=cwd)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)) * 1000
+
+def bench_startup(d, n=30):
+    """起動時間: torch の import とモデル構築 vs NumPy 重みの mmap 読み込み"""
+    print(f"\n【起動時間】n_robot={n}（import 〜 最初の行動）")
+    sys_ = MADDPGSystem(n_agents=n, obs_dim=OBS_DIM)
+    npy = os.path.join(d, f"actor_{n}")
+    pt = os.path.join(d, f"actor_{n}.pt")
+    sys_.export_actor(npy)
+    torch.save(sys_.actor.state_dict(), pt)
+    t_torch = startup_time(STARTUP_TORCH.format(path=pt, n=n, obs_dim=OBS_DIM))
+    t_numpy = startup_time(STARTUP_NUMPY.format(path=npy, n=n, obs_dim=OBS_DIM))
+    print(f"{'torch[ms]':>10} {'numpy[ms]':>10} {'speedup':>8}")
+    print(f"{t_torch:>10.1f} {t_numpy:>10.1f} {t_torch / t_numpy:>7.1f}x")
+
+def bench_latency(d):
+    """1ステップの推論時間: 全エージェント分の決定的行動"""
+    print("\n【推論時間】1ステップ（全エージェント分）")
+    print(f"{'n_robot':>8} {'torch[ms]':>10} {'numpy[ms]':>10} {'speedup':>8}")
+    for n in ROBOT_COUNTS:
+        sys_ = MADDPGSystem(n_agents=n, obs_dim=OBS_DIM)
+        path = os.path.join(d, f"latency_{n}")
+        sys_.export_actor(path)
+        actor = NumpyActor(path)
+        obs = np.random.default_rng(0).normal(size=(n, OBS_DIM)).astype(np.float32)
+        t_torch = timeit(lambda: sys_.act(obs, deterministic=True))
+        t_numpy = timeit(lambda: actor.act(obs))
+        print(f"{n:>8} {t_torch:>10.3f} {t_numpy:>10.3f} {t_torch / t_numpy:>7.1f}x")
+
+if __name__ == "__main__":
+    print("🔍 方策推論ベンチマーク（torch vs NumPy 書き出し版）")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as d:
+        bench_startup(d)
+        bench_latency(d)
+    print("=" * 60)
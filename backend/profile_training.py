@@ -64,12 +64,7 @@ def profile_training():
         rew_scalar = -0.01 * n_collisions
         done = 0.0
         
-        for i in range(10):
-            maddpg.buffers[i].push(
-                obs[i], acts[i],
-                np.array([rew_scalar], dtype=np.float32),
-                nobs[i], np.array([done], dtype=np.float32)
-            )
+        maddpg.push(obs, acts, rew_scalar, nobs, done)
         push_time = time.perf_counter() - push_start
         timings["buffer_push"].append(push_time)
         
@@ -82,8 +77,8 @@ def profile_training():
         # 5. メトリクス計算（エピソード終了時のみ）
         if step == 99:
             metrics_start = time.perf_counter()
-            M1 = coverage_m1(env.mask, env.p, 0.1)
-            M2 = uniformity_m2(env.p, env.mask)
+            M1 = coverage_m1(env.shape_index, env.p, 0.1)
+            M2 = uniformity_m2(env.p, env.shape_index)
             metrics_time = time.perf_counter() - metrics_start
             timings["metrics_calc"].append(metrics_time)
         
@@ -170,6 +165,48 @@ def profile_training():
     
     print("=" * 60)
 
+def profile_prefetch(n_robot=30, steps=200, prefetch=2):
+    """
+    サンプル先読み（prefetch）の効果測定
+    ウォームアップ済みのバッファで「行動選択 → 環境ステップ → push → 更新」を回し、
+    同期サンプリング（prefetch=0）と先読みスレッドで1ステップ時間を比較する
+    """
+    print("\n" + "=" * 60)
+    print(f"🧵 サンプル先読みの効果（n_robot={n_robot}, {steps}ステップ, 毎ステップ更新）")
+    print("=" * 60)
+    results = {}
+    for k in [0, prefetch]:
+        env = SwarmEnv(shape="circle", grid_size=64, n_robot=n_robot, seed=1234)
+        obs = env.reset()
+        maddpg = MADDPGSystem(
+            n_agents=n_robot, obs_dim=obs.shape[1],
+            gamma=0.99, batch=128, capacity=100_000, warmup_steps=500, prefetch=k
+        )
+        # ウォームアップ分を先に貯める
+        for _ in range(500):
+            acts = np.random.uniform(-1, 1, size=(n_robot, 2)).astype(np.float32)
+            nobs, _ = env.step(acts)
+            maddpg.push(obs, acts, 0.0, nobs, 0.0)
+            obs = nobs
+        t_update, t_total = [], []
+        for _ in range(steps):
+            t0 = time.perf_counter()
+            acts = maddpg.act(obs)
+            nobs, col_pairs = env.step(acts)
+            maddpg.push(obs, acts, -0.01 * len(col_pairs), nobs, 0.0)
+            t1 = time.perf_counter()
+            maddpg.step_update()
+            t2 = time.perf_counter()
+            t_update.append(t2 - t1); t_total.append(t2 - t0)
+            obs = nobs
+        maddpg.close()
+        results[k] = (np.mean(t_update) * 1000, np.mean(t_total) * 1000)
+        label = "同期サンプリング" if k == 0 else f"先読み(K={k})"
+        print(f"{label:>14}: 更新 {results[k][0]:.2f}ms / 1ステップ {results[k][1]:.2f}ms")
+    print(f"1ステップ短縮: {results[0][1] - results[prefetch][1]:.2f}ms "
+          f"({(1 - results[prefetch][1] / results[0][1]) * 100:.1f}%)")
+
 if __name__ == "__main__":
     profile_training()
+    profile_prefetch()
 